@@ -1,5 +1,128 @@
+import time
+from typing import Iterable, List
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.decomposition import LatentDirichletAllocation
+from sklearn.feature_extraction.text import CountVectorizer
+
+from gpit.utils.logging import ANA_LOG
 
 
 class Model:
-    def __init__(self):
-        pass
+    """
+    Online (mini-batch variational) LDA over a sparse document-term matrix.
+
+    The texts are expected to be `process_text` outputs. The vocabulary is fixed by `fit`;
+    `fold_in` updates the topics with new documents (e.g. after a delta sync) through
+    `partial_fit`, so the model never has to be retrained from scratch.
+    """
+
+    def __init__(self, n_topics: int = 20, max_features: int = 50000, min_df: int = 5, max_df: float = 0.5,
+                 batch_size: int = 4096, max_iter: int = 5, n_jobs: int = -1, random_state: int = 0):
+        self.vectorizer = CountVectorizer(max_features=max_features, min_df=min_df, max_df=max_df,
+                                          token_pattern=r"(?u)\b[a-zA-Z][a-zA-Z0-9_]+\b", dtype=np.float32)
+        self.lda = LatentDirichletAllocation(n_components=n_topics, learning_method="online", batch_size=batch_size,
+                                             max_iter=max_iter, n_jobs=n_jobs, random_state=random_state)
+        self.seen_keys = set()
+        self.n_docs = 0
+        self.timings = {}
+
+    def _timed(self, stage, func, *args):
+        start_time = time.time()
+        result = func(*args)
+        self.timings[stage] = time.time() - start_time
+        return result
+
+    def _unseen(self, texts: List[str], keys: Iterable = None) -> List[str]:
+        if keys is None:
+            return list(texts)
+        keys = list(keys)
+        texts = [text for text, key in zip(texts, keys) if key not in self.seen_keys]
+        self.seen_keys.update(keys)
+        return texts
+
+    def fit(self, texts: List[str], keys: Iterable = None) -> "Model":
+        texts = self._unseen(texts, keys)
+        doc_term = self._timed("vectorize", self.vectorizer.fit_transform, texts)
+        self._timed("fit", self.lda.fit, doc_term)
+        self.n_docs = doc_term.shape[0]
+        ANA_LOG.info(f"gpit fitted {self.lda.n_components} topics on {doc_term.shape[0]} docs x {doc_term.shape[1]} terms "
+                     f"({doc_term.nnz} non-zeros): vectorize {self.timings['vectorize']:.2f}s, fit {self.timings['fit']:.2f}s")
+        return self
+
+    def fold_in(self, texts: List[str], keys: Iterable = None) -> int:
+        """Update the topics with documents that were not seen before; return how many were folded in."""
+        texts = self._unseen(texts, keys)
+        if not texts:
+            return 0
+        doc_term = self._timed("vectorize", self.vectorizer.transform, texts)
+        self.n_docs += doc_term.shape[0]
+        # the online update weighs a batch by corpus size / batch size, sklearn assumes 1e6 docs otherwise
+        self.lda.set_params(total_samples=self.n_docs)
+        self._timed("fold_in", self.lda.partial_fit, doc_term)
+        ANA_LOG.info(f"gpit folded {len(texts)} docs into the topics in {self.timings['fold_in']:.2f}s")
+        return len(texts)
+
+    def transform(self, texts: List[str]) -> np.ndarray:
+        doc_term = self.vectorizer.transform(texts)
+        return self._timed("transform", self.lda.transform, doc_term)
+
+    def assign_topics(self, df: pd.DataFrame, texts: List[str]) -> pd.DataFrame:
+        """Write the most likely topic, its probability and the topic's top words back as columns."""
+        doc_topic = self.transform(texts)
+        topics = doc_topic.argmax(axis=1)
+        top_words = [" ".join(words) for words in self.top_words(5)]
+        return df.assign(Topic=topics, TopicScore=doc_topic.max(axis=1).round(4),
+                         TopicWords=[top_words[topic] for topic in topics])
+
+    def top_words(self, n: int = 10) -> List[List[str]]:
+        vocab = self.vectorizer.get_feature_names_out()
+        return [vocab[np.argsort(-weights)[:n]].tolist() for weights in self.lda.components_]
+
+    def save(self, path: str):
+        joblib.dump(self, path)
+
+    @staticmethod
+    def load(path: str) -> "Model":
+        return joblib.load(path)
+
+
+def issue_texts(df: pd.DataFrame) -> List[str]:
+    """`process_text` of title and body, the input the topic model is trained on"""
+    from gpit.utils.utils import process_text
+    bodies = df["Body"].fillna("") if "Body" in df.columns else [""] * len(df)
+    return [process_text(f"{title} {body}") for title, body in zip(df["Title"].fillna(""), bodies)]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    # synthetic corpus benchmark: python -m gpit.analyzer.LDA.lda --n_docs 100000
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n_docs", type=int, default=100000)
+    parser.add_argument("--n_topics", type=int, default=20)
+    parser.add_argument("--n_jobs", type=int, default=-1)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vocab = np.array([f"term{i}" for i in range(20000)])
+    topic_terms = rng.dirichlet(np.full(len(vocab), 0.01), size=args.n_topics)
+    doc_topics = rng.dirichlet(np.full(args.n_topics, 0.1), size=args.n_docs)
+    lengths = rng.integers(20, 200, size=args.n_docs)
+    doc_ids = np.repeat(np.arange(args.n_docs), lengths)
+    token_topics = (rng.random(len(doc_ids))[:, None] > doc_topics.cumsum(axis=1)[doc_ids]).sum(axis=1)
+    token_topics = np.minimum(token_topics, args.n_topics - 1)
+    words = np.empty(len(doc_ids), dtype=np.int64)
+    for topic in range(args.n_topics):
+        mask = token_topics == topic
+        words[mask] = np.searchsorted(topic_terms[topic].cumsum(), rng.random(mask.sum()) * topic_terms[topic].sum())
+    words = np.minimum(words, len(vocab) - 1)
+    docs = [" ".join(doc) for doc in np.split(vocab[words], np.cumsum(lengths)[:-1])]
+
+    model = Model(n_topics=args.n_topics, n_jobs=args.n_jobs)
+    model.fit(docs[: args.n_docs * 9 // 10])
+    model.fold_in(docs[args.n_docs * 9 // 10:])
+    model.assign_topics(pd.DataFrame(index=range(args.n_docs)), docs)
+    print({stage: round(seconds, 2) for stage, seconds in model.timings.items()})
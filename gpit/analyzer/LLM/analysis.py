@@ -0,0 +1,228 @@
+"""
+Checkpointed LLM analysis of a cleaned dataset.
+
+Rows are streamed from the csv chunk by chunk, rendered with the prompt template (within the
+token budgets of a `PromptBuilder`) and generated in batches of prompts of similar length. Every finished row is appended to a JSON-lines checkpoint as soon as its batch returns,
+so an interrupted run resumes with the first unfinished row instead of re-generating finished ones.
+The checkpoint starts with the hash of the model, sampling parameters and prompt template it was generated with;
+a run with other ones starts a new checkpoint instead of mixing their outputs.
+The checkpoint is exported to csv when the run completes, with the rows that are still in the csv only.
+With the relevance scores of a triage stage (`cascade.py`), only the rows scoring at least the
+threshold are generated; the others are exported with their score and no analysis.
+A failing batch does not stop the run: its failing rows are isolated (see `inference.generate_isolated`),
+recorded with their error in a dead-letter JSON-lines file and exported without analysis; they are
+not checkpointed, so the next run tries them again. Rows that were only answered with a reduced
+`max_tokens` after timeouts are exported with their (possibly cut off) analysis and `Truncated` set,
+and dead-lettered like failures, so the next run generates them with the full budget.
+With `config.json_schema`, every output is parsed into one typed column per schema property
+(see `structured.py`); the raw output stays in the analysis column.
+"""
+import json
+import os
+import time
+from typing import Dict, Mapping, Sequence, Set, Union
+
+import pandas as pd
+
+from gpit.analyzer.LLM.cache import ResultCache, run_key
+from gpit.analyzer.LLM.engines import Engine
+from gpit.analyzer.LLM.inference import infer_batch
+from gpit.analyzer.LLM.inference_config import InferenceConfig
+from gpit.analyzer.LLM.prompts import PromptBuilder, length_buckets, render_prompts
+from gpit.analyzer.LLM.structured import column_name, parse_structured, schema_columns, typed_columns
+from gpit.utils.logging import ANA_LOG
+
+
+RESULT_COL = "Analysis"
+SAVED_COL = "TokensSaved"  # prompt tokens removed by log/code compression
+RELEVANCE_COL = "Relevance"  # triage score of a cascade
+TRUNCATED_COL = "Truncated"  # analysis generated with a reduced max_tokens after timeouts
+
+
+class ResultCheckpoint:
+    """
+    JSON-lines file of finished rows, one object per row, keyed by `key_col`. With a `run_key` (see `cache.run_key`)
+    the file starts with a {"run_key": ...} line, and a file of another run is discarded.
+    """
+
+    def __init__(self, path: str, key_col: str = "Link", run_key: str = None):
+        self.path = path
+        self.key_col = key_col
+        self.run_key = run_key
+        self.done: Set[str] = set()
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for number, line in enumerate(f):
+                try:
+                    record = json.loads(line)
+                except ValueError:  # torn write of an interrupted run: drop it and everything after
+                    break
+                if number == 0 and self.run_key is not None and record.get("run_key") != self.run_key:
+                    ANA_LOG.warning(f"gpit discards {self.path}: it was generated with another model, sampling "
+                                    f"parameters or prompt template")
+                    break
+                valid_size += len(line)
+                if "run_key" not in record:
+                    self.done.add(str(record[self.key_col]))
+        if valid_size < os.path.getsize(self.path):
+            with open(self.path, "r+b") as f:
+                f.truncate(valid_size)
+
+    def append(self, records: Sequence[Dict]):
+        new_file = not os.path.exists(self.path) or not os.path.getsize(self.path)
+        header = [{"run_key": self.run_key}] if self.run_key is not None and new_file else []
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(record, ensure_ascii=False) + "\n" for record in header + list(records))
+            f.flush()
+            os.fsync(f.fileno())
+        self.done.update(str(record[self.key_col]) for record in records)
+
+    def to_frame(self) -> pd.DataFrame:
+        if not os.path.exists(self.path) or not os.path.getsize(self.path):
+            return pd.DataFrame(columns=[self.key_col, RESULT_COL])
+        results = pd.read_json(self.path, lines=True, dtype=False)
+        if "run_key" in results.columns:
+            results = results[results["run_key"].isna()].drop(columns=["run_key"]).reset_index(drop=True)
+        return results
+
+
+def row_keys(chunk: pd.DataFrame, key_col: str) -> pd.Series:
+    """The key of every row of a chunk read from a csv, as text: its `key_col`, or its row number in the csv
+    when there is no such col"""
+    if key_col in chunk.columns:
+        return chunk[key_col].astype(str)
+    return pd.Series(chunk.index.astype(str), index=chunk.index)
+
+
+def analyze_csv(file: str, out_file: str, engine: Engine, config: InferenceConfig, template: Union[str, PromptBuilder],
+                key_col: str = "Link", keep_cols: Sequence[str] = ("Title",), batch_size: int = None,
+                chunksize: int = 20000, restart: bool = False, cache: ResultCache = None,
+                relevance: Mapping[str, float] = None, threshold: float = 0.5,
+                dead_letter: str = None) -> pd.DataFrame:
+    """
+    Generate `template` for every row of `file` that has no result yet and write all results to `out_file`.
+
+    Results are checkpointed to `out_file` with a `.jsonl` suffix after every batch of `batch_size` rows
+    (config.max_batch_size by default); `restart` discards the checkpoint; so does a change of the model,
+    sampling parameters or template.
+    With a `cache`, rows whose rendered prompt was generated before with the same config are not generated again.
+    The pending rows of every chunk are sorted by prompt length before batching, so a batch holds prompts of similar
+    length; `out_file` is still in the row order of `file`.
+    With `relevance` (the triage score of every key), only the rows scoring at least `threshold` are generated.
+    Rows that fail are appended to the JSON-lines `dead_letter` (`out_file` with a `_failed.jsonl` suffix by default)
+    with their error.
+    """
+    start_time = time.time()
+    builder = template if isinstance(template, PromptBuilder) else PromptBuilder(template)
+    checkpoint_file = os.path.splitext(out_file)[0] + ".jsonl"
+    dead_letter = dead_letter or os.path.splitext(out_file)[0] + "_failed.jsonl"
+    if restart:
+        for path in (checkpoint_file, dead_letter):
+            if os.path.exists(path):
+                os.remove(path)
+    checkpoint = ResultCheckpoint(checkpoint_file, key_col=key_col, run_key=run_key(config, **builder.params()))
+    batch_size = batch_size or config.max_batch_size
+    skipped = analyzed = tokens_saved = prompt_tokens = 0
+    engine_prompt_tokens, engine_cached_tokens = engine.prompt_tokens, engine.cached_tokens
+    generate_time = 0.0
+    below = []  # records of the rows under the relevance threshold, not checkpointed (the threshold may change)
+    failed = []  # records of the rows that failed, not checkpointed either (retried by the next run)
+    schema = config.json_schema
+    malformed = 0
+    for chunk in pd.read_csv(file, chunksize=chunksize):
+        keys = row_keys(chunk, key_col)
+        pending = ~keys.isin(checkpoint.done).to_numpy()
+        skipped += int((~pending).sum())
+        chunk, keys = chunk[pending], keys[pending]
+        extra = [col for col in keep_cols if col in chunk.columns and col != key_col]
+        records = chunk[extra].astype(object).where(chunk[extra].notna(), None).to_dict("records")
+        keys = keys.tolist()
+        if relevance is not None:
+            escalate = []
+            for key, record in zip(keys, records):
+                record[RELEVANCE_COL] = float(relevance.get(key, 1.0))  # unscored rows are escalated
+                escalate.append(record[RELEVANCE_COL] >= threshold)
+                if not escalate[-1]:
+                    below.append({key_col: key, **record, RESULT_COL: None})
+            chunk = chunk[escalate]
+            keys = [key for key, keep in zip(keys, escalate) if keep]
+            records = [record for record, keep in zip(records, escalate) if keep]
+        if chunk.empty:
+            continue
+        prompts, lengths, saved = builder.build(chunk)
+        tokens_saved += sum(saved)
+        prompt_tokens += sum(lengths)
+        for positions in length_buckets(lengths, batch_size):
+            batch_start = time.time()
+            failures = {}
+            outputs = infer_batch(engine, [prompts[i] for i in positions], config, batch_size=batch_size, cache=cache,
+                                  failures=failures)
+            generate_time += time.time() - batch_start
+            finished = [(i, output) for i, output in zip(positions, outputs)
+                        if output is not None and prompts[i] not in failures]
+            if schema is not None:
+                fields = [parse_structured(output, schema) for _, output in finished]
+                malformed += sum(value is None for value in fields)
+                fields = [{column_name(name): (value or {}).get(name) for name in schema["properties"]}
+                          for value in fields]
+            else:
+                fields = [{}] * len(finished)
+            checkpoint.append([{key_col: keys[i], **records[i], RESULT_COL: output, **row_fields, SAVED_COL: saved[i]}
+                               for (i, output), row_fields in zip(finished, fields)])
+            if len(finished) < len(positions):
+                errors = [(i, output, failures.get(prompts[i])) for i, output in zip(positions, outputs)
+                          if output is None or prompts[i] in failures]
+                with open(dead_letter, "a", encoding="utf-8") as f:
+                    f.writelines(json.dumps({key_col: keys[i], "error": error, "time": time.time()}) + "\n"
+                                 for i, _, error in errors)
+                failed += [{key_col: keys[i], **records[i], RESULT_COL: output, SAVED_COL: saved[i],
+                            **({TRUNCATED_COL: True} if output is not None else {})} for i, output, _ in errors]
+                ANA_LOG.warning(f"gpit could not (fully) analyze {len(errors)} rows, recorded in {dead_letter}")
+            analyzed += len(finished)
+            ANA_LOG.info(f"gpit analyzed {analyzed} rows ({skipped} already done) in {time.time() - start_time:.2f}s")
+
+    results = checkpoint.to_frame()
+    if below or failed:
+        results = pd.concat([results, pd.DataFrame(below + failed)], ignore_index=True)
+    if len(results):  # batches were generated longest first: restore the row order of `file`
+        header = pd.read_csv(file, nrows=0).columns
+        file_keys = pd.concat([row_keys(keys, key_col) for keys in pd.read_csv(
+            file, usecols=[key_col if key_col in header else header[0]], dtype=str, chunksize=chunksize)])
+        position = pd.Series(range(len(file_keys)), index=file_keys.to_numpy())
+        position = position[~position.index.duplicated()]
+        # checkpointed rows that are no longer in `file` (e.g. removed by new cleaning filters) are not exported
+        results = results[results[key_col].astype(str).isin(position.index)]
+        results = results.iloc[results[key_col].astype(str).map(position).argsort(kind="stable")]
+    if schema is not None:
+        results = typed_columns(results.reindex(columns=[*results.columns, *[
+            col for col in schema_columns(schema) if col not in results.columns]]), schema)
+    results.to_csv(out_file, index=False)
+    ANA_LOG.info(f"gpit wrote {len(results)} results to {out_file}: {analyzed} analyzed, {skipped} resumed "
+                 f"from the checkpoint, {len(failed)} failed in {time.time() - start_time:.2f}s")
+    if analyzed:
+        ANA_LOG.info(f"gpit generated {analyzed} analyses in {generate_time:.2f}s "
+                     f"({analyzed / max(generate_time, 1e-9):.2f} rows/s)")
+    if malformed:
+        ANA_LOG.warning(f"gpit could not parse {malformed} outputs as JSON of the schema, their fields are empty")
+    if relevance is not None:
+        ANA_LOG.info(f"gpit escalated {analyzed} of {analyzed + len(below)} new rows with a relevance >= {threshold} "
+                     f"({analyzed / max(analyzed + len(below), 1):.1%}, {skipped} resumed)")
+    if tokens_saved:
+        ANA_LOG.info(f"gpit compression saved {tokens_saved} of {prompt_tokens + tokens_saved} prompt tokens "
+                     f"({tokens_saved / (prompt_tokens + tokens_saved):.1%})")
+    engine_prompt_tokens = engine.prompt_tokens - engine_prompt_tokens
+    engine_cached_tokens = engine.cached_tokens - engine_cached_tokens
+    if engine_prompt_tokens:
+        ANA_LOG.info(f"gpit prefix cache: {engine_cached_tokens} of {engine_prompt_tokens} prompt tokens cached "
+                     f"({engine_cached_tokens / engine_prompt_tokens:.1%} hit rate, prefill of "
+                     f"{engine_cached_tokens} tokens saved; shared prompt prefix of {builder.prefix_tokens} tokens)")
+    if cache is not None:
+        stats = cache.stats()
+        ANA_LOG.info(f"gpit result cache: {stats['hits']} hits, {stats['misses']} misses "
+                     f"({stats['hit_rate']:.1%} hit rate), {stats['evicted']} evicted, "
+                     f"{stats['entries']} entries ({stats['size_mb']}MB)")
+    return results
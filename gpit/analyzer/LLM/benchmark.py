@@ -0,0 +1,200 @@
+"""
+Reproducible inference benchmarks.
+
+`sample_prompt_set` samples a fixed set of prompts from collected issues (seeded) and saves it as JSON,
+so every engine and config replays exactly the same prompts, also in later runs. `benchmark_suite`
+replays a prompt set through every combination of engine and config (ConfigManager presets, config
+files or model paths) and writes one JSON report with, per combination: model load time, throughput,
+p50/p95/p99 request latency, peak memory and the prefix and result cache hit rates.
+
+The `fake` engine (`engines.FakeEngine`) needs no GPU: its results measure the overhead of the harness
+itself (micro-batching, caching, worker I/O with `isolate`), e.g. on a CI machine.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import pandas as pd
+
+from gpit.analyzer.LLM.cache import ResultCache
+from gpit.analyzer.LLM.engines import ENGINES, Engine
+from gpit.analyzer.LLM.inference import infer_batch, resolve_config
+from gpit.analyzer.LLM.inference_config import InferenceConfig
+from gpit.analyzer.LLM.metrics import Histogram, LATENCY_BUCKETS
+from gpit.analyzer.LLM.prompts import PromptBuilder
+from gpit.analyzer.LLM.worker import SubprocessEngine
+from gpit.utils.logging import ANA_LOG
+
+
+def sample_prompt_set(file: str, out_file: str, builder: PromptBuilder, n: int = 200, seed: int = 0) -> List[str]:
+    """Render the prompts of `n` rows of `file` sampled with `seed`, and save them to the JSON `out_file`"""
+    df = pd.read_csv(file)
+    df = df.sample(n=min(n, len(df)), random_state=seed)
+    prompts = builder.build(df).prompts
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump({"source": file, "seed": seed, "prompts": prompts}, f)
+    return prompts
+
+
+def load_prompt_set(file: str) -> List[str]:
+    with open(file, encoding="utf-8") as f:
+        return json.load(f)["prompts"]
+
+
+def gpu_used_mb() -> Optional[float]:
+    """
+    Memory in use on all GPUs by any process (vLLM runs the model in an engine-core subprocess, not in this one),
+    from NVML when `pynvml` is installed, else from `torch.cuda.mem_get_info`; None without GPUs
+    """
+    try:
+        import pynvml
+    except ImportError:
+        pynvml = None
+    if pynvml is not None:
+        try:
+            pynvml.nvmlInit()
+            try:
+                return sum(pynvml.nvmlDeviceGetMemoryInfo(pynvml.nvmlDeviceGetHandleByIndex(i)).used
+                           for i in range(pynvml.nvmlDeviceGetCount())) / 2 ** 20
+            finally:
+                pynvml.nvmlShutdown()
+        except pynvml.NVMLError:  # no NVML library or driver
+            pass
+    try:
+        import torch
+    except ImportError:
+        return None
+    if not torch.cuda.is_available():
+        return None
+    return sum(total - free for free, total in map(torch.cuda.mem_get_info, range(torch.cuda.device_count()))) / 2 ** 20
+
+
+def rss_mb(pid: int) -> Optional[float]:
+    """Current resident set size of process `pid` (from /proc, Linux), None when it can not be read"""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PeakMemory:
+    """
+    Peak memory while the `with` block runs: the RSS of this process and of the worker process of `engine` (if it
+    has one) and the memory in use on the GPUs (device-wide, see `gpu_used_mb`), sampled every `interval` seconds
+    by a thread.
+    Unlike `ru_maxrss` (the peak of the whole process lifetime), the peaks are those of the block only.
+    """
+
+    def __init__(self, engine: Engine, interval: float = 0.05):
+        self.engine = engine
+        self.interval = interval
+        self.peaks: Dict[str, float] = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _observe(self, key: str, value: Optional[float]):
+        if value is not None:
+            self.peaks[key] = max(self.peaks.get(key, 0.0), value)
+
+    def sample(self):
+        self._observe("rss_mb", rss_mb(os.getpid()))
+        process = getattr(self.engine, "process", None)  # the worker of a SubprocessEngine, while it runs
+        if process is not None:
+            self._observe("worker_rss_mb", rss_mb(process.pid))
+        self._observe("gpu_mb", gpu_used_mb())
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def __enter__(self) -> "PeakMemory":
+        self.sample()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+        self.sample()
+
+    def result(self) -> Dict[str, float]:
+        return {key: round(value, 1) for key, value in self.peaks.items()}
+
+
+def run_benchmark(engine: Engine, prompts: Sequence[str], config: InferenceConfig, batch_size: int = None,
+                  repeats: int = 1, cache: ResultCache = None) -> Dict[str, Any]:
+    """
+    Replay `prompts` `repeats` times through `engine` in micro-batches of `batch_size` (config.max_batch_size by
+    default); the latency of a request is the latency of its micro-batch.
+    """
+    prompts = list(prompts)
+    batch_size = batch_size or config.max_batch_size or len(prompts) or 1
+    start_time = time.perf_counter()
+    engine.ensure_loaded(config)
+    load_time = time.perf_counter() - start_time
+    latency = Histogram(LATENCY_BUCKETS)
+    prompt_tokens, cached_tokens = engine.prompt_tokens, engine.cached_tokens
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        for start in range(0, len(prompts), batch_size):
+            batch = prompts[start:start + batch_size]
+            batch_start = time.perf_counter()
+            infer_batch(engine, batch, config, batch_size=len(batch), cache=cache)
+            for _ in batch:
+                latency.observe(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start_time
+    prompt_tokens, cached_tokens = engine.prompt_tokens - prompt_tokens, engine.cached_tokens - cached_tokens
+    requests = len(prompts) * repeats
+    return {
+        "requests": requests,
+        "load_s": round(load_time, 3),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_requests_per_s": round(requests / max(elapsed, 1e-9), 2),
+        "throughput_prompt_tokens_per_s": round(prompt_tokens / max(elapsed, 1e-9), 1),
+        "latency_s": latency.summary(),
+        "prefix_cache_hit_rate": round(cached_tokens / prompt_tokens, 4) if prompt_tokens else None,
+        "result_cache": cache.stats() if cache is not None else None,
+    }
+
+
+def benchmark_suite(prompts: Sequence[str], engines: Sequence[str], configs: Sequence[Union[str, InferenceConfig]],
+                    out_file: str, batch_size: int = None, repeats: int = 2, isolate: bool = False,
+                    cache: bool = False) -> Dict[str, Any]:
+    """
+    `run_benchmark` of every engine (an `ENGINES` name) with every config, written to the JSON `out_file`.
+    With `cache`, every combination starts with an empty result cache, so later repeats hit it.
+    A combination that fails (e.g. its backend is not installed) is reported with its error.
+    """
+    for engine_name in engines:
+        assert engine_name in ENGINES, f"engine must be one of {list(ENGINES)} but got {engine_name}"
+    results = []
+    for engine_name in engines:
+        for model in configs:
+            config = resolve_config(model)
+            result = {"engine": engine_name, "config": model if isinstance(model, str) else config.model_path,
+                      "isolate": isolate, "batch_size": batch_size or config.max_batch_size}
+            engine = SubprocessEngine(ENGINES[engine_name]()) if isolate else ENGINES[engine_name]()
+            memory = PeakMemory(engine)
+            with tempfile.TemporaryDirectory() as cache_dir:
+                result_cache = ResultCache(os.path.join(cache_dir, "cache.sqlite")) if cache else None
+                try:
+                    with memory:
+                        result.update(run_benchmark(engine, prompts, config, batch_size=batch_size, repeats=repeats,
+                                                    cache=result_cache))
+                except Exception as e:
+                    result["error"] = f"{type(e).__name__}: {e}"
+                    ANA_LOG.warning(f"gpit benchmark of {engine_name} with {result['config']} failed: {result['error']}")
+                finally:
+                    engine.close()
+                    if result_cache is not None:
+                        result_cache.close()
+            result["peak_memory"] = memory.result()  # of this combination only
+            results.append(result)
+    report = {"prompts": len(prompts), "repeats": repeats, "results": results}
+    with open(out_file, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    return report
@@ -0,0 +1,104 @@
+"""
+Persistent, content-addressed cache of generated outputs.
+
+An output is stored under the sha256 of everything that determines it: the model and its dtype,
+the sampling parameters, the system message and the prompt. Parameters that only change how the
+model is served (parallelism, memory utilization, chunked prefill, prefix caching, server URL) are
+not part of the key, so changing them keeps the cache. Re-running an analysis
+therefore only generates the prompts that are new or changed. The cache is a single SQLite file,
+bounded in size by evicting the least recently used entries.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Tuple
+
+from gpit.analyzer.LLM.inference_config import InferenceConfig
+
+
+def run_key(config: InferenceConfig, **params) -> str:
+    """sha256 of the model and its dtype, the sampling parameters and the system message of `config`, and `params`"""
+    key = {"model_path": config.model_path, "dtype": config.dtype, **config.generate_params(), **params}
+    return hashlib.sha256(json.dumps(key, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+
+def cache_key(config: InferenceConfig, prompt: str) -> str:
+    return run_key(config, prompt=prompt)
+
+
+def _batches(items: List, size: int = 500) -> Iterable[List]:
+    # stay below SQLite's limit of host parameters per statement
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class ResultCache:
+    """SQLite cache of `cache_key` -> output, holding at most `max_size_mb` of outputs"""
+
+    def __init__(self, path: str, max_size_mb: float = 1024):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.max_bytes = int(max_size_mb * 2 ** 20)
+        self.hits = self.misses = self.evicted = 0
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results "
+                        "(key TEXT PRIMARY KEY, output TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.db.commit()
+
+    def __len__(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    @property
+    def size(self) -> int:
+        return self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+
+    def get_many(self, keys: List[str]) -> Dict[str, str]:
+        """Cached outputs of the keys that are in the cache (counted as hits, the others as misses)"""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        for batch in _batches(unique):
+            rows = self.db.execute(f"SELECT key, output FROM results WHERE key IN ({','.join('?' * len(batch))})", batch)
+            found.update(rows)
+        now = time.time()
+        self.db.executemany("UPDATE results SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+        self.db.commit()
+        hits = sum(key in found for key in keys)
+        self.hits += hits
+        self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items: List[Tuple[str, str]]):
+        now = time.time()
+        self.db.executemany("INSERT OR REPLACE INTO results (key, output, size, last_used) VALUES (?, ?, ?, ?)",
+                            [(key, output, len(output.encode("utf-8")), now) for key, output in items])
+        self.db.commit()
+        self.evict()
+
+    def evict(self) -> int:
+        """Drop least recently used entries until the cache fits in its size bound; return how many were dropped"""
+        excess = self.size - self.max_bytes
+        if excess <= 0:
+            return 0
+        victims, freed = [], 0
+        for key, size in self.db.execute("SELECT key, size FROM results ORDER BY last_used"):
+            if freed >= excess:
+                break
+            victims.append(key)
+            freed += size
+        for batch in _batches(victims):
+            self.db.execute(f"DELETE FROM results WHERE key IN ({','.join('?' * len(batch))})", batch)
+        self.db.commit()
+        self.evicted += len(victims)
+        return len(victims)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evicted": self.evicted, "entries": len(self), "size_mb": round(self.size / 2 ** 20, 2)}
+
+    def close(self):
+        self.db.close()
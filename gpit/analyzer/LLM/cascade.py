@@ -0,0 +1,146 @@
+"""
+Relevance triage, the first stage of a two-stage analysis.
+
+Most cleaned issues turn out to be unrelated to memory, so instead of analyzing every issue with the
+large model, a cheap scorer first rates the relevance of every issue (0 to 1): `KeywordScorer` matches
+weighted memory keywords locally, `LLMScorer` asks a small model (e.g. the `qwen_small` config) for a
+score with a few output tokens. `triage_csv` checkpoints the scores, and `analysis.analyze_csv` only
+escalates the issues scoring at least the threshold to the analysis model.
+"""
+import math
+import os
+import re
+import time
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+from gpit.analyzer.LLM.analysis import RELEVANCE_COL, ResultCheckpoint, row_keys
+from gpit.analyzer.LLM.cache import ResultCache
+from gpit.analyzer.LLM.compress import LogCompressor
+from gpit.analyzer.LLM.engines import Engine
+from gpit.analyzer.LLM.inference import infer_batch
+from gpit.analyzer.LLM.inference_config import InferenceConfig
+from gpit.analyzer.LLM.prompts import PromptBuilder, text_fields
+from gpit.utils.logging import ANA_LOG
+
+
+# lower-case phrase -> weight, found anywhere in the text; a weight of 2 alone is a relevance of 0.63, 1 alone 0.39
+MEMORY_KEYWORDS = {
+    "out of memory": 2.0, "outofmemoryerror": 2.0, "memory leak": 2.0, "leaks memory": 2.0, "allocator": 2.0,
+    "fragmentation": 2.0, "empty_cache": 2.0, "memory_allocated": 2.0, "memory_reserved": 2.0,
+    "memory": 1.0, "kv cache": 1.0, "gpu_memory_utilization": 1.0, "swap": 1.0, "peak mem": 1.0, "malloc": 1.0,
+}
+# short words only found as whole words ("oom" but not "room")
+MEMORY_WORDS = {"oom": 2.0, "vram": 1.0, "rss": 1.0}
+TRIAGE_TEMPLATE = """Is the following issue about memory (e.g. out-of-memory errors, memory leaks, high or growing memory usage)?
+Answer with a single score from 0 (unrelated) to 10 (certainly about memory).
+
+Title: {title}
+Body: {body}
+/no_think"""  # Qwen3: answer without a thinking block, which would not fit the few output tokens
+TRIAGE_BUDGETS = {"title": 64, "body": 384}
+TRIAGE_MAX_TOKENS = 16
+SCORE_PATTERN = re.compile(r"\d+(\.\d+)?")
+
+
+def parse_score(output: str) -> Optional[float]:
+    """The 0-10 score of a triage answer as a relevance in [0, 1], None when the answer has no score"""
+    answer = re.sub(r"<think>.*?(</think>|$)", "", output, flags=re.DOTALL)
+    match = SCORE_PATTERN.search(answer)
+    return min(1.0, max(0.0, float(match.group()) / 10)) if match else None
+
+
+class KeywordScorer:
+    """Relevance 1 - exp(-w / scale) of the summed weights w of the keywords and words found in a row's text"""
+
+    def __init__(self, keywords: Dict[str, float] = None, words: Dict[str, float] = None,
+                 text_cols=("title", "body", "code"), scale: float = 2.0):
+        self.keywords = {keyword.lower(): weight for keyword, weight in (keywords or MEMORY_KEYWORDS).items()}
+        self.words = {word.lower(): weight for word, weight in (words or MEMORY_WORDS).items()}
+        self.word_pattern = re.compile(r"\b(" + "|".join(map(re.escape, self.words)) + r")\b") if self.words else None
+        self.text_cols = text_cols
+        self.scale = scale
+
+    def score(self, text: str) -> float:
+        text = text.lower()
+        # substring search is much faster than a regex of alternatives on long logs
+        weight = sum(weight for keyword, weight in self.keywords.items() if keyword in text)
+        if self.word_pattern is not None:
+            weight += sum(self.words[word] for word in set(self.word_pattern.findall(text)))
+        return round(1 - math.exp(-weight / self.scale), 4)
+
+    def __call__(self, df: pd.DataFrame) -> List[float]:
+        fields = text_fields(df)
+        cols = [fields[col] for col in self.text_cols if col in fields.columns]
+        texts = cols[0].str.cat(cols[1:], sep="\n") if cols else pd.Series("", index=df.index)
+        return [self.score(text) for text in texts]
+
+    def close(self):
+        pass
+
+
+class LLMScorer:
+    """
+    Relevance scored by a (small) model with `TRIAGE_MAX_TOKENS` output tokens; answers without a score are
+    escalated (relevance 1), prompts that failed score None
+    """
+
+    def __init__(self, engine: Engine, config: InferenceConfig, template: str = TRIAGE_TEMPLATE,
+                 budgets: Dict[str, int] = None, cache: ResultCache = None):
+        self.engine = engine
+        self.config = config
+        self.builder = PromptBuilder(template, budgets=budgets or TRIAGE_BUDGETS, compressor=LogCompressor())
+        self.cache = cache
+        self.unparsed = 0
+
+    def __call__(self, df: pd.DataFrame) -> List[float]:
+        prompts, _, _ = self.builder.build(df)
+        failures = {}
+        outputs = infer_batch(self.engine, prompts, self.config, cache=self.cache, failures=failures)
+        scores = [None if prompt in failures else parse_score(output) for prompt, output in zip(prompts, outputs)]
+        self.unparsed += sum(score is None for prompt, score in zip(prompts, scores) if prompt not in failures)
+        return [None if prompt in failures else 1.0 if score is None else score
+                for prompt, score in zip(prompts, scores)]
+
+    def close(self):
+        self.engine.close()
+
+
+def triage_csv(file: str, out_file: str, scorer, key_col: str = "Link", chunksize: int = 20000,
+               restart: bool = False) -> pd.Series:
+    """
+    Relevance of every row of `file` (indexed by `key_col` as text), scored by `scorer` (a callable
+    DataFrame -> scores) and checkpointed to the JSON-lines `out_file`, so only new rows are scored again.
+    Rows the scorer failed on (score None) are escalated (relevance 1) but not checkpointed, so the next run
+    scores them again.
+    """
+    start_time = time.time()
+    if restart and os.path.exists(out_file):
+        os.remove(out_file)
+    checkpoint = ResultCheckpoint(out_file, key_col=key_col)
+    scored = 0
+    failed = {}
+    for chunk in pd.read_csv(file, chunksize=chunksize):
+        keys = row_keys(chunk, key_col)
+        pending = ~keys.isin(checkpoint.done).to_numpy()
+        chunk, keys = chunk[pending], keys[pending]
+        if chunk.empty:
+            continue
+        scores = scorer(chunk)
+        checkpoint.append([{key_col: key, RELEVANCE_COL: score} for key, score in zip(keys, scores)
+                           if score is not None])
+        failed.update((key, 1.0) for key, score in zip(keys, scores) if score is None)
+        scored += len(chunk)
+    elapsed = time.time() - start_time
+    ANA_LOG.info(f"gpit triage scored {scored} rows in {elapsed:.2f}s ({scored / max(elapsed, 1e-9):.1f} rows/s)"
+                 + (f", {scorer.unparsed} answers without a score escalated" if getattr(scorer, "unparsed", 0) else "")
+                 + (f", {len(failed)} failed rows escalated" if failed else ""))
+    results = checkpoint.to_frame()
+    relevance = pd.Series(dtype=float)
+    if not results.empty:
+        results = results.drop_duplicates(key_col, keep="last")
+        relevance = pd.Series(results[RELEVANCE_COL].to_numpy(dtype=float), index=results[key_col].astype(str))
+    if failed:
+        relevance = pd.concat([relevance, pd.Series(failed, dtype=float)])
+    return relevance
@@ -0,0 +1,99 @@
+"""
+Multi-turn chat on a warm engine.
+
+`ChatSession` keeps the conversation as a list of chat messages and sends all of it with every question,
+so the model answers with the history in context. The engine is loaded once, by `load` or on the first question,
+and stays loaded until `close`; because every turn starts with the messages of the turn before, the engine's
+prefix cache (`enable_prefix_caching`) only has to prefill the new messages. Every turn records its TTFT,
+latency, throughput and prefix cache hits, e.g. for the interactive mode of `run_inference`.
+"""
+import asyncio
+import time
+from typing import Any, AsyncIterator, Dict, List, Union
+
+from gpit.analyzer.LLM.engines import Engine
+from gpit.analyzer.LLM.inference import resolve_config, stream
+from gpit.analyzer.LLM.inference_config import InferenceConfig
+
+
+class ChatSession:
+    """
+    A conversation with `model` on `engine`. With `max_turns`, only the last `max_turns` questions and answers are
+    sent (older turns fall out of the context, and out of the shared prefix).
+    """
+
+    def __init__(self, engine: Engine, model: Union[str, InferenceConfig], max_turns: int = None, **kwargs):
+        assert max_turns is None or max_turns > 0, f"max_turns must be positive but got {max_turns}"
+        self.engine = engine
+        self.config = resolve_config(model, **kwargs)
+        self.max_turns = max_turns
+        self.messages: List[Dict[str, str]] = []
+        self.turns: List[Dict[str, Any]] = []
+
+    def load(self):
+        """Load the engine now, in the calling thread (backends such as sgl.Engine have to load in the main thread)"""
+        self.engine.ensure_loaded(self.config)
+
+    def context(self, question: str) -> List[Dict[str, str]]:
+        """The messages sent for `question`: the history (its last `max_turns` turns) and the question"""
+        history = self.messages[-2 * self.max_turns:] if self.max_turns else self.messages
+        return history + [{"role": "user", "content": question}]
+
+    async def stream(self, question: str) -> AsyncIterator[str]:
+        """Yield the text deltas of the answer to `question`; a complete answer is added to the history"""
+        messages = self.context(question)
+        self.load()  # before the latency is measured
+        prompt_tokens, cached_tokens = self.engine.prompt_tokens, self.engine.cached_tokens
+        start, delta_times, answer = time.perf_counter(), [], []
+        async for delta in stream(self.engine, messages, self.config):
+            delta_times.append(time.perf_counter())
+            answer.append(delta)
+            yield delta
+        self.messages = messages + [{"role": "assistant", "content": "".join(answer)}]
+        self.turns.append(turn_stats(start, delta_times, self.engine.prompt_tokens - prompt_tokens,
+                                     self.engine.cached_tokens - cached_tokens))
+
+    def ask(self, question: str) -> str:
+        """The complete answer to `question` (non-streaming)"""
+
+        async def run():
+            return "".join([delta async for delta in self.stream(question)])
+
+        return asyncio.run(run())
+
+    def reset(self):
+        """Start a new conversation; the engine (and its prefix cache) stays warm"""
+        self.messages = []
+
+    def summary(self) -> Dict[str, Any]:
+        prompt_tokens = sum(turn["prompt_tokens"] for turn in self.turns)
+        cached_tokens = sum(turn["cached_tokens"] for turn in self.turns)
+        return {"turns": len(self.turns), "latency_s": round(sum(turn["latency_s"] for turn in self.turns), 3),
+                "prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens,
+                "prefix_cache_hit_rate": round(cached_tokens / prompt_tokens, 4) if prompt_tokens else None}
+
+    def close(self):
+        self.engine.close()
+
+
+def turn_stats(start: float, delta_times: List[float], prompt_tokens: int, cached_tokens: int) -> Dict[str, Any]:
+    """Latency of a turn sent at `start` whose deltas arrived at `delta_times`, and its prompt tokens"""
+    stats = {"ttft_s": round(delta_times[0] - start, 3) if delta_times else None,
+             "latency_s": round((delta_times[-1] if delta_times else time.perf_counter()) - start, 3),
+             "tokens_per_s": None, "prompt_tokens": prompt_tokens, "cached_tokens": cached_tokens}
+    if len(delta_times) > 1 and delta_times[-1] > delta_times[0]:
+        stats["tokens_per_s"] = round((len(delta_times) - 1) / (delta_times[-1] - delta_times[0]), 1)
+    return stats
+
+
+def format_turn(turn: Dict[str, Any]) -> str:
+    """e.g. "TTFT 0.12s, 1.30s, 45.2 tokens/s, prefix cache 86% (1200 of 1400 prompt tokens)" """
+    if turn["ttft_s"] is None:
+        return "no output"
+    parts = [f"TTFT {turn['ttft_s']:.2f}s", f"{turn['latency_s']:.2f}s"]
+    if turn["tokens_per_s"] is not None:
+        parts.append(f"{turn['tokens_per_s']:.1f} tokens/s")
+    if turn["prompt_tokens"]:
+        parts.append(f"prefix cache {turn['cached_tokens'] / turn['prompt_tokens']:.0%} "
+                     f"({turn['cached_tokens']} of {turn['prompt_tokens']} prompt tokens)")
+    return ", ".join(parts)
@@ -0,0 +1,183 @@
+"""
+Compression of logs and code pasted into issues, applied before prompting.
+
+Issue bodies are full of text that costs tokens without telling the analyzer anything: progress
+bars, thousands of repeated log lines, recursive stack frames and `collect_env`/`pip freeze`
+dumps. `LogCompressor` rewrites such text line by line:
+
+- progress bar updates keep their final state only
+- runs of repeated lines or blocks of lines (numbers ignored) keep their first and last repetition
+- a stack frame that already occurred in the text is dropped (with its source line)
+- a traceback with more than `max_frames` frames keeps its head and tail frames
+- environment reports keep their key lines, package lists the packages relevant to GPU issues
+"""
+import re
+from typing import List
+
+NUMBER_PATTERN = re.compile(r"\d+(\.\d+)?")
+PROGRESS_PATTERN = re.compile(r"\d+%\|[^|]*\|[^\[\]]*\[[^\]]*\]")  # tqdm: ` 45%|####      | 45/100 [00:01<00:02, ...]`
+FRAME_PATTERN = re.compile(
+    r'^\s*(File ".*", line \d+|at [\w$.<>]+\(.*\)$|#\d+\s+0x[0-9a-f]+|frame #\d+:)'
+)
+ENV_START_PATTERN = re.compile(r"^\s*(Collecting environment information|PyTorch version:|Versions of relevant libraries:)")
+ENV_KEY_PATTERN = re.compile(
+    r"^\s*(PyTorch version|Is debug build|CUDA used to build PyTorch|ROCM used to build PyTorch|OS|Python version"
+    r"|Is CUDA available|CUDA runtime version|GPU models and configuration|Nvidia driver version"
+    r"|cuDNN version|CPU|Architecture)\s*:"
+)
+KEY_VALUE_PATTERN = re.compile(r"^\s*[\w(][\w ()/.,\-]*:(\s|$)")
+# `[pip3] torch==2.1.0`, `torch==2.1.0`, `torch @ file:///...`, `torch  2.1.0  py3.10_cuda12.1  pytorch` (conda list)
+PACKAGE_PATTERN = re.compile(r"^\s*(\[(pip|pip3|conda)\]\s+\S.*|[\w.\-]+\s*==\s*\S+|[\w.\-]+ @ \S+"
+                             r"|[\w.\-]+\s+\d+\.\d[\w.+\-]*(\s+\S+){0,2})\s*$")
+KEEP_PACKAGES = re.compile(r"torch|cuda|cudnn|nvidia|nccl|triton|numpy|transformers|vllm|sglang|flash|xformers|jax"
+                           r"|tensorflow|onnx|rocm", re.IGNORECASE)
+
+
+def _normalized(line: str) -> str:
+    return NUMBER_PATTERN.sub("#", line.strip())
+
+
+def _last_progress(line: str) -> str:
+    """Only the final state of progress bars that were pasted as one line"""
+    bars = list(PROGRESS_PATTERN.finditer(line))
+    return line[bars[-2].end():] if len(bars) > 1 else line
+
+
+def _is_env_line(line: str) -> bool:
+    return bool(KEY_VALUE_PATTERN.match(line) or PACKAGE_PATTERN.match(line))
+
+
+class LogCompressor:
+    """
+    Args:
+        min_repeats: shortest run of repeated lines/blocks that is collapsed
+        max_block: longest block of lines (e.g. a frame and its source line) detected as repeating
+        max_frames: frames kept per traceback, half from its head and half from its tail
+        min_packages: shortest package list that is abbreviated
+    """
+
+    def __init__(self, min_repeats: int = 3, max_block: int = 4, max_frames: int = 16, min_packages: int = 8):
+        self.min_repeats = min_repeats
+        self.max_block = max_block
+        self.max_frames = max_frames
+        self.min_packages = min_packages
+
+    def __call__(self, text: str) -> str:
+        if not isinstance(text, str) or "\n" not in text and "\r" not in text:
+            return text
+        lines = [_last_progress(line.rsplit("\r", 1)[-1]) for line in text.split("\n")]
+        for step in (self.abbreviate_environment, self.abbreviate_packages, self.dedup_frames,
+                     self.collapse_repeats, self.cut_tracebacks):
+            lines = step(lines)
+        return "\n".join(lines)
+
+    def collapse_repeats(self, lines: List[str]) -> List[str]:
+        keys = [_normalized(line) for line in lines]
+        result, i = [], 0
+        while i < len(lines):
+            for size in range(1, self.max_block + 1):
+                block = keys[i:i + size]
+                if len(block) < size or not any(block):
+                    continue
+                repeats = 1
+                while keys[i + repeats * size:i + (repeats + 1) * size] == block:
+                    repeats += 1
+                if repeats >= self.min_repeats:
+                    last = i + (repeats - 1) * size
+                    result.extend(lines[i:i + size] + [f"[... repeated {repeats - 2} more times ...]"]
+                                  + lines[last:last + size])
+                    i += repeats * size
+                    break
+            else:
+                result.append(lines[i])
+                i += 1
+        return result
+
+    def dedup_frames(self, lines: List[str]) -> List[str]:
+        seen, result, dropped, skip_source = set(), [], 0, False
+        for line in lines:
+            if skip_source:  # the source line printed below a dropped Python frame
+                skip_source = False
+                if not FRAME_PATTERN.match(line) and line.startswith("    "):
+                    dropped += 1
+                    continue
+            if FRAME_PATTERN.match(line):
+                if line.strip() in seen:
+                    dropped += 1
+                    skip_source = line.lstrip().startswith("File ")
+                    continue
+                seen.add(line.strip())
+            if dropped:
+                result.append(f"[... {dropped} duplicate frame lines omitted ...]")
+                dropped = 0
+            result.append(line)
+        if dropped:
+            result.append(f"[... {dropped} duplicate frame lines omitted ...]")
+        return result
+
+    def cut_tracebacks(self, lines: List[str]) -> List[str]:
+        frames = [i for i, line in enumerate(lines) if FRAME_PATTERN.match(line)]
+        if len(frames) <= self.max_frames:
+            return lines
+        # consecutive frames (allowing one source line in between) form one traceback
+        tracebacks, current = [], [frames[0]]
+        for i in frames[1:]:
+            if i - current[-1] <= 2:
+                current.append(i)
+            else:
+                tracebacks.append(current)
+                current = [i]
+        tracebacks.append(current)
+        drop = set()
+        for traceback in tracebacks:
+            if len(traceback) > self.max_frames:
+                head = self.max_frames // 2
+                start, end = traceback[head], traceback[len(traceback) - (self.max_frames - head)]
+                drop.update(range(start, end))
+        result = []
+        for i, line in enumerate(lines):
+            if i in drop:
+                if i - 1 not in drop:
+                    result.append("[... frames omitted ...]")
+                continue
+            result.append(line)
+        return result
+
+    def abbreviate_environment(self, lines: List[str]) -> List[str]:
+        result, i = [], 0
+        while i < len(lines):
+            if not ENV_START_PATTERN.match(lines[i]):
+                result.append(lines[i])
+                i += 1
+                continue
+            # collect_env separates its sections by blank lines: the report ends at a blank line followed by prose
+            end = i + 1
+            while end < len(lines) and not lines[end].startswith("```"):
+                if not lines[end].strip() and not (end + 1 < len(lines) and _is_env_line(lines[end + 1])):
+                    break
+                end += 1
+            kept = [line for line in lines[i:end] if ENV_KEY_PATTERN.match(line)
+                    or PACKAGE_PATTERN.match(line) and KEEP_PACKAGES.search(line)]
+            result.extend(kept)
+            if end - i > len(kept):
+                result.append(f"[... {end - i - len(kept)} lines of environment report omitted ...]")
+            i = end
+        return result
+
+    def abbreviate_packages(self, lines: List[str]) -> List[str]:
+        result, i = [], 0
+        while i < len(lines):
+            end = i
+            while end < len(lines) and lines[end].strip() and PACKAGE_PATTERN.match(lines[end]):
+                end += 1
+            # log lines can look like `name version`, but a package list names every package once
+            names = {re.split(r"[\s=@]", re.sub(r"^\s*\[\w+\]\s*", "", lines[j]))[0] for j in range(i, end)}
+            if end - i < self.min_packages or len(names) < (end - i) / 2:
+                result.append(lines[i])
+                i += 1
+                continue
+            kept = [line for line in lines[i:end] if KEEP_PACKAGES.search(line)]
+            result.extend(kept)
+            result.append(f"[... {end - i - len(kept)} other packages omitted ...]")
+            i = end
+        return result
@@ -1,155 +1,497 @@
 """
-@SHAOYU: in this file, I need to implement template code generation for inference engines.
+Inference engines: in-process adapters that load a model once and generate batches of prompts.
+
+Every engine implements the same protocol:
+
+    engine.load(config)             # import the backend and load model/tokenizer
+    engine.generate(prompts, ...)   # one output per prompt, in input order (JSON of `json_schema`, when given)
+    engine.stream(prompt, ...)      # async iterator of the text deltas of one prompt's output
+    engine.close()                  # release the model (and its GPU memory)
+
+A prompt is a string (one user message) or a list of chat messages (a conversation with its history).
+The requests of a `generate` call that are not finished after `config.timeout` seconds are aborted and
+GenerationTimeout (a TimeoutError) is raised with the outputs of the finished ones; the engine stays loaded.
+
+`worker.SubprocessEngine` wraps any engine to run it in an isolated worker process instead.
+`OpenAIEngine` loads no model: it sends the prompts to an OpenAI-compatible server.
+`FakeEngine` loads no model either: it returns deterministic outputs, for dry runs and tests on CPU.
 """
-import textwrap
+import asyncio
+import gc
+import hashlib
+import http.client
+import itertools
+import json
+import os
+import random
+import time
 from abc import abstractmethod, ABCMeta
-from typing import List
-from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Union
+
+from gpit.analyzer.LLM.http_client import ConnectionPool, HTTPStatusError, TokenRateLimiter, retry_after
+from gpit.analyzer.LLM.inference_config import InferenceConfig
+from gpit.analyzer.LLM.structured import example_instance, strict_schema
+from gpit.utils.logging import ANA_LOG
+
+
+Prompt = Union[str, List[Dict[str, str]]]  # one user message, or a conversation of chat messages
+
+
+class GenerationTimeout(TimeoutError):
+    """Raised by `generate` after its timeout: `outputs` holds the outputs of the requests that finished in time
+    and None for the aborted ones, in input order"""
+
+    def __init__(self, message: str, outputs: List[Optional[str]]):
+        super().__init__(message)
+        self.outputs = outputs
+
+
+def chat_messages(prompt: Prompt, system_content: str = None) -> List[Dict[str, str]]:
+    """The chat messages of a prompt: a string is one user message, a list holds the messages of a conversation
+    ({"role": "user" or "assistant", "content": ...}, ending with a user message); after the system message"""
+    system = [{"role": "system", "content": system_content}] if system_content else []
+    return system + ([{"role": "user", "content": prompt}] if isinstance(prompt, str) else list(prompt))
+
+
+def prompt_text(prompt: Prompt) -> str:
+    return prompt if isinstance(prompt, str) else "\n".join(message["content"] for message in prompt)
+
+
+def chat_texts(tokenizer, prompts: List[Prompt], system_content: str = None) -> List[str]:
+    """Apply the chat template of `tokenizer` to every prompt (after the system message)"""
+    return [
+        tokenizer.apply_chat_template(chat_messages(prompt, system_content), tokenize=False, add_generation_prompt=True)
+        for prompt in prompts
+    ]
+
 
+async def iterate_in_thread(iterator: Iterator[str]) -> AsyncIterator[str]:
+    """Consume a blocking iterator in worker threads, without blocking the event loop"""
+    done = object()
+    try:
+        while (item := await asyncio.to_thread(next, iterator, done)) is not done:
+            yield item
+    finally:  # a consumer that stops early closes the iterator (e.g. to cancel the request), unless it is running
+        if hasattr(iterator, "close") and not getattr(iterator, "gi_running", False):
+            iterator.close()
 
 
-class Engine(metaclass=ABCMeta):  # FIXME@SHAOYU: need to further investigate the ABCMeatClass
-    def __init__(self):  # TODO@SHAOYU: add some necessary parameters for engines. In this way, we can modify the method from static into dynamic
-        pass
+class Engine(metaclass=ABCMeta):
+    def __init__(self):
+        self.config = None  # the InferenceConfig the model was loaded with, None while not loaded
+        # prompt tokens of the generated prompts and how many of them the backend took from its prefix cache
+        # (only counted by backends that report them)
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
 
     @property
-    def import_engine(self):
+    def loaded(self) -> bool:
+        return self.config is not None
+
+    def ensure_loaded(self, config: InferenceConfig):
+        """Load the model of `config`, unless it is already loaded with the same loading parameters"""
+        if self.config is None or self.config.load_params() != config.load_params():
+            self.close()
+            self.load(config)
+        self.config = config  # sampling/timeout settings may change without reloading
+
+    @abstractmethod
+    def load(self, config: InferenceConfig):
         raise NotImplementedError
 
     @abstractmethod
-    def load_model(self, model_path):
+    def generate(self, prompts: List[Prompt], temperature: float, top_p: float, repetition_penalty: float,
+                 max_tokens: int, system_content: Optional[str] = None, json_schema: Optional[Dict] = None) -> List[str]:
         raise NotImplementedError
 
+    async def stream(self, prompt: Prompt, temperature: float, top_p: float, repetition_penalty: float,
+                     max_tokens: int, system_content: Optional[str] = None,
+                     json_schema: Optional[Dict] = None) -> AsyncIterator[str]:
+        """Text deltas of the output of `prompt` as they are generated; this default yields the whole output at once"""
+        params = {"json_schema": json_schema} if json_schema is not None else {}
+        outputs = await asyncio.to_thread(self.generate, [prompt], temperature, top_p, repetition_penalty, max_tokens,
+                                          system_content, **params)
+        yield outputs[0]
+
+    def close(self):
+        self.config = None
+
 
 class SglangEngine(Engine):
     def __init__(self):
         super().__init__()
+        self.llm = None
+        self.tokenizer = None
 
-    @property
-    def import_engine(self):
-        import_strings = \
-        """
-        import asyncio
-        import io
-        import os
-        
-        from PIL import Image
-        import requests
+    def load(self, config: InferenceConfig):
         import sglang as sgl
-        
-        from sglang.srt.conversation import chat_templates
-        from sglang.test.test_utils import is_in_ci
-        from sglang.utils import async_stream_and_merge, stream_and_merge
-        """
-        return import_strings
-
-    def load_model(self, model_path):
-        load_strings = \
-        f"""
-        llm = sgl.Engine(model_path="{model_path}")
-        """
-        return load_strings
-
-    def init_sampling_params(self, temperature, top_p, repetition_penalty, max_tokens):
-        sampling_params_code = \
-        f"""
-        sampling_params = sgl.SamplingParams(temperature={temperature}, top_p={top_p}, repetition_penalty={repetition_penalty}, max_tokens={max_tokens})
-        """
-        return sampling_params_code
-
-    def init_prompt(self, prompts):
-        prompts_code = \
-        f"""
-        prompts = {prompts}
-        """
-        return prompts_code
-
-    def get_output_code(self, prompts, sampling_params):
-        output_code = \
-        f"""
-        outputs = llm.generate({prompts}, {sampling_params})
-        for prompt, output in zip(prompts, outputs):
-            print("===============================")
-            print(f"Prompt: {{prompt}}\\nGenerated text: {{output['text']}}")
-        """
-        return output_code
+        from transformers import AutoTokenizer
+
+        self.tokenizer = AutoTokenizer.from_pretrained(config.model_path)
+        self.llm = sgl.Engine(model_path=config.model_path, dtype=config.dtype, tp_size=config.tensor_parallel_size,
+                              mem_fraction_static=config.gpu_memory_utilization,
+                              disable_radix_cache=not config.enable_prefix_caching)
+        self.config = config
+
+    @staticmethod
+    def _sampling_params(temperature, top_p, repetition_penalty, max_tokens, json_schema=None):
+        sampling_params = {"temperature": temperature, "top_p": top_p, "repetition_penalty": repetition_penalty,
+                           "max_new_tokens": max_tokens}
+        if json_schema is not None:
+            sampling_params["json_schema"] = json.dumps(json_schema)
+        return sampling_params
+
+    def generate(self, prompts, temperature, top_p, repetition_penalty, max_tokens, system_content=None,
+                 json_schema=None):
+        sampling_params = self._sampling_params(temperature, top_p, repetition_penalty, max_tokens, json_schema)
+        texts = chat_texts(self.tokenizer, prompts, system_content)
+        # the event loop of the engine's tokenizer manager, as in sgl.Engine.generate
+        outputs = asyncio.get_event_loop().run_until_complete(self._generate(texts, sampling_params))
+        for output in outputs:
+            if output is not None:
+                self.prompt_tokens += output["meta_info"].get("prompt_tokens", 0)
+                self.cached_tokens += output["meta_info"].get("cached_tokens", 0)
+        texts = [output["text"] if output is not None else None for output in outputs]
+        if None in texts:
+            raise GenerationTimeout(f"{texts.count(None)} of {len(prompts)} prompts did not finish within "
+                                    f"{self.config.timeout} seconds", texts)
+        return texts
+
+    async def _generate(self, texts, sampling_params) -> List[Optional[Dict]]:
+        """One request per text, all in flight at once; the requests not finished after the timeout are aborted"""
+        tasks = [asyncio.ensure_future(self.llm.async_generate(text, sampling_params)) for text in texts]
+        done, pending = await asyncio.wait(tasks, timeout=self.config.timeout)
+        if pending:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for rid in list(self.llm.tokenizer_manager.rid_to_state):  # free the slots of the unfinished requests
+                self.llm.tokenizer_manager.abort_request(rid)
+        return [task.result() if task in done else None for task in tasks]
+
+    async def stream(self, prompt, temperature, top_p, repetition_penalty, max_tokens, system_content=None,
+                     json_schema=None):
+        # async_generate runs on the caller's loop (sgl.Engine.generate needs the event loop of the main thread)
+        sampling_params = self._sampling_params(temperature, top_p, repetition_penalty, max_tokens, json_schema)
+        text = chat_texts(self.tokenizer, [prompt], system_content)[0]
+        output = ""
+        async with aclosing(await self.llm.async_generate(text, sampling_params, stream=True)) as chunks:
+            async for chunk in chunks:
+                delta, output = chunk["text"][len(output):], chunk["text"]  # chunks hold the whole output so far
+                if chunk.get("meta_info", {}).get("finish_reason"):
+                    self.prompt_tokens += chunk["meta_info"].get("prompt_tokens", 0)
+                    self.cached_tokens += chunk["meta_info"].get("cached_tokens", 0)
+                if delta:
+                    yield delta
+
+    def close(self):
+        if self.llm is not None:
+            self.llm.shutdown()
+            self.llm = self.tokenizer = None
+        super().close()
 
 
 class VllmEngine(Engine):
     def __init__(self):
         super().__init__()
+        self.llm = None
+        self.tokenizer = None
+        self.request_ids = itertools.count()
 
-    @property
-    def import_engine(self):
-        import_strings = textwrap.dedent(
-        """
-        from transformers import AutoTokenizer
-        from vllm import LLM, SamplingParams
-        """
-        )
-        return import_strings
-
-    def load_model(self, model_path, dtype, tensor_parallel_size, gpu_memory_utilization, enable_chunked_prefill):
-        load_strings = textwrap.dedent(
-        f"""
-        tokenizer = AutoTokenizer.from_pretrained("{model_path}")
-        llm = LLM(model="{model_path}", dtype="{dtype}", tensor_parallel_size={tensor_parallel_size}, gpu_memory_utilization={gpu_memory_utilization}, enable_chunked_prefill={enable_chunked_prefill})
-        """
-        )
-        return load_strings
-
-    def init_sampling_params(self, temperature, top_p, repetition_penalty, max_tokens):
-        sampling_params_code = textwrap.dedent(
-        f"""
-        sampling_params = SamplingParams(temperature={temperature}, top_p={top_p}, repetition_penalty={repetition_penalty}, max_tokens={max_tokens})
-        """
-        )
-        return sampling_params_code
-
-    def init_prompt(self, prompt: str):
-        text_code = textwrap.dedent(
-        f"""
-        prompts = "{prompt}"
-        messages = [
-            {{"role": "user", "content": prompts}}
-        ]
-        text = tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True,
-        )
-        """
-        )
-        return text_code
-
-    def get_output(self, num):
-        output_code = textwrap.dedent(
-        f"""
-        outputs = llm.generate([text], sampling_params)
-        output_list = []
-        for i in range(len(outputs)):
-            output = outputs[i]
-            prompt = output.prompt
-            generated_text = output.outputs[0].text
-            output_list.append(generated_text)
-            if i + 1 == {num}:
+    def load(self, config: InferenceConfig):
+        from vllm import LLM
+
+        # dtype `float16` and `enable_chunked_prefill=False` by default, refer to https://github.com/vllm-project/vllm/issues/17578#issuecomment-2849401877
+        self.llm = LLM(model=config.model_path, dtype=config.dtype, tensor_parallel_size=config.tensor_parallel_size,
+                       gpu_memory_utilization=config.gpu_memory_utilization,
+                       enable_chunked_prefill=config.enable_chunked_prefill,
+                       enable_prefix_caching=config.enable_prefix_caching)
+        self.tokenizer = self.llm.get_tokenizer()
+        self.config = config
+
+    @staticmethod
+    def _sampling_params(temperature, top_p, repetition_penalty, max_tokens, json_schema=None):
+        from vllm import SamplingParams
+
+        guided = {}
+        if json_schema is not None:
+            from vllm.sampling_params import GuidedDecodingParams
+            guided["guided_decoding"] = GuidedDecodingParams(json=json_schema)
+        return SamplingParams(temperature=temperature, top_p=top_p, repetition_penalty=repetition_penalty,
+                              max_tokens=max_tokens, **guided)
+
+    def generate(self, prompts, temperature, top_p, repetition_penalty, max_tokens, system_content=None,
+                 json_schema=None):
+        sampling_params = self._sampling_params(temperature, top_p, repetition_penalty, max_tokens, json_schema)
+        # the whole batch is scheduled at once, like LLM.generate, but stepped here to abort it after the timeout
+        engine = self.llm.llm_engine
+        request_ids = [f"gpit-{next(self.request_ids)}" for _ in prompts]
+        for request_id, text in zip(request_ids, chat_texts(self.tokenizer, prompts, system_content)):
+            engine.add_request(request_id, text, sampling_params)
+        finished = {}
+        deadline = time.monotonic() + self.config.timeout
+        while len(finished) < len(request_ids) and time.monotonic() <= deadline:
+            for output in engine.step():
+                if output.finished:
+                    finished[output.request_id] = output
+        unfinished = [request_id for request_id in request_ids if request_id not in finished]
+        if unfinished:
+            engine.abort_request(unfinished)
+        for output in finished.values():
+            self.prompt_tokens += len(output.prompt_token_ids or [])
+            self.cached_tokens += getattr(output, "num_cached_tokens", None) or 0
+        texts = [finished[request_id].outputs[0].text if request_id in finished else None
+                 for request_id in request_ids]  # in input order
+        if unfinished:
+            raise GenerationTimeout(f"{len(unfinished)} of {len(prompts)} prompts did not finish within "
+                                    f"{self.config.timeout} seconds", texts)
+        return texts
+
+    def stream(self, prompt, temperature, top_p, repetition_penalty, max_tokens, system_content=None, json_schema=None):
+        sampling_params = self._sampling_params(temperature, top_p, repetition_penalty, max_tokens, json_schema)
+        return iterate_in_thread(self._stream(chat_texts(self.tokenizer, [prompt], system_content)[0], sampling_params))
+
+    def _stream(self, text, sampling_params) -> Iterator[str]:
+        # the offline LLM has no streaming API: step its engine and diff the (cumulative) outputs of the request
+        engine = self.llm.llm_engine
+        request_id = f"gpit-stream-{next(self.request_ids)}"
+        engine.add_request(request_id, text, sampling_params)
+        output_text, finished = "", False
+        try:
+            while not finished and engine.has_unfinished_requests():
+                for output in engine.step():
+                    if output.request_id != request_id:
+                        continue
+                    delta, output_text = output.outputs[0].text[len(output_text):], output.outputs[0].text
+                    if output.finished:
+                        finished = True
+                        self.prompt_tokens += len(output.prompt_token_ids or [])
+                        self.cached_tokens += getattr(output, "num_cached_tokens", None) or 0
+                    if delta:
+                        yield delta
+        finally:
+            if not finished:  # a consumer that stopped early: free the KV cache slots of the request
+                engine.abort_request([request_id])
+
+    def close(self):
+        if self.llm is not None:
+            self.llm = self.tokenizer = None
+            gc.collect()
+            try:
+                import torch
+                torch.cuda.empty_cache()
+            except ImportError:
+                pass
+        super().close()
+
+
+class OpenAIEngine(Engine):
+    """
+    Chat completions of any OpenAI-compatible `/v1/chat/completions` endpoint (e.g. `vllm serve`, hosted APIs).
+
+    The prompts of a `generate` call are sent concurrently (at most `config.max_concurrency` in flight) over pooled
+    keep-alive connections, within `config.tokens_per_minute`; throttled (429) and failed (5xx, connection error)
+    requests are retried with exponential backoff (or after the server's `Retry-After`).
+    """
+    RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+    MAX_BACKOFF = 30  # seconds
+
+    def __init__(self):
+        super().__init__()
+        self.pool = None
+        self.limiter = None
+        self.retries = 0  # requests retried since loading, for monitoring throttling
+
+    def load(self, config: InferenceConfig):
+        if not config.api_base:
+            raise ValueError("the openai engine needs the api_base of the server, e.g. http://localhost:8000/v1")
+        self.pool = ConnectionPool(config.api_base, timeout=config.timeout)
+        self.config = config
+
+    def _chat_request(self, prompt, temperature, top_p, repetition_penalty, max_tokens, system_content=None,
+                      json_schema=None):
+        params = {"temperature": temperature, "top_p": top_p, "max_tokens": max_tokens}
+        if repetition_penalty != 1.0:  # not an OpenAI parameter: only sent when it is used (vLLM/SGLang servers)
+            params["repetition_penalty"] = repetition_penalty
+        if json_schema is not None:
+            params["response_format"] = {"type": "json_schema",
+                                         "json_schema": {"name": "analysis", "schema": strict_schema(json_schema),
+                                                         "strict": True}}
+        return {"model": self.config.model_path, "messages": chat_messages(prompt, system_content), **params}
+
+    def _headers(self):
+        api_key = os.environ.get(self.config.api_key_env)
+        return {"Authorization": f"Bearer {api_key}"} if api_key else {}
+
+    def _count_usage(self, usage):
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.cached_tokens += (usage.get("prompt_tokens_details") or {}).get("cached_tokens", 0)
+
+    def _backoff(self, attempt: int, status: Optional[int], headers, error: str) -> float:
+        """Seconds to wait before retrying a failed request; raises when the request is not retried"""
+        if status is not None and status not in self.RETRY_STATUS:
+            raise RuntimeError(f"Chat completion failed with {error}")
+        if attempt == self.config.max_retries:
+            raise RuntimeError(f"Chat completion failed {attempt + 1} times, last with {error}")
+        self.retries += 1
+        delay = retry_after(headers)
+        if delay is None:
+            delay = min(self.MAX_BACKOFF, 2 ** attempt) * random.uniform(0.5, 1)
+        ANA_LOG.debug(f"gpit retries a chat completion in {delay:.1f}s ({error})")
+        return delay
+
+    def generate(self, prompts, temperature, top_p, repetition_penalty, max_tokens, system_content=None,
+                 json_schema=None):
+        self.pool.timeout = self.config.timeout
+        tokens_per_minute = self.config.tokens_per_minute
+        if not tokens_per_minute:
+            self.limiter = None
+        elif self.limiter is None or self.limiter.capacity != tokens_per_minute:
+            self.limiter = TokenRateLimiter(tokens_per_minute)
+        requests = [self._chat_request(prompt, temperature, top_p, repetition_penalty, max_tokens, system_content,
+                                       json_schema) for prompt in prompts]
+        retries = self.retries
+        with ThreadPoolExecutor(self.config.max_concurrency) as executor:
+            outputs = asyncio.run(self._complete_all(requests, executor))
+        if self.retries > retries:
+            ANA_LOG.warning(f"gpit retried {self.retries - retries} throttled or failed chat completions "
+                            f"for {len(prompts)} prompts")
+        return outputs
+
+    async def _complete_all(self, requests, executor) -> List[str]:
+        semaphore = asyncio.Semaphore(self.config.max_concurrency)
+        # gather returns the outputs in the order of the requests, whatever order they finish in
+        return await asyncio.gather(*(self._complete(request, semaphore, executor) for request in requests))
+
+    async def _complete(self, request, semaphore, executor) -> str:
+        loop = asyncio.get_running_loop()
+        headers = self._headers()
+        # rough estimate (4 characters per token) of the prompt tokens, the completion may use all of max_tokens
+        estimate = sum(len(message["content"]) for message in request["messages"]) // 4 + request["max_tokens"]
+        for attempt in range(self.config.max_retries + 1):
+            if self.limiter is not None:
+                await self.limiter.acquire(estimate)
+            async with semaphore:
+                try:
+                    status, response_headers, data = await loop.run_in_executor(
+                        executor, self.pool.post, "chat/completions", request, headers)
+                    error = f"HTTP {status}: {data[:200].decode('utf-8', 'replace')}"
+                except (OSError, http.client.HTTPException) as e:  # connection refused/reset, timeout, ...
+                    status, response_headers, error = None, {}, f"{type(e).__name__}: {e}"
+            if status == 200:
+                response = json.loads(data)
+                usage = response.get("usage") or {}
+                self._count_usage(usage)
+                if self.limiter is not None:
+                    self.limiter.refund(estimate - usage.get("total_tokens", estimate))
+                return response["choices"][0]["message"]["content"] or ""
+            if self.limiter is not None:
+                self.limiter.refund(estimate)
+            await asyncio.sleep(self._backoff(attempt, status, response_headers, error))
+
+    def stream(self, prompt, temperature, top_p, repetition_penalty, max_tokens, system_content=None, json_schema=None):
+        request = self._chat_request(prompt, temperature, top_p, repetition_penalty, max_tokens, system_content,
+                                     json_schema)
+        return iterate_in_thread(self._stream({**request, "stream": True, "stream_options": {"include_usage": True}}))
+
+    def _stream(self, request) -> Iterator[str]:
+        self.pool.timeout = self.config.timeout
+        for attempt in range(self.config.max_retries + 1):
+            events = self.pool.stream("chat/completions", request, self._headers())
+            try:
+                first = next(events, None)  # throttling is reported before the first event
                 break
-        """
-        )
-        return output_code
+            except HTTPStatusError as e:
+                delay = self._backoff(attempt, e.status, e.headers, str(e))
+            except (OSError, http.client.HTTPException) as e:
+                delay = self._backoff(attempt, None, {}, f"{type(e).__name__}: {e}")
+            time.sleep(delay)
+        for event in itertools.chain([first] if first is not None else [], events):
+            chunk = json.loads(event)
+            if chunk.get("usage"):  # the last chunk (stream_options.include_usage)
+                self._count_usage(chunk["usage"])
+            for choice in chunk.get("choices") or []:
+                delta = (choice.get("delta") or {}).get("content")
+                if delta:
+                    yield delta
 
+    def close(self):
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+        super().close()
 
 
-if __name__ == "__main__":
-    vllm_engine = VllmEngine()
-    import_code = vllm_engine.import_engine
-    # dtype uses `float16` and `enable_chunked_prefill=False`, refer to https://github.com/vllm-project/vllm/issues/17578#issuecomment-2849401877
-    model_loading_code = vllm_engine.load_model(model_path="Qwen/Qwen3-1.7B", dtype="float16", tensor_parallel_size=4, gpu_memory_utilization=0.7, enable_chunked_prefill=False)
-    sampling_params_code = vllm_engine.init_sampling_params(temperature=0.6, top_p=0.95, repetition_penalty=1.0, max_tokens=4096)
-    prompt_code = vllm_engine.init_prompt("hello, who you are?")
-    output_code = vllm_engine.get_output(num=1)
-    complete_code = import_code + model_loading_code + prompt_code + sampling_params_code + output_code
-    Path("./atmp.py").write_text(complete_code)
+class FakeEngine(Engine):
+    """
+    Engine without a model: the output of a prompt is a digest of it (or an instance of `json_schema` derived from
+    it), generated (or streamed in deltas of `DELTA_SIZE` characters) in `latency` seconds per prompt.
+    Tokens are words; with `enable_prefix_caching`, prompts reuse the cached blocks of `BLOCK_SIZE` tokens they share
+    with earlier prompts from their start, like vLLM's automatic prefix caching.
+    """
+    BLOCK_SIZE = 16
+    DELTA_SIZE = 4  # characters per streamed delta
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.blocks = set()
 
+    def load(self, config: InferenceConfig):
+        self.blocks = set()
+        self.config = config
 
+    def _prefill(self, tokens: List[str]):
+        self.prompt_tokens += len(tokens)
+        if not self.config.enable_prefix_caching:
+            return
+        block, hit = None, True
+        for start in range(0, len(tokens) - self.BLOCK_SIZE + 1, self.BLOCK_SIZE):
+            block = hash((block, tuple(tokens[start:start + self.BLOCK_SIZE])))  # a block with all blocks before it
+            hit = hit and block in self.blocks
+            if hit:
+                self.cached_tokens += self.BLOCK_SIZE
+            self.blocks.add(block)
 
+    @staticmethod
+    def _output(prompt, system_content=None, json_schema=None) -> str:
+        prompt = prompt_text(prompt)
+        if json_schema is not None:
+            return json.dumps(example_instance(json_schema, f"{system_content}|{prompt}"))
+        return f"fake:{hashlib.sha256(f'{system_content}|{prompt}'.encode('utf-8')).hexdigest()[:16]}"
+
+    def generate(self, prompts, temperature, top_p, repetition_penalty, max_tokens, system_content=None,
+                 json_schema=None):
+        # the prompts are generated one after the other: those that do not fit in the timeout are aborted
+        finished = len(prompts) if not self.latency else min(len(prompts), int(self.config.timeout // self.latency))
+        for prompt in prompts[:finished]:
+            self._prefill(f"{system_content or ''} {prompt_text(prompt)}".split())
+        time.sleep(self.config.timeout if finished < len(prompts) else self.latency * finished)
+        outputs = [self._output(prompt, system_content, json_schema) if i < finished else None
+                   for i, prompt in enumerate(prompts)]
+        if finished < len(prompts):
+            raise GenerationTimeout(f"{len(prompts) - finished} of {len(prompts)} prompts did not finish within "
+                                    f"{self.config.timeout} seconds", outputs)
+        return outputs
+
+    async def stream(self, prompt, temperature, top_p, repetition_penalty, max_tokens, system_content=None,
+                     json_schema=None):
+        self._prefill(f"{system_content or ''} {prompt_text(prompt)}".split())
+        output = self._output(prompt, system_content, json_schema)
+        deltas = [output[i:i + self.DELTA_SIZE] for i in range(0, len(output), self.DELTA_SIZE)]
+        for delta in deltas:  # the latency of the prompt spread over its deltas
+            await asyncio.sleep(self.latency / len(deltas))
+            yield delta
+
+
+ENGINES = {"vllm": VllmEngine, "sglang": SglangEngine, "openai": OpenAIEngine, "fake": FakeEngine}
+
+
+if __name__ == "__main__":
+    vllm_engine = VllmEngine()
+    vllm_engine.load(InferenceConfig(model_path="Qwen/Qwen3-1.7B", tensor_parallel_size=4))
+    print(vllm_engine.generate(["hello, who you are?"], temperature=0.6, top_p=0.95, repetition_penalty=1.0,
+                               max_tokens=4096))
+    vllm_engine.close()
@@ -4,8 +4,8 @@ Inference function usage examples
 Demonstrates how to use different engines for model inference
 """
 
-from engines import VllmEngine, SglangEngine
-from inference import infer
+from gpit.analyzer.LLM.engines import VllmEngine, SglangEngine
+from gpit.analyzer.LLM.inference import infer
 import time
 import logging
 
@@ -0,0 +1,148 @@
+"""
+Standard-library HTTP plumbing of `engines.OpenAIEngine`.
+
+`ConnectionPool` keeps one keep-alive `http.client` connection per concurrent request, so requests to
+the same server reuse their TCP (and TLS) connections; its blocking calls are run in a thread pool by
+the engine's event loop. `TokenRateLimiter` is a token bucket that spreads requests so that at most
+`tokens_per_minute` (prompt and completion) tokens are requested per minute.
+"""
+import asyncio
+import http.client
+import json
+import queue
+import time
+from typing import Any, Dict, Iterator, Optional, Tuple
+from urllib.parse import urlsplit
+
+
+class HTTPStatusError(Exception):
+    def __init__(self, status: int, headers: Dict[str, str], data: bytes):
+        super().__init__(f"HTTP {status}: {data[:200].decode('utf-8', 'replace')}")
+        self.status = status
+        self.headers = headers
+
+
+class ConnectionPool:
+    """Keep-alive connections to the server of `base_url`; safe to use from several threads"""
+
+    def __init__(self, base_url: str, timeout: float = 300):
+        url = urlsplit(base_url)
+        if url.scheme not in ("http", "https") or not url.hostname:
+            raise ValueError(f"api_base must be an http(s) URL but got {base_url}")
+        self.connection_class = http.client.HTTPSConnection if url.scheme == "https" else http.client.HTTPConnection
+        self.host = url.hostname
+        self.port = url.port
+        self.path = url.path.rstrip("/")
+        self.timeout = timeout
+        self.idle = queue.SimpleQueue()
+
+    def _connection(self) -> Tuple[http.client.HTTPConnection, bool]:
+        """An idle connection (reused: True) or a new one"""
+        try:
+            connection, reused = self.idle.get_nowait(), True
+        except queue.Empty:
+            connection, reused = self.connection_class(self.host, self.port, timeout=self.timeout), False
+        connection.timeout = self.timeout
+        if connection.sock is not None:
+            connection.sock.settimeout(self.timeout)
+        return connection, reused
+
+    def _send(self, connection: http.client.HTTPConnection, path: str, body: Dict[str, Any],
+              headers: Dict[str, str] = None) -> http.client.HTTPResponse:
+        connection.request("POST", f"{self.path}/{path}", body=json.dumps(body).encode("utf-8"),
+                           headers={"Content-Type": "application/json", **(headers or {})})
+        return connection.getresponse()
+
+    def _release(self, connection: http.client.HTTPConnection, response: http.client.HTTPResponse):
+        if response.will_close:
+            connection.close()
+        else:
+            self.idle.put(connection)
+
+    def post(self, path: str, body: Dict[str, Any], headers: Dict[str, str] = None) -> Tuple[int, Dict[str, str], bytes]:
+        """POST `body` as JSON to `path` (relative to `base_url`); return the status, headers and body of the response"""
+        connection, reused = self._connection()
+        try:
+            response = self._send(connection, path, body, headers)
+            data = response.read()
+        except Exception as e:
+            connection.close()  # the connection may be half-used: never reuse it
+            if reused and isinstance(e, (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)):
+                return self.post(path, body, headers)  # the server closed the idle connection: use a new one
+            raise
+        self._release(connection, response)
+        return response.status, {key.lower(): value for key, value in response.getheaders()}, data
+
+    def stream(self, path: str, body: Dict[str, Any], headers: Dict[str, str] = None) -> Iterator[bytes]:
+        """
+        POST `body` as JSON to `path` and yield the data of the server-sent events of the response until `[DONE]`;
+        raise HTTPStatusError when the response is not OK
+        """
+        connection, _ = self._connection()
+        response = None
+        try:
+            response = self._send(connection, path, body, headers)
+            if response.status != 200:
+                raise HTTPStatusError(response.status, {key.lower(): value for key, value in response.getheaders()},
+                                      response.read())
+            for line in response:
+                line = line.strip()
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[len(b"data:"):].strip()
+                if data == b"[DONE]":
+                    break
+                yield data
+            response.read()
+        except BaseException:  # errors, and consumers that stop early (GeneratorExit): the response is not read up
+            connection.close()
+            raise
+        self._release(connection, response)
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+class TokenRateLimiter:
+    """Token bucket holding up to one minute of tokens, refilled continuously"""
+
+    def __init__(self, tokens_per_minute: int, clock=time.monotonic):
+        if tokens_per_minute <= 0:
+            raise ValueError(f"tokens_per_minute must be positive but got {tokens_per_minute}")
+        self.capacity = float(tokens_per_minute)
+        self.rate = tokens_per_minute / 60
+        self.tokens = self.capacity
+        self.clock = clock
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: int):
+        """Wait until `tokens` (at most a minute's worth) are available and take them"""
+        tokens = min(tokens, self.capacity)
+        while True:
+            self._refill()
+            if self.tokens >= tokens:  # no await between the check and the update: atomic within the event loop
+                self.tokens -= tokens
+                return
+            await asyncio.sleep((tokens - self.tokens) / self.rate)
+
+    def refund(self, tokens: int):
+        """Return tokens that were acquired but not used (e.g. the estimated completion tokens that were not generated)"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + tokens)
+
+
+def retry_after(headers: Dict[str, str]) -> Optional[float]:
+    """Seconds to wait before retrying, as requested by the server's `Retry-After` header (if it is numeric)"""
+    try:
+        return max(0.0, float(headers["retry-after"]))
+    except (KeyError, ValueError):
+        return None
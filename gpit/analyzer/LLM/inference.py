@@ -1,20 +1,21 @@
-from engines import VllmEngine, SglangEngine, Engine
-from inference_config import InferenceConfig, load_inference_config
-import subprocess
-import tempfile
-import os
-import json
-import re
-from pathlib import Path
-from typing import Union
+from gpit.analyzer.LLM.cache import ResultCache, cache_key
+from gpit.analyzer.LLM.engines import VllmEngine, SglangEngine, Engine, GenerationTimeout, Prompt
+from gpit.analyzer.LLM.inference_config import InferenceConfig, load_inference_config
+from gpit.analyzer.LLM.metrics import METRICS, LatencyMetrics, config_label
+from gpit.utils.logging import ANA_LOG
+from contextlib import aclosing
+from dataclasses import replace
+from typing import AsyncIterator, Dict, Hashable, List, Optional, Sequence, Union
+import time
 
 
 def infer(engine: Engine, prompts: str, model: Union[str, InferenceConfig], **kwargs):
     """
-    Generate templated code using engine instance, start subprocess for inference and return results
+    Run inference on a single prompt and return the result.
+    The engine loads the model on the first call only and keeps it for the later calls.
     
     Args:
-        engine: Instantiated Engine object (VllmEngine or SglangEngine)
+        engine: Instantiated Engine object (VllmEngine, SglangEngine or a SubprocessEngine wrapping one)
         prompts: Input prompts
         model: Model path/name or InferenceConfig object, or config name
         **kwargs: Other inference parameters that will override config parameters
@@ -22,151 +23,187 @@ def infer(engine: Engine, prompts: str, model: Union[str, InferenceConfig], **kw
     Returns:
         str: Generated text result from inference
     """
-    
-    # Process configuration parameters
+    return infer_batch(engine, [prompts], model, **kwargs)[0]
+
+
+async def stream(engine: Engine, prompt: Prompt, model: Union[str, InferenceConfig], metrics: LatencyMetrics = None,
+                 **kwargs) -> AsyncIterator[str]:
+    """
+    Streaming version of `infer`: yield the text deltas of the output as they are generated, and record the
+    TTFT, inter-token latencies and throughput of the request in `metrics`
+    (by default `METRICS[config_label(config)]`, the metrics of the config's loading parameters).
+
+    Args:
+        engine: Instantiated Engine object
+        prompt: Input prompt, or the chat messages of a conversation
+        model: Model path/name or InferenceConfig object, or config name
+        metrics: Optional LatencyMetrics to record the request in
+        **kwargs: Other inference parameters that will override config parameters
+    """
+    config = resolve_config(model, **kwargs)
+    # loaded in the calling thread (backends such as sgl.Engine have to load in the main thread), before the latency
+    engine.ensure_loaded(config)
+    metrics = metrics if metrics is not None else METRICS[config_label(config)]
+    start, delta_times = time.perf_counter(), []
+    try:
+        async with aclosing(engine.stream(prompt, **config.generate_params())) as deltas:
+            async for delta in deltas:
+                delta_times.append(time.perf_counter())
+                yield delta
+    finally:  # also record requests that failed or were stopped after some deltas
+        metrics.observe(start, delta_times)
+
+
+def infer_batch(engine: Engine, prompts: Sequence[str], model: Union[str, InferenceConfig],
+                ids: Sequence[Hashable] = None, batch_size: int = None, cache: ResultCache = None,
+                failures: Dict[str, str] = None, **kwargs) -> Union[List[str], Dict[Hashable, str]]:
+    """
+    Batched version of `infer`: the prompts are chat-templated and generated by the engine in micro-batches
+    of `batch_size` prompts (config.max_batch_size by default), one engine `generate` call per micro-batch,
+    so the engine can schedule a whole micro-batch at once (continuous batching).
+
+    Args:
+        engine: Instantiated Engine object (VllmEngine, SglangEngine or a SubprocessEngine wrapping one)
+        prompts: Input prompts
+        model: Model path/name or InferenceConfig object, or config name
+        ids: Optional id of every prompt (e.g. issue links)
+        batch_size: Prompts per generate call, overrides config.max_batch_size
+            (the timeout applies to each generate call)
+        cache: Optional ResultCache; only the prompts without a cached output (for this config) are generated
+        failures: Optional dict; when given, a failing batch does not raise but is split to isolate its failing
+            prompts (see `generate_isolated`), whose output is None and whose error is added as failures[prompt].
+            Prompts in `failures` (also those with a truncated output) are not cached
+        **kwargs: Other inference parameters that will override config parameters
+
+    Returns:
+        List[str] of outputs in input order, or {id: output} (in input order) when ids are given
+    """
+    config = resolve_config(model, **kwargs)
+    prompts = list(prompts)
+    if ids is not None:
+        ids = list(ids)
+        if len(ids) != len(prompts):
+            raise ValueError(f"got {len(ids)} ids for {len(prompts)} prompts")
+    batch_size = batch_size or config.max_batch_size or len(prompts) or 1
+
+    if cache is None:
+        outputs = generate_batches(engine, prompts, config, batch_size, failures)
+    else:
+        keys = [cache_key(config, prompt) for prompt in prompts]
+        cached = cache.get_many(keys)
+        missing = list(dict.fromkeys(key for key in keys if key not in cached))  # each distinct prompt once
+        if missing:
+            prompt_of = dict(zip(keys, prompts))
+            generated = generate_batches(engine, [prompt_of[key] for key in missing], config, batch_size, failures)
+            failed = failures or {}
+            cache.put_many([(key, output) for key, output in zip(missing, generated)
+                            if output is not None and prompt_of[key] not in failed])
+            cached.update(zip(missing, generated))
+        outputs = [cached[key] for key in keys]
+    return outputs if ids is None else dict(zip(ids, outputs))
+
+
+def generate_batches(engine: Engine, prompts: List[str], config: InferenceConfig, batch_size: int,
+                     failures: Dict[str, str] = None) -> List[Optional[str]]:
+    """Generate `prompts` in micro-batches of `batch_size`, loading the model if needed"""
+    engine.ensure_loaded(config)
+    outputs = []
+    for start in range(0, len(prompts), batch_size):
+        batch = prompts[start:start + batch_size]
+        if failures is not None:
+            outputs.extend(generate_isolated(engine, batch, config, failures))
+            continue
+        batch_outputs = engine.generate(batch, **config.generate_params())
+        if len(batch_outputs) != len(batch):
+            raise RuntimeError(f"Engine returned {len(batch_outputs)} outputs for {len(batch)} prompts")
+        outputs.extend(batch_outputs)
+    return outputs
+
+
+def is_oom(error: Exception) -> bool:
+    """Whether `error` is an out-of-memory error, also when it was raised in a worker process"""
+    return isinstance(error, MemoryError) or "out of memory" in str(error).lower()
+
+
+def generate_isolated(engine: Engine, prompts: List[str], config: InferenceConfig,
+                      failures: Dict[str, str]) -> List[Optional[str]]:
+    """
+    Generate `prompts` in one call; when it fails, generate each half separately, so the outputs of the
+    other prompts are kept and only the failing prompts are left. After a timeout the outputs of the prompts
+    that finished in time are kept and only the unfinished ones are retried (a single prompt has
+    `config.request_timeout` seconds, when set): with half the `max_tokens`, up to `config.timeout_retries`
+    times. A prompt that still fails outputs None and its error is added to `failures`. The output of a retry is
+    kept, but as it may be cut off by the reduced `max_tokens` the prompt is added to `failures` as well
+    ("Truncated: ..."), so it is neither cached nor checkpointed under the full config.
+    After an out-of-memory error the engine is recycled (closed and loaded again) to release fragmented memory.
+    """
+    if len(prompts) == 1 and config.request_timeout:
+        config = replace(config, timeout=min(config.timeout, config.request_timeout))
+    engine.ensure_loaded(config)  # errors while loading are not the prompts' fault: they are raised
+    try:
+        outputs = engine.generate(prompts, **config.generate_params())
+        if len(outputs) != len(prompts):
+            raise RuntimeError(f"Engine returned {len(outputs)} outputs for {len(prompts)} prompts")
+        return outputs
+    except GenerationTimeout as e:
+        error = e
+        if any(output is not None for output in e.outputs):  # the finished outputs are kept
+            outputs = list(e.outputs)
+            unfinished = [i for i, output in enumerate(outputs) if output is None]
+            ANA_LOG.warning(f"gpit retries {len(unfinished)} of {len(prompts)} prompts that did not finish in time")
+            retried = retry_timed_out(engine, [prompts[i] for i in unfinished], config, failures, error)
+            for i, output in zip(unfinished, retried):
+                outputs[i] = output
+            return outputs
+    except Exception as e:
+        error = e
+    if is_oom(error):
+        ANA_LOG.warning(f"gpit recycles the engine after running out of memory on {len(prompts)} prompts")
+        engine.close()
+    if len(prompts) > 1:
+        ANA_LOG.warning(f"gpit splits a failed batch of {len(prompts)} prompts ({type(error).__name__}: {error})")
+        middle = len(prompts) // 2
+        return (generate_isolated(engine, prompts[:middle], config, failures)
+                + generate_isolated(engine, prompts[middle:], config, failures))
+    if isinstance(error, TimeoutError):
+        return retry_timed_out(engine, prompts, config, failures, error)
+    failures[prompts[0]] = f"{type(error).__name__}: {error}"
+    return [None]
+
+
+def retry_timed_out(engine: Engine, prompts: List[str], config: InferenceConfig, failures: Dict[str, str],
+                    error: Exception) -> List[Optional[str]]:
+    """Generate `prompts` that timed out again with half the `max_tokens`, while `config.timeout_retries` are left"""
+    if config.timeout_retries == 0 or config.max_tokens <= 1:
+        for prompt in prompts:
+            failures[prompt] = f"{type(error).__name__}: {error}"
+        return [None] * len(prompts)
+    retry = replace(config, max_tokens=config.max_tokens // 2, timeout_retries=config.timeout_retries - 1)
+    outputs = generate_isolated(engine, prompts, retry, failures)
+    for prompt, output in zip(prompts, outputs):
+        if output is not None and prompt not in failures:
+            failures[prompt] = f"Truncated: generated with max_tokens={retry.max_tokens} after {error}"
+    return outputs
+
+
+def resolve_config(model: Union[str, InferenceConfig], **overrides) -> InferenceConfig:
+    """
+    Model path/name, config name or InferenceConfig object -> InferenceConfig,
+    with the config fields given in `overrides` replaced (other keyword arguments are ignored)
+    """
     if isinstance(model, InferenceConfig):
         config = model
-        model_path = config.model_path
     elif isinstance(model, str):
         if model.startswith("/") or model.startswith("./") or "/" in model:
             # If it's a path, create default config
             config = InferenceConfig(model_path=model)
-            model_path = model
         else:
             # If it's a config name, load config
             config = load_inference_config(model)
-            model_path = config.model_path
     else:
         raise ValueError("model parameter must be a string (path or config name) or InferenceConfig object")
-    
-    # Override config parameters with kwargs
-    temperature = kwargs.get('temperature', config.temperature)
-    top_p = kwargs.get('top_p', config.top_p)
-    repetition_penalty = kwargs.get('repetition_penalty', config.repetition_penalty)
-    max_tokens = kwargs.get('max_tokens', config.max_tokens)
-    timeout = kwargs.get('timeout', config.timeout)
-    
-    # Generate complete inference code
-    complete_code = generate_inference_code(
-        engine, prompts, model_path, config,
-        temperature, top_p, repetition_penalty, max_tokens
-    )
-    
-    # Create temporary file and write code
-    with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False) as temp_file:
-        temp_file.write(complete_code)
-        temp_file_path = temp_file.name
-    
-    try:
-        # Start subprocess to execute code
-        result = subprocess.run(
-            ['python', temp_file_path],
-            capture_output=True,
-            text=True,
-            timeout=timeout
-        )
-        
-        if result.returncode != 0:
-            raise RuntimeError(f"Inference process error: {result.stderr}")
-        
-        # Parse output results
-        output = parse_inference_output(result.stdout)
-        return output
-        
-    finally:
-        # Clean up temporary file
-        os.unlink(temp_file_path)
-
-
-def generate_inference_code(engine, prompts, model_path, config, temperature, top_p, repetition_penalty, max_tokens):
-    """
-    Generate complete inference code based on engine type
-    """
-    import_code = engine.import_engine
-    
-    if isinstance(engine, VllmEngine):
-        # VllmEngine code generation - use parameters from config
-        model_loading_code = engine.load_model(
-            model_path=model_path,
-            dtype=config.dtype,
-            tensor_parallel_size=config.tensor_parallel_size,
-            gpu_memory_utilization=config.gpu_memory_utilization,
-            enable_chunked_prefill=config.enable_chunked_prefill
-        )
-        sampling_params_code = engine.init_sampling_params(
-            temperature, top_p, repetition_penalty, max_tokens
-        )
-        prompt_code = engine.init_prompt(prompts)
-        output_code = engine.get_output(num=1)
-        
-        # Add result output code
-        result_output_code = """
-# Output results to stdout for parsing
-print("INFERENCE_RESULT_START")
-for result in output_list:
-    print(result)
-print("INFERENCE_RESULT_END")
-        """
-        
-    elif isinstance(engine, SglangEngine):
-        # SglangEngine code generation
-        model_loading_code = engine.load_model(model_path)
-        sampling_params_code = engine.init_sampling_params(
-            temperature, top_p, repetition_penalty, max_tokens
-        )
-        prompt_code = engine.init_prompt([prompts])
-        output_code = engine.get_output_code("prompts", "sampling_params")
-        
-        # Add result output code
-        result_output_code = """
-# Output results to stdout for parsing
-print("INFERENCE_RESULT_START")
-for prompt, output in zip(prompts, outputs):
-    print(output['text'])
-print("INFERENCE_RESULT_END")
-        """
-    else:
-        raise ValueError(f"Unsupported engine type: {type(engine)}")
-    
-    # Combine complete code
-    complete_code = (
-        import_code + "\n" +
-        model_loading_code + "\n" +
-        sampling_params_code + "\n" +
-        prompt_code + "\n" +
-        output_code + "\n" +
-        result_output_code
-    )
-    
-    return complete_code
-
-
-def parse_inference_output(stdout):
-    """
-    Parse subprocess stdout and extract inference results
-    """
-    lines = stdout.strip().split('\n')
-    
-    # Find result markers
-    start_idx = None
-    end_idx = None
-    
-    for i, line in enumerate(lines):
-        if "INFERENCE_RESULT_START" in line:
-            start_idx = i + 1
-        elif "INFERENCE_RESULT_END" in line:
-            end_idx = i
-            break
-    
-    if start_idx is not None and end_idx is not None:
-        result_lines = lines[start_idx:end_idx]
-        return '\n'.join(result_lines).strip()
-    else:
-        # If markers not found, try to extract last generated text from output
-        for line in reversed(lines):
-            if line.strip() and not line.startswith("Generated text:"):
-                return line.strip()
-        return "Inference result not found"
+    overrides = {key: value for key, value in overrides.items() if key in config.to_dict()}
+    return replace(config, **overrides) if overrides else config
 
 
 def infer_with_config(engine: Engine, prompts: str, config_name: str = "qwen_small", **kwargs):
@@ -210,7 +247,7 @@ if __name__ == "__main__":
     
     # Test inference using config object
     print("\nTesting inference with config object:")
-    from inference_config import load_inference_config
+    from gpit.analyzer.LLM.inference_config import load_inference_config
     config = load_inference_config("creative_mode")
     result3 = infer(
         engine=vllm_engine,
@@ -19,9 +19,23 @@ class InferenceConfig:
     max_tokens: int = 4096
     dtype: str = "float16"
     tensor_parallel_size: int = 1
+    data_parallel_size: int = 1  # Model replicas, each in a worker process on `tensor_parallel_size` devices
+    devices: Optional[str] = None  # Devices of the replicas, e.g. "0,1,2,3" (consecutive slices); by default 0, 1, ...
     gpu_memory_utilization: float = 0.7
     enable_chunked_prefill: bool = False
-    timeout: int = 300  # Subprocess timeout in seconds
+    enable_prefix_caching: bool = True  # Reuse the KV cache of prompt prefixes shared with earlier prompts
+    timeout: int = 300  # Timeout in seconds of a generate call (the engine aborts its unfinished requests), also in a worker
+    request_timeout: Optional[int] = None  # Deadline in seconds of a single prompt isolated from a failed batch
+    timeout_retries: int = 2  # Retries of the prompts that timed out, each with half the max_tokens
+    max_batch_size: int = 1024  # Prompts sent to the engine per generate call by infer_batch
+    system_content: Optional[str] = None  # System message put before every prompt
+    json_schema: Optional[Dict[str, Any]] = None  # JSON schema the outputs are constrained to (guided decoding)
+    engine: str = "vllm"  # Backend of run_analysis: vllm, sglang or openai (any OpenAI-compatible server)
+    api_base: Optional[str] = None  # openai engine: server URL up to the API version, e.g. http://localhost:8000/v1
+    api_key_env: str = "OPENAI_API_KEY"  # openai engine: environment variable holding the API key (if any)
+    max_concurrency: int = 16  # openai engine: requests in flight at the same time
+    tokens_per_minute: Optional[int] = None  # openai engine: rate limit of prompt + completion tokens
+    max_retries: int = 5  # openai engine: retries of a request throttled (429) or failed (5xx, connection error)
     
     def to_dict(self) -> Dict[str, Any]:
         """Convert to dictionary format"""
@@ -33,11 +47,39 @@ class InferenceConfig:
             "max_tokens": self.max_tokens,
             "dtype": self.dtype,
             "tensor_parallel_size": self.tensor_parallel_size,
+            "data_parallel_size": self.data_parallel_size,
+            "devices": self.devices,
             "gpu_memory_utilization": self.gpu_memory_utilization,
             "enable_chunked_prefill": self.enable_chunked_prefill,
-            "timeout": self.timeout
+            "enable_prefix_caching": self.enable_prefix_caching,
+            "timeout": self.timeout,
+            "request_timeout": self.request_timeout,
+            "timeout_retries": self.timeout_retries,
+            "max_batch_size": self.max_batch_size,
+            "system_content": self.system_content,
+            "json_schema": self.json_schema,
+            "engine": self.engine,
+            "api_base": self.api_base,
+            "api_key_env": self.api_key_env,
+            "max_concurrency": self.max_concurrency,
+            "tokens_per_minute": self.tokens_per_minute,
+            "max_retries": self.max_retries
         }
     
+    def load_params(self) -> Dict[str, Any]:
+        """Parameters the model is loaded with (changing any of them requires reloading the model)"""
+        return {key: getattr(self, key) for key in
+                ("model_path", "dtype", "tensor_parallel_size", "gpu_memory_utilization", "enable_chunked_prefill",
+                 "enable_prefix_caching", "api_base")}
+
+    def generate_params(self) -> Dict[str, Any]:
+        """Keyword arguments of `Engine.generate` (sampling parameters, system prompt and, if any, JSON schema)"""
+        params = {key: getattr(self, key) for key in
+                  ("temperature", "top_p", "repetition_penalty", "max_tokens", "system_content")}
+        if self.json_schema is not None:  # only passed when set: engines without guided decoding keep working
+            params["json_schema"] = self.json_schema
+        return params
+
     @classmethod
     def from_dict(cls, config_dict: Dict[str, Any]) -> 'InferenceConfig':
         """Create config object from dictionary"""
@@ -61,7 +103,6 @@ class ConfigManager:
     
     def __init__(self, config_dir: str = "./configs"):
         self.config_dir = config_dir
-        os.makedirs(config_dir, exist_ok=True)
         self._predefined_configs = self._create_predefined_configs()
     
     def _create_predefined_configs(self) -> Dict[str, InferenceConfig]:
@@ -120,6 +161,7 @@ class ConfigManager:
     
     def save_config(self, config_name: str, config: InferenceConfig):
         """Save configuration"""
+        os.makedirs(self.config_dir, exist_ok=True)  # created on first save, not on import
         config_file = os.path.join(self.config_dir, f"{config_name}.json")
         config.save_to_file(config_file)
     
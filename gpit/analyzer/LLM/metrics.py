@@ -0,0 +1,86 @@
+"""
+Latency metrics of streamed generations.
+
+Every streamed request records its time to first token (TTFT), the latency between its following
+deltas (inter-token latency, ITL; a delta is one token or a few) and its decode throughput into the
+`LatencyMetrics` of its config, `METRICS[config_label(config)]`, so configs that differ e.g. in
+`gpu_memory_utilization` or `enable_chunked_prefill` can be compared by their histograms.
+"""
+import bisect
+import math
+from collections import defaultdict
+from typing import Dict, List, Sequence
+
+from gpit.analyzer.LLM.inference_config import InferenceConfig
+
+
+LATENCY_BUCKETS = tuple(0.001 * 2 ** (i / 2) for i in range(40))  # upper bounds from 1ms to 12min, in seconds
+THROUGHPUT_BUCKETS = tuple(2 ** (i / 2) for i in range(32))  # upper bounds from 1 to 46341 tokens/s
+
+
+class Histogram:
+    """Counts of the observed values per bucket (value <= upper bound), with count, sum, min and max"""
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last bucket holds the values above every bound
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> float:
+        """The `q`th percentile, interpolated linearly within its bucket"""
+        if not self.count:
+            return math.nan
+        rank = q / 100 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = max(self.buckets[i - 1] if i else 0.0, self.min)
+                upper = min(self.buckets[i] if i < len(self.buckets) else self.max, self.max)
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.max
+
+    def summary(self) -> Dict[str, float]:
+        if not self.count:
+            return {"count": 0}
+        return {"count": self.count, "mean": self.sum / self.count, "min": self.min, "max": self.max,
+                "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99)}
+
+
+class LatencyMetrics:
+    def __init__(self):
+        self.ttft = Histogram(LATENCY_BUCKETS)  # seconds from the request to its first delta
+        self.itl = Histogram(LATENCY_BUCKETS)  # seconds between consecutive deltas
+        self.throughput = Histogram(THROUGHPUT_BUCKETS)  # deltas per second after the first one
+
+    def observe(self, start: float, delta_times: List[float]):
+        """Record a request sent at `start` whose deltas arrived at `delta_times` (same clock)"""
+        if not delta_times:
+            return
+        self.ttft.observe(delta_times[0] - start)
+        for previous, current in zip(delta_times, delta_times[1:]):
+            self.itl.observe(current - previous)
+        if len(delta_times) > 1 and delta_times[-1] > delta_times[0]:
+            self.throughput.observe((len(delta_times) - 1) / (delta_times[-1] - delta_times[0]))
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        return {"ttft_s": self.ttft.summary(), "itl_s": self.itl.summary(),
+                "throughput_tokens_per_s": self.throughput.summary()}
+
+
+def config_label(config: InferenceConfig) -> str:
+    """The loading parameters of `config`, which determine its latency (besides `max_tokens`)"""
+    return ", ".join(f"{key}={value}" for key, value in config.load_params().items() if value is not None)
+
+
+METRICS: Dict[str, LatencyMetrics] = defaultdict(LatencyMetrics)  # config_label -> metrics of its streams
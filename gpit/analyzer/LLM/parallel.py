@@ -0,0 +1,143 @@
+"""
+Data-parallel inference over several model replicas.
+
+`DataParallelEngine(engine)` starts `config.data_parallel_size` workers of `engine` (see `worker.py`),
+each seeing only its own slice of `config.devices`, so a small model can run as one replica per GPU
+instead of one replica on all of them. The prompts of a `generate` call are cut into shards that are
+dealt round-robin to the workers' queues; a worker that runs out of shards steals from the back of the
+longest queue, so a slow replica does not hold up the whole batch. A replica that fails (after the
+restarts of its worker) leaves its shards to the others, which keep working until every shard is generated
+or every replica failed. Outputs are merged in input order.
+"""
+import math
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from gpit.analyzer.LLM.engines import Engine, GenerationTimeout
+from gpit.analyzer.LLM.inference_config import InferenceConfig
+from gpit.analyzer.LLM.worker import SubprocessEngine
+
+
+def device_groups(config: InferenceConfig) -> List[str]:
+    """`CUDA_VISIBLE_DEVICES` of every replica: consecutive slices of `tensor_parallel_size` devices"""
+    size = config.tensor_parallel_size
+    count = config.data_parallel_size * size
+    if config.devices:
+        devices = [device.strip() for device in str(config.devices).split(",") if device.strip()]
+    else:
+        devices = [str(i) for i in range(count)]
+    if len(devices) < count:
+        raise ValueError(f"{config.data_parallel_size} replicas of {size} devices need {count} devices "
+                         f"but got {len(devices)} ({config.devices})")
+    return [",".join(devices[i:i + size]) for i in range(0, count, size)]
+
+
+class DataParallelEngine(Engine):
+    """
+    Args:
+        engine: engine of every replica (its class is instantiated in every worker process)
+        shard_size: prompts per shard, by default a quarter of each replica's share of a `generate` call
+    """
+
+    def __init__(self, engine: Engine, shard_size: int = None):
+        super().__init__()
+        self.engine = engine
+        self.shard_size = shard_size
+        self.replicas: List[SubprocessEngine] = []
+        self.shards = []  # shards generated by every replica since loading
+        self.stolen = 0  # shards generated by a replica other than the one they were dealt to
+
+    def ensure_loaded(self, config: InferenceConfig):
+        """Like `Engine.ensure_loaded`, also reloading when the devices of the replicas change; the replicas get the
+        sampling/timeout settings of `config` as well"""
+        if self.config is not None and device_groups(self.config) != device_groups(config):
+            self.close()
+        super().ensure_loaded(config)
+        for replica in self.replicas:
+            replica.ensure_loaded(config)
+
+    def load(self, config: InferenceConfig):
+        self.replicas = [SubprocessEngine(self.engine, env={"CUDA_VISIBLE_DEVICES": devices})
+                         for devices in device_groups(config)]
+        self.shards = [0] * len(self.replicas)
+        self.config = config
+        with ThreadPoolExecutor(len(self.replicas)) as executor:  # load the replicas at the same time
+            for future in [executor.submit(replica.load, config) for replica in self.replicas]:
+                future.result()
+
+    def generate(self, prompts, temperature, top_p, repetition_penalty, max_tokens, system_content=None,
+                 json_schema=None):
+        params = {"temperature": temperature, "top_p": top_p, "repetition_penalty": repetition_penalty,
+                  "max_tokens": max_tokens, "system_content": system_content}
+        if json_schema is not None:
+            params["json_schema"] = json_schema
+        shard_size = self.shard_size or max(1, math.ceil(len(prompts) / (4 * len(self.replicas))))
+        queues = [deque() for _ in self.replicas]
+        for i, start in enumerate(range(0, len(prompts), shard_size)):
+            queues[i % len(queues)].append(range(start, min(start + shard_size, len(prompts))))
+        outputs = [None] * len(prompts)
+        errors, timeouts = [], []
+        in_flight = [0]  # shards being generated, which a failing replica gives back
+        changed = threading.Condition()
+
+        def next_shard(replica: int):
+            with changed:
+                while True:
+                    if queues[replica]:
+                        shard = queues[replica].popleft()
+                    else:
+                        victim = max(range(len(queues)), key=lambda i: len(queues[i]))
+                        if not queues[victim]:
+                            if not in_flight[0]:
+                                return None
+                            changed.wait()  # until a shard is done or given back
+                            continue
+                        self.stolen += 1
+                        shard = queues[victim].pop()
+                    in_flight[0] += 1
+                    return shard
+
+        def work(replica: int):
+            while (shard := next_shard(replica)) is not None:
+                engine = self.replicas[replica]
+                prompt_tokens, cached_tokens = engine.prompt_tokens, engine.cached_tokens
+                try:
+                    results = engine.generate([prompts[i] for i in shard], **params)
+                    if len(results) != len(shard):
+                        raise RuntimeError(f"returned {len(results)} outputs for {len(shard)} prompts")
+                except GenerationTimeout as e:  # the replica is fine: the shard keeps its finished outputs
+                    results = e.outputs
+                    timeouts.append(str(e))
+                except Exception as e:
+                    with changed:  # give the shard back to the replicas that are still working
+                        queues[replica].append(shard)
+                        errors.append(f"replica {replica} ({engine.env['CUDA_VISIBLE_DEVICES']}): {e}")
+                        in_flight[0] -= 1
+                        changed.notify_all()
+                    return
+                for i, result in zip(shard, results):
+                    outputs[i] = result
+                with changed:
+                    self.shards[replica] += 1
+                    self.prompt_tokens += engine.prompt_tokens - prompt_tokens
+                    self.cached_tokens += engine.cached_tokens - cached_tokens
+                    in_flight[0] -= 1
+                    changed.notify_all()
+
+        with ThreadPoolExecutor(len(self.replicas)) as executor:
+            list(executor.map(work, range(len(self.replicas))))
+        left = sum(len(queue) for queue in queues)
+        if left:  # every replica failed
+            raise RuntimeError(f"{left} shards were not generated: {'; '.join(errors)}")
+        if timeouts:
+            raise GenerationTimeout(f"{outputs.count(None)} of {len(prompts)} prompts did not finish "
+                                    f"({timeouts[0]})", outputs)
+        return outputs
+
+    def close(self):
+        for replica in self.replicas:
+            replica.close()
+        self.replicas = []
+        super().close()
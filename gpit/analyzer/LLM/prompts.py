@@ -0,0 +1,167 @@
+"""
+Token-budgeted prompt rendering.
+
+`PromptBuilder` fills the prompt template with the columns of every row, but first compresses
+logs and code (optional, see `compress.py`) and truncates each field to its token budget, keeping the head and the tail of long fields (the error of a long log
+is usually at its end). Tokens are counted with the model's tokenizer when it can be loaded, and
+with a word/punctuation approximation otherwise. The token length of every rendered prompt is
+returned too, so requests of similar length can be batched together.
+
+With `prefix_first`, the static instructions at the end of the template are moved in front of the
+issue fields, so every prompt starts with the same text and the engine's prefix cache can reuse its
+KV cache instead of prefilling the instructions again for every issue.
+"""
+import re
+from collections import Counter, defaultdict
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple
+
+import pandas as pd
+
+from gpit.utils.logging import ANA_LOG
+
+
+WORD_PATTERN = re.compile(r"\w+|[^\w\s]")
+FIELD_PATTERN = re.compile(r"{(\w+)}")
+MAX_CHARS_PER_TOKEN = 16  # longer texts are cut by characters before tokenizing, the rest would be truncated anyway
+
+
+def text_fields(df: pd.DataFrame) -> pd.DataFrame:
+    """Every column as text with lower-cased names, missing values as `nan` (what the prompt template expects)"""
+    return df.astype(object).fillna("nan").astype(str).rename(columns=str.lower)
+
+
+def render_prompts(df: pd.DataFrame, template: str) -> List[str]:
+    """Fill the `{field}`s of the template with the lower-cased columns of every row (missing values as `nan`)"""
+    rows = text_fields(df).to_dict("records")
+    try:
+        return [template.format_map(row) for row in rows]
+    except KeyError as e:
+        raise ValueError(f"prompt_template field {e} is not a column of the dataset ({', '.join(df.columns)})")
+
+
+def prefix_layout(template: str) -> str:
+    """`template` with the instructions following the line of its last field moved in front of its first field"""
+    fields = list(FIELD_PATTERN.finditer(template))
+    end = template.find("\n", fields[-1].end()) if fields else -1
+    if end == -1 or not template[end:].strip():
+        return template
+    return f"{template[end:].strip()}\n\n{template[:end].strip()}\n"
+
+
+def load_tokenizer(model_path: str):
+    """The (fast) tokenizer of the model, or None when transformers or the tokenizer are unavailable"""
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(model_path)
+    except Exception as e:  # ImportError, no network/cache, ...
+        ANA_LOG.warning(f"gpit can not load the tokenizer of {model_path} ({type(e).__name__}), "
+                        f"token counts are approximated")
+        return None
+    if not getattr(tokenizer, "is_fast", False):  # slow tokenizers have no offset mapping
+        ANA_LOG.warning(f"gpit has no fast tokenizer for {model_path}, token counts are approximated")
+        return None
+    return tokenizer
+
+
+class Prompts(NamedTuple):
+    prompts: List[str]
+    lengths: List[int]  # (approximate) tokens of every prompt
+    saved: List[int]  # tokens removed by the compressor from every row's fields
+
+
+class PromptBuilder:
+    """
+    Args:
+        template: prompt template with `{field}`s (lower-cased column names)
+        budgets: max tokens per field, e.g. {"title": 64, "body": 1536, "code": 1024}; other fields are not truncated
+        tokenizer: fast Hugging Face tokenizer, None to approximate tokens by words and punctuation marks
+        head_ratio: share of a truncated field's budget kept from its head (the rest is kept from its tail)
+        compressor: applied to the `compress` fields before truncation, e.g. `compress.LogCompressor()`
+        prefix_first: render the template with its static instructions first (see `prefix_layout`)
+    """
+
+    def __init__(self, template: str, budgets: Dict[str, int] = None, tokenizer=None,
+                 head_ratio: Dict[str, float] = None, compressor: Callable[[str], str] = None,
+                 compress: Sequence[str] = ("body", "code"), prefix_first: bool = False):
+        self.template = prefix_layout(template) if prefix_first else template
+        self.compressor = compressor
+        self.compress = {field.lower() for field in compress}
+        self.budgets = {field.lower(): int(budget) for field, budget in (budgets or {}).items()}
+        self.tokenizer = tokenizer
+        self.head_ratio = {"title": 1.0, **(head_ratio or {})}
+        self.template_tokens = len(self.offsets([self.template.format_map(defaultdict(str))])[0])
+        # static text every prompt starts with
+        self.prefix = self.template[:match.start()] if (match := FIELD_PATTERN.search(self.template)) else self.template
+        self.prefix_tokens = len(self.offsets([self.prefix])[0])
+
+    def params(self) -> Dict:
+        """Everything besides the rows that determines the prompts"""
+        compressor = self.compressor
+        return {"template": self.template, "budgets": self.budgets, "head_ratio": self.head_ratio,
+                "compress": sorted(self.compress), "tokenizer": getattr(self.tokenizer, "name_or_path", None),
+                "compressor": None if compressor is None else
+                {"name": getattr(compressor, "__qualname__", type(compressor).__qualname__),
+                 **getattr(compressor, "__dict__", {})}}
+
+    def offsets(self, texts: List[str]) -> List[List[Tuple[int, int]]]:
+        """(start, end) character offsets of the tokens of every text"""
+        if self.tokenizer is None:
+            return [[match.span() for match in WORD_PATTERN.finditer(text)] for text in texts]
+        encoded = self.tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True)
+        return [[tuple(offset) for offset in offsets] for offsets in encoded["offset_mapping"]]
+
+    def truncate(self, texts: List[str], budget: int, head_ratio: float = 0.5) -> Tuple[List[str], List[int]]:
+        """Cut every text to at most `budget` tokens (plus a marker), keeping its head and tail; return the token counts"""
+        max_chars = budget * MAX_CHARS_PER_TOKEN
+        head_chars = int(max_chars * head_ratio)
+        texts = [text if len(text) <= max_chars else text[:head_chars] + text[len(text) - max_chars + head_chars:]
+                 for text in texts]
+        results, counts = [], []
+        for text, offsets in zip(texts, self.offsets(texts)):
+            if len(offsets) <= budget:
+                results.append(text)
+                counts.append(len(offsets))
+                continue
+            head = int(budget * head_ratio)
+            tail = budget - head
+            head_end = offsets[head - 1][1] if head else 0
+            if not tail:  # head only (e.g. titles): stay on one line
+                results.append(text[:head_end] + " ...")
+            else:
+                results.append(text[:head_end] + "\n[... truncated ...]\n" + text[offsets[len(offsets) - tail][0]:])
+            counts.append(budget)
+        return results, counts
+
+    def count(self, texts: List[str]) -> List[int]:
+        return [len(offsets) for offsets in self.offsets(texts)]
+
+    def build(self, df: pd.DataFrame) -> Prompts:
+        """Rendered prompts of the rows of `df`, their token lengths and the tokens saved by compression"""
+        fields = text_fields(df)
+        lengths = pd.Series(self.template_tokens, index=fields.index)
+        saved = pd.Series(0, index=fields.index)
+        for field, occurrences in Counter(FIELD_PATTERN.findall(self.template)).items():
+            if field not in fields.columns:
+                continue
+            texts = fields[field].tolist()
+            if self.compressor is not None and field in self.compress:
+                compressed = [self.compressor(text) for text in texts]
+                changed = [i for i, (text, new) in enumerate(zip(texts, compressed)) if new != text]
+                if changed:
+                    before = self.count([texts[i] for i in changed])
+                    after = self.count([compressed[i] for i in changed])
+                    saved.iloc[changed] += [(b - a) * occurrences for b, a in zip(before, after)]
+                texts = compressed
+            if field in self.budgets:
+                texts, counts = self.truncate(texts, self.budgets[field], self.head_ratio.get(field, 0.5))
+            else:
+                counts = self.count(texts)
+            fields[field] = texts
+            lengths += [count * occurrences for count in counts]
+        return Prompts(render_prompts(fields, self.template), lengths.tolist(), saved.tolist())
+
+
+def length_buckets(lengths: Sequence[int], batch_size: int) -> List[List[int]]:
+    """Positions grouped into batches of `batch_size` of similar length, the longest batch first"""
+    order = sorted(range(len(lengths)), key=lambda i: -lengths[i])
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
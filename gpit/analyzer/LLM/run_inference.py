@@ -5,11 +5,37 @@ Provides command line interface to use the inference system
 """
 
 import argparse
+import asyncio
+import json
 import sys
 import time
-from engines import VllmEngine, SglangEngine
-from inference import infer
-from inference_config import config_manager, load_inference_config
+from gpit.analyzer.LLM.chat import ChatSession, format_turn
+from gpit.analyzer.LLM.engines import ENGINES
+from gpit.analyzer.LLM.inference import infer, stream
+from gpit.analyzer.LLM.inference_config import config_manager, load_inference_config
+from gpit.analyzer.LLM.metrics import METRICS
+from gpit.analyzer.LLM.worker import SubprocessEngine
+
+
+def print_stream(engine, prompt, model, **kwargs) -> str:
+    """Print the output of `prompt` as it is generated; return its TTFT and throughput"""
+    start, delta_times = time.perf_counter(), []
+
+    async def run():
+        async for delta in stream(engine, prompt, model, **kwargs):  # recorded in METRICS as well
+            delta_times.append(time.perf_counter())
+            print(delta, end="", flush=True)
+
+    try:
+        asyncio.run(run())
+    finally:
+        print()
+    if not delta_times:
+        return "no output"
+    stats = f"TTFT {delta_times[0] - start:.2f}s"
+    if len(delta_times) > 1 and delta_times[-1] > delta_times[0]:
+        stats += f", {(len(delta_times) - 1) / (delta_times[-1] - delta_times[0]):.1f} tokens/s"
+    return stats
 
 
 def main():
@@ -19,21 +45,24 @@ def main():
         epilog="""
 Usage examples:
   # Use predefined config
-  python run_inference.py -e vllm -m qwen_small -p "Hello, who are you?"
+  python -m gpit.analyzer.LLM.run_inference -e vllm -m qwen_small -p "Hello, who are you?"
   
   # Use custom parameters
-  python run_inference.py -e vllm -m "Qwen/Qwen3-1.7B" -p "Explain machine learning" --temperature 0.8 --max-tokens 200
+  python -m gpit.analyzer.LLM.run_inference -e vllm -m "Qwen/Qwen3-1.7B" -p "Explain machine learning" --temperature 0.8 --max-tokens 200
   
   # List available configs
-  python run_inference.py --list-configs
+  python -m gpit.analyzer.LLM.run_inference --list-configs
   
-  # Interactive mode
-  python run_inference.py -e vllm -m qwen_small --interactive
+  # Stream the output as it is generated
+  python -m gpit.analyzer.LLM.run_inference -e vllm -m qwen_small -p "Hello, who are you?" --stream
+
+  # Interactive chat (streamed) on a warm engine, keeping the last 10 turns, printing the latency histograms on exit
+  python -m gpit.analyzer.LLM.run_inference -e vllm -m qwen_small --interactive --max-turns 10 --metrics
         """
     )
     
     parser.add_argument('-e', '--engine', 
-                       choices=['vllm', 'sglang'], 
+                       choices=list(ENGINES), 
                        default='vllm',
                        help='Inference engine type (default: vllm)')
     
@@ -58,11 +87,23 @@ Usage examples:
     parser.add_argument('--timeout', type=int,
                        help='Inference timeout in seconds')
     
+    parser.add_argument('--isolate', action='store_true',
+                       help='Run the engine in a separate worker process')
+    
     parser.add_argument('--list-configs', action='store_true',
                        help='List all available configurations')
     
     parser.add_argument('--interactive', action='store_true',
-                       help='Enter interactive mode')
+                       help='Enter interactive chat mode (outputs are streamed, history is kept)')
+    
+    parser.add_argument('--max-turns', type=int,
+                       help='Turns of history sent in interactive mode (default: all)')
+    
+    parser.add_argument('--stream', action='store_true',
+                       help='Stream the output of the prompt as it is generated')
+    
+    parser.add_argument('--metrics', action='store_true',
+                       help='Print the TTFT, inter-token latency and throughput histograms of the streamed outputs')
     
     parser.add_argument('--verbose', action='store_true',
                        help='Verbose output')
@@ -88,13 +129,10 @@ Usage examples:
         sys.exit(1)
     
     # Create engine
-    if args.engine == 'vllm':
-        engine = VllmEngine()
-    elif args.engine == 'sglang':
-        engine = SglangEngine()
-    else:
-        print(f"Error: Unsupported engine type {args.engine}")
-        sys.exit(1)
+    engine = ENGINES[args.engine]()
+    
+    if args.isolate:
+        engine = SubprocessEngine(engine)
     
     print(f"Using {args.engine.upper()} engine, model: {args.model}")
     
@@ -113,7 +151,10 @@ Usage examples:
     
     # Interactive mode
     if args.interactive:
-        print("\nEntering interactive mode (type 'quit' or 'exit' to exit)")
+        session = ChatSession(engine, args.model, max_turns=args.max_turns, **kwargs)
+        session.load()  # in the main thread, before the first question
+        print("\nEntering interactive mode (type 'quit' or 'exit' to exit, '/reset' to start a new conversation, "
+              "'/stats' for the session's statistics)")
         print("-" * 50)
         
         while True:
@@ -124,25 +165,31 @@ Usage examples:
                     print("Goodbye!")
                     break
                 
-                if not prompt:
+                if prompt == '/reset':
+                    session.reset()
+                    print("History cleared")
                     continue
                 
-                print(f"\nInferring... (engine: {args.engine})")
-                start_time = time.time()
-                
-                result = infer(
-                    engine=engine,
-                    prompts=prompt,
-                    model=args.model,
-                    **kwargs
-                )
+                if prompt == '/stats':
+                    print(json.dumps(session.summary(), indent=2))
+                    continue
                 
-                end_time = time.time()
+                if not prompt:
+                    continue
                 
-                print(f"\nAnswer (time elapsed: {end_time - start_time:.2f} seconds):")
+                print(f"\nAnswer (engine: {args.engine}, turn {len(session.messages) // 2 + 1}):")
                 print("-" * 30)
-                print(result)
+                
+                async def run():
+                    async for delta in session.stream(prompt):
+                        print(delta, end="", flush=True)
+                
+                try:
+                    asyncio.run(run())
+                finally:
+                    print()
                 print("-" * 30)
+                print(format_turn(session.turns[-1]))
                 
             except KeyboardInterrupt:
                 print("\n\nUser interrupted, exiting...")
@@ -164,22 +211,29 @@ Usage examples:
             print(f"Parameters: {kwargs}")
         
         try:
-            print("\nInferring...")
-            start_time = time.time()
-            
-            result = infer(
-                engine=engine,
-                prompts=args.prompt,
-                model=args.model,
-                **kwargs
-            )
-            
-            end_time = time.time()
-            
-            print(f"\nInference result (time elapsed: {end_time - start_time:.2f} seconds):")
-            print("=" * 50)
-            print(result)
-            print("=" * 50)
+            if args.stream:
+                print("\nInference result:")
+                print("=" * 50)
+                stats = print_stream(engine, args.prompt, args.model, **kwargs)
+                print("=" * 50)
+                print(stats)
+            else:
+                print("\nInferring...")
+                start_time = time.time()
+                
+                result = infer(
+                    engine=engine,
+                    prompts=args.prompt,
+                    model=args.model,
+                    **kwargs
+                )
+                
+                end_time = time.time()
+                
+                print(f"\nInference result (time elapsed: {end_time - start_time:.2f} seconds):")
+                print("=" * 50)
+                print(result)
+                print("=" * 50)
             
         except Exception as e:
             print(f"Inference failed: {e}")
@@ -187,6 +241,10 @@ Usage examples:
                 import traceback
                 traceback.print_exc()
             sys.exit(1)
+    
+    if args.metrics:
+        print(json.dumps({label: metrics.summary() for label, metrics in METRICS.items()}, indent=2))
+    engine.close()
 
 
 if __name__ == "__main__":
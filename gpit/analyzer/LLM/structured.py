@@ -0,0 +1,157 @@
+"""
+Structured (JSON) outputs of the analysis.
+
+Every analysis task has a JSON schema in `SCHEMAS`. With `InferenceConfig.json_schema` set, the engines
+constrain decoding to the schema (vLLM guided decoding, SGLang `json_schema`, OpenAI `response_format`),
+so every output parses and no generation has to be re-run or re-parsed with regexes. The fields are
+short, so `schema_max_tokens` bounds the output tokens far below a free-text `max_tokens`, and
+`analysis.analyze_csv` writes every property to its own typed column (`column_name`).
+Only the subset of JSON schema used here is validated: object properties/required, string (enum,
+maxLength), boolean, integer and number (minimum, maximum). OpenAI's `strict` structured outputs reject
+such constraints: `strict_schema` moves them into the descriptions, and they are still validated when parsed.
+"""
+import hashlib
+import json
+import re
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+
+MEMORY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "memory_related": {"type": "boolean"},
+        "category": {"type": "string",
+                     "enum": ["out_of_memory", "memory_leak", "high_usage", "fragmentation", "other", "none"]},
+        "device": {"type": "string", "enum": ["gpu", "cpu", "both", "unknown"]},
+        "symptom": {"type": "string", "maxLength": 300},
+        "solution": {"type": "string", "maxLength": 300},
+        "confidence": {"type": "integer", "minimum": 0, "maximum": 10},
+    },
+    "required": ["memory_related", "category", "device", "symptom", "solution", "confidence"],
+    "additionalProperties": False,
+}
+SCHEMAS = {"memory": MEMORY_SCHEMA}
+# keywords rejected by OpenAI `strict` structured outputs
+STRICT_UNSUPPORTED = {"minLength", "maxLength", "pattern", "format", "minimum", "maximum", "exclusiveMinimum",
+                      "exclusiveMaximum", "multipleOf", "minItems", "maxItems", "uniqueItems", "minProperties",
+                      "maxProperties", "patternProperties"}
+CHARS_PER_TOKEN = 3  # conservative for English text
+
+
+def column_name(name: str) -> str:
+    """The result column of a schema property: `memory_related` -> `MemoryRelated`"""
+    return "".join(part[:1].upper() + part[1:] for part in name.split("_"))
+
+
+def schema_columns(schema: Dict[str, Any]) -> List[str]:
+    return [column_name(name) for name in schema["properties"]]
+
+
+def typed_columns(df: pd.DataFrame, schema: Dict[str, Any]) -> pd.DataFrame:
+    """`df` with the column of every property of `schema` converted to the (nullable) dtype of its type"""
+    dtypes = {"boolean": "boolean", "integer": "Int64", "number": "Float64", "string": "string"}
+    for name, prop in schema["properties"].items():
+        column = column_name(name)
+        if column not in df.columns:
+            continue
+        dtype = "category" if "enum" in prop else dtypes.get(prop.get("type"))
+        if dtype is not None:
+            df[column] = df[column].astype(object).where(df[column].notna(), None).astype(dtype)
+    return df
+
+
+def schema_max_tokens(schema: Dict[str, Any], margin: float = 1.25) -> int:
+    """Output tokens that fit every property of `schema` at its longest, with keys and punctuation"""
+    tokens = 2
+    for name, prop in schema["properties"].items():
+        tokens += len(name) // CHARS_PER_TOKEN + 4  # key, quotes, colon, comma
+        if "enum" in prop:
+            tokens += max(len(str(value)) for value in prop["enum"]) // CHARS_PER_TOKEN + 2
+        elif prop.get("type") == "string":
+            tokens += prop.get("maxLength", 1000) // CHARS_PER_TOKEN + 2
+        else:
+            tokens += 4
+    return int(tokens * margin)
+
+
+def schema_instructions(schema: Dict[str, Any]) -> str:
+    """
+    Instructions to append to a prompt template (its braces escaped), so the model knows the fields it is
+    constrained to
+    """
+    schema = json.dumps(schema).replace("{", "{{").replace("}", "}}")
+    return f"Answer with a single JSON object matching this JSON schema:\n{schema}"
+
+
+def strict_schema(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """`schema` without the keywords of STRICT_UNSUPPORTED, each moved into the description of its (sub)schema"""
+    result = {}
+    for key, value in schema.items():
+        if key in STRICT_UNSUPPORTED:
+            continue
+        if key in ("properties", "$defs"):
+            value = {name: strict_schema(prop) for name, prop in value.items()}
+        elif key == "items":
+            value = strict_schema(value)
+        elif key == "anyOf":
+            value = [strict_schema(item) for item in value]
+        result[key] = value
+    dropped = [f"{key}: {value}" for key, value in schema.items() if key in STRICT_UNSUPPORTED]
+    if dropped:
+        result["description"] = "; ".join(filter(None, [schema.get("description"), ", ".join(dropped)]))
+    return result
+
+
+def validate(value: Any, schema: Dict[str, Any]) -> bool:
+    kind = schema.get("type")
+    if "enum" in schema and value not in schema["enum"]:
+        return False
+    if kind == "object":
+        if not isinstance(value, dict) or any(name not in value for name in schema.get("required", [])):
+            return False
+        properties = schema.get("properties", {})
+        if schema.get("additionalProperties") is False and set(value) - set(properties):
+            return False
+        return all(validate(value[name], prop) for name, prop in properties.items() if name in value)
+    if kind == "string":
+        return isinstance(value, str) and len(value) <= schema.get("maxLength", len(value))
+    if kind == "boolean":
+        return isinstance(value, bool)
+    if kind in ("integer", "number"):
+        if isinstance(value, bool) or not isinstance(value, int if kind == "integer" else (int, float)):
+            return False
+        return schema.get("minimum", value) <= value <= schema.get("maximum", value)
+    return True
+
+
+def parse_structured(output: str, schema: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The JSON object of `output` (after a thinking block, if any) when it matches `schema`, else None"""
+    answer = re.sub(r"<think>.*?(</think>|$)", "", output, flags=re.DOTALL)
+    start, end = answer.find("{"), answer.rfind("}")
+    if start == -1 or end < start:
+        return None
+    try:
+        value = json.loads(answer[start:end + 1])
+    except ValueError:
+        return None
+    return value if validate(value, schema) else None
+
+
+def example_instance(schema: Dict[str, Any], seed: str) -> Any:
+    """A deterministic value of `schema` derived from `seed` (outputs of the fake engine)"""
+    digest = hashlib.sha256(seed.encode("utf-8")).hexdigest()
+    kind = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][int(digest[:8], 16) % len(schema["enum"])]
+    if kind == "object":
+        return {name: example_instance(prop, f"{seed}|{name}") for name, prop in schema.get("properties", {}).items()}
+    if kind == "string":
+        return f"fake:{digest[:16]}"[:schema.get("maxLength", 21)]
+    if kind == "boolean":
+        return int(digest[:8], 16) % 2 == 0
+    if kind in ("integer", "number"):
+        low, high = schema.get("minimum", 0), schema.get("maximum", 100)
+        return int(low + int(digest[:8], 16) % (int(high - low) + 1))
+    return None
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Optional subprocess isolation for inference engines
+
+`SubprocessEngine(engine)` runs `engine` in a long-lived worker process that loads the model
+once and serves `generate` and `stream` calls over its stdin/stdout. Messages are framed as a
+4-byte big-endian length followed by UTF-8 JSON:
+
+    request:  {"prompts": ["..."], "params": {"temperature": 0.7, ..., "system_content": "..."}, "timeout": 300}
+    response: {"outputs": ["..."], "prompt_tokens": 123, "cached_tokens": 45}  or  {"error": "..."}
+              (a GenerationTimeout error also holds the "outputs" of the prompts that finished, null for the others)
+
+    request:  {"prompt": "...", "params": {...}, "stream": true}
+    response: {"delta": "..."} per delta, then {"done": true, "prompt_tokens": 123, "cached_tokens": 45}
+              (or {"error": "..."})
+
+The engine aborts the unfinished requests of a `generate` call after its `timeout` and answers with a
+GenerationTimeout, so the worker (and its model) is kept; a worker that does not answer within `ABORT_GRACE` more seconds is killed.
+
+The wrapped engine class is imported by the worker from its module, so it must not be
+defined in `__main__` and must be constructible without arguments.
+"""
+
+import asyncio
+import importlib
+import json
+import os
+import select
+import struct
+import subprocess
+import sys
+from dataclasses import replace
+from typing import Any, BinaryIO, Dict, Iterator, List
+
+from gpit.analyzer.LLM.engines import Engine, GenerationTimeout, iterate_in_thread
+from gpit.analyzer.LLM.inference_config import InferenceConfig
+
+
+HEADER = struct.Struct(">I")
+
+
+def write_frame(stream: BinaryIO, message: Dict[str, Any]):
+    data = json.dumps(message).encode("utf-8")
+    stream.write(HEADER.pack(len(data)) + data)
+    stream.flush()
+
+
+def _read_exact(stream: BinaryIO, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = stream.read(size - len(data))
+        if not chunk:
+            raise EOFError("Inference worker pipe closed")
+        data += chunk
+    return data
+
+
+def read_frame(stream: BinaryIO) -> Dict[str, Any]:
+    (size,) = HEADER.unpack(_read_exact(stream, HEADER.size))
+    return json.loads(_read_exact(stream, size).decode("utf-8"))
+
+
+def engine_path(engine: Engine) -> str:
+    return f"{type(engine).__module__}:{type(engine).__qualname__}"
+
+
+ABORT_GRACE = 10  # seconds a worker has after a timeout to abort its requests before it is killed
+
+
+def engine_class(path: str) -> type:
+    module, name = path.split(":")
+    return getattr(importlib.import_module(module), name)
+
+
+async def write_deltas(engine: Engine, request: Dict[str, Any], responses: BinaryIO):
+    async for delta in engine.stream(request["prompt"], **request["params"]):
+        write_frame(responses, {"delta": delta})
+
+
+def serve(engine: Engine, config: InferenceConfig):
+    """Worker main loop"""
+    # engines print their logs to stdout: keep the real stdout for responses and send everything else to stderr
+    responses = os.fdopen(os.dup(sys.stdout.fileno()), "wb", buffering=0)
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    requests = sys.stdin.buffer
+
+    engine.load(config)
+    write_frame(responses, {"ready": True})
+    while True:
+        try:
+            request = read_frame(requests)
+        except EOFError:  # the client closed the pipe (or exited)
+            break
+        prompt_tokens, cached_tokens = engine.prompt_tokens, engine.cached_tokens
+        try:
+            if request.get("stream"):
+                asyncio.run(write_deltas(engine, request, responses))
+                response = {"done": True}
+            else:
+                if request.get("timeout") is not None:
+                    engine.config = replace(engine.config, timeout=request["timeout"])
+                response = {"outputs": engine.generate(request["prompts"], **request["params"])}
+        except GenerationTimeout as e:
+            response = {"error": f"{type(e).__name__}: {e}", "outputs": e.outputs}
+        except Exception as e:
+            response = {"error": f"{type(e).__name__}: {e}"}
+        response.update(prompt_tokens=engine.prompt_tokens - prompt_tokens,
+                        cached_tokens=engine.cached_tokens - cached_tokens)
+        write_frame(responses, response)
+    engine.close()
+
+
+class SubprocessEngine(Engine):
+    """
+    Runs `engine` in a worker process, restarted (up to `max_restarts` times in a row) when it crashes.
+    `env` is added to the environment of the worker, e.g. {"CUDA_VISIBLE_DEVICES": "0,1"}.
+    """
+
+    def __init__(self, engine: Engine, max_restarts: int = 3, env: Dict[str, str] = None):
+        super().__init__()
+        self.engine = engine
+        self.max_restarts = max_restarts
+        self.env = env or {}
+        self.process = None
+        self.restarts = 0
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def load(self, config: InferenceConfig):
+        self.config = config
+        self._start()
+
+    def _start(self):
+        # the worker has to import the engine's module the way this process did
+        env = {**os.environ, **self.env, "PYTHONPATH": os.pathsep.join(path or os.getcwd() for path in sys.path)}
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gpit.analyzer.LLM.worker", "--engine", engine_path(self.engine),
+             "--config", json.dumps(self.config.to_dict())],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=0, env=env
+        )
+        try:
+            read_frame(self.process.stdout)  # blocks while the model is loading
+        except EOFError:
+            returncode = self.process.wait()
+            self.process = None
+            raise RuntimeError(f"Inference worker exited while loading the model (exit code {returncode})")
+
+    def _stop(self):
+        if self.process is not None:
+            if self.process.poll() is None:
+                self.process.kill()
+            self.process.wait()
+            self.process = None
+
+    def _read(self, timeout: float = None) -> Dict[str, Any]:
+        if timeout is not None:  # the engine aborts the request itself after `timeout`
+            timeout += min(timeout, ABORT_GRACE)
+        readable, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not readable:
+            self._stop()  # a stuck worker can not serve the next request either
+            raise TimeoutError(f"Inference worker did not answer within {timeout} seconds")
+        return read_frame(self.process.stdout)
+
+    def _request(self, message: Dict[str, Any], timeout: float = None) -> Dict[str, Any]:
+        write_frame(self.process.stdin, message)
+        return self._read(timeout)
+
+    def generate(self, prompts, temperature, top_p, repetition_penalty, max_tokens, system_content=None,
+                 json_schema=None) -> List[str]:
+        params = {"temperature": temperature, "top_p": top_p, "repetition_penalty": repetition_penalty,
+                  "max_tokens": max_tokens, "system_content": system_content}
+        if json_schema is not None:
+            params["json_schema"] = json_schema
+        while True:
+            try:
+                if not self.alive:
+                    self._start()
+                response = self._request({"prompts": list(prompts), "params": params, "timeout": self.config.timeout},
+                                         timeout=self.config.timeout)
+                self.restarts = 0
+                break
+            except (BrokenPipeError, EOFError, RuntimeError) as e:
+                self._stop()
+                if self.restarts >= self.max_restarts:
+                    raise RuntimeError(f"Inference worker crashed {self.restarts + 1} times: {e}")
+                self.restarts += 1
+        self.prompt_tokens += response.get("prompt_tokens", 0)
+        self.cached_tokens += response.get("cached_tokens", 0)
+        if "error" in response:
+            if response["error"].startswith(("GenerationTimeout:", "TimeoutError:")):  # aborted by the engine:
+                # the worker is still loaded, and the prompts that finished in time have their outputs
+                raise GenerationTimeout(f"Inference error: {response['error']}",
+                                        response.get("outputs") or [None] * len(prompts))
+            raise RuntimeError(f"Inference error: {response['error']}")
+        return response["outputs"]
+
+    def stream(self, prompt, temperature, top_p, repetition_penalty, max_tokens, system_content=None, json_schema=None):
+        params = {"temperature": temperature, "top_p": top_p, "repetition_penalty": repetition_penalty,
+                  "max_tokens": max_tokens, "system_content": system_content}
+        if json_schema is not None:
+            params["json_schema"] = json_schema
+        return iterate_in_thread(self._stream({"prompt": prompt, "params": params, "stream": True}))
+
+    def _stream(self, message: Dict[str, Any]) -> Iterator[str]:
+        if not self.alive:
+            self._start()
+        done = False
+        try:
+            write_frame(self.process.stdin, message)
+            while True:
+                response = self._read(self.config.timeout)  # the timeout applies to every delta
+                if "error" in response:
+                    done = True  # the worker is ready for the next request
+                    raise RuntimeError(f"Inference error: {response['error']}")
+                if response.get("done"):
+                    done = True
+                    self.prompt_tokens += response.get("prompt_tokens", 0)
+                    self.cached_tokens += response.get("cached_tokens", 0)
+                    return
+                yield response["delta"]
+        except (BrokenPipeError, EOFError) as e:
+            raise RuntimeError(f"Inference worker crashed while streaming: {e}")
+        finally:
+            if not done:  # a crashed worker, or a consumer that stopped early: the worker's frames are out of step
+                self._stop()
+
+    def close(self):
+        self._stop()
+        super().close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inference worker process")
+    parser.add_argument("--engine", required=True, help="Engine class as module:ClassName")
+    parser.add_argument("--config", required=True, help="InferenceConfig as JSON")
+    args = parser.parse_args()
+
+    serve(engine_class(args.engine)(), InferenceConfig.from_dict(json.loads(args.config)))
@@ -0,0 +1,168 @@
+"""
+Out-of-core text features shared by the analyzers (topic models, similarity search, classifiers).
+
+Issues are read chunk by chunk, normalized like `process_text` and hashed into a fixed-width
+sparse space, so no vocabulary has to be fitted and no chunk depends on another. Every chunk
+is stored as raw CSR arrays (`.npy`) that `FeatureStore` memory-maps back, together with the
+document frequencies needed for TF-IDF, accumulated in the same pass.
+"""
+import json
+import os
+import time
+from typing import Iterable, List, Sequence
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import HashingVectorizer
+
+from gpit.analyzer.LLM.analysis import row_keys
+from gpit.utils.logging import ANA_LOG
+
+
+class HashingFeaturizer:
+    def __init__(self, n_features: int = 2 ** 20, stopwords_file: str = "stopwords.txt", max_tokens: int = 300):
+        from gpit.utils.utils import TextNormalizer
+        self.n_features = n_features
+        self.normalizer = TextNormalizer(stopwords_file, max_tokens=max_tokens)
+        self.vectorizer = HashingVectorizer(n_features=n_features, analyzer=self.normalizer.tokens,
+                                            alternate_sign=False, norm=None, dtype=np.float32)
+
+    def transform(self, texts: Iterable[str]) -> sp.csr_matrix:
+        """Raw term counts of `texts` as a (n_texts, n_features) CSR matrix."""
+        return self.vectorizer.transform(texts).tocsr()
+
+
+def tfidf_rows(matrix: sp.csr_matrix, idf: np.ndarray) -> sp.csr_matrix:
+    """Sublinear tf, idf weighting and l2 normalization of raw counts."""
+    # scaling `data` in place is O(nnz); multiplying with diagonal matrices would be O(n_features)
+    matrix = sp.csr_matrix(matrix, dtype=np.float32, copy=True)
+    matrix.data = (1 + np.log(matrix.data)) * idf[matrix.indices]
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    norms = np.sqrt(np.bincount(rows, weights=matrix.data.astype(np.float64) ** 2, minlength=matrix.shape[0]))
+    matrix.data /= norms[rows].astype(np.float32)
+    return matrix
+
+
+def issue_text(df: pd.DataFrame, text_cols: Sequence[str] = ("Title", "Body")) -> List[str]:
+    cols = [df[col].fillna("").astype(str) for col in text_cols if col in df.columns]
+    return list(cols[0].str.cat(cols[1:], sep=" ")) if cols else [""] * len(df)
+
+
+class FeatureStore:
+    """A directory of hashed feature chunks:
+
+    - `meta.json`: n_features, n_docs, the row count of every chunk, the name of the df file and the size of the keys
+    - `df_XXXXX.npy`: document frequency of every feature (for TF-IDF) after chunk XXXXX
+    - `keys.txt`: one row key (issue link) per document, in row order
+    - `chunk_XXXXX_{data,indices,indptr}.npy`: the CSR arrays of each chunk's raw counts
+
+    `meta.json` is the commit record: it is replaced atomically after everything else of an append is written,
+    and only what it counts is read, so an interrupted append leaves the store as it was before (on disk and in
+    memory, which is only updated once meta.json is replaced).
+    """
+
+    def __init__(self, path: str, n_features: int = 2 ** 20):
+        self.path = path
+        self.meta = {"n_features": n_features, "n_docs": 0, "chunks": [], "keys_bytes": 0}
+        self.doc_freq = np.zeros(n_features, dtype=np.int64)
+        self.keys = []
+        if os.path.exists(os.path.join(path, "meta.json")):
+            self.load()
+
+    def load(self):
+        with open(os.path.join(self.path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.doc_freq = np.load(os.path.join(self.path, self.meta.get("df_file", "df.npy")))
+        with open(os.path.join(self.path, "keys.txt"), "rb") as f:
+            keys = f.read(self.meta["keys_bytes"]) if "keys_bytes" in self.meta else f.read()
+        self.keys = keys.decode("utf-8").split("\n")[:self.n_docs]  # without the keys of an interrupted append
+        self.meta.setdefault("keys_bytes", sum(len(f"{key}\n".encode("utf-8")) for key in self.keys))
+
+    @property
+    def n_features(self) -> int:
+        return self.meta["n_features"]
+
+    @property
+    def n_docs(self) -> int:
+        return self.meta["n_docs"]
+
+    def _chunk_file(self, i: int, part: str) -> str:
+        return os.path.join(self.path, f"chunk_{i:05d}_{part}.npy")
+
+    def append(self, matrix: sp.csr_matrix, keys: List[str]):
+        assert matrix.shape[1] == self.n_features, f"expected {self.n_features} features but got {matrix.shape[1]}"
+        os.makedirs(self.path, exist_ok=True)
+        i = len(self.meta["chunks"])
+        matrix.sort_indices()
+        np.save(self._chunk_file(i, "data"), matrix.data.astype(np.float32))
+        np.save(self._chunk_file(i, "indices"), matrix.indices.astype(np.int32))
+        np.save(self._chunk_file(i, "indptr"), matrix.indptr.astype(np.int64))
+        doc_freq = self.doc_freq + np.bincount(matrix.indices, minlength=self.n_features)
+        # the chunk, its keys and the new df file first, meta.json last: until meta.json is replaced, the store
+        # reads as before the append (the extra keys are dropped on load, the new files are not referenced)
+        df_file = f"df_{i:05d}.npy"
+        np.save(os.path.join(self.path, df_file), doc_freq)
+        # the keys go after the committed ones, over the keys of an interrupted (or failed) append
+        keys = [str(key) for key in keys]
+        data = "".join(f"{key}\n" for key in keys).encode("utf-8")
+        keys_file = os.path.join(self.path, "keys.txt")
+        with open(keys_file, "r+b" if os.path.exists(keys_file) else "wb") as f:
+            f.truncate(self.meta["keys_bytes"])
+            f.seek(self.meta["keys_bytes"])
+            f.write(data)
+        previous_df_file = self.meta.get("df_file", "df.npy")
+        meta = {**self.meta, "n_docs": self.n_docs + matrix.shape[0], "chunks": self.meta["chunks"] + [matrix.shape[0]],
+                "df_file": df_file, "keys_bytes": self.meta["keys_bytes"] + len(data)}
+        with open(os.path.join(self.path, "meta.json.tmp"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(os.path.join(self.path, "meta.json.tmp"), os.path.join(self.path, "meta.json"))
+        self.meta, self.doc_freq = meta, doc_freq  # committed: only now the store in memory changes
+        self.keys.extend(keys)
+        if os.path.exists(os.path.join(self.path, previous_df_file)):
+            os.remove(os.path.join(self.path, previous_df_file))
+
+    def chunk(self, i: int) -> sp.csr_matrix:
+        """Raw counts of chunk `i`, backed by memory-mapped arrays."""
+        arrays = [np.load(self._chunk_file(i, part), mmap_mode="r") for part in ("data", "indices", "indptr")]
+        return sp.csr_matrix(tuple(arrays), shape=(self.meta["chunks"][i], self.n_features), copy=False)
+
+    def idf(self) -> np.ndarray:
+        # smoothed idf, the same formula as sklearn's TfidfTransformer
+        return (np.log((1 + self.n_docs) / (1 + self.doc_freq)) + 1).astype(np.float32)
+
+    def tfidf(self, matrix: sp.csr_matrix, idf: np.ndarray = None) -> sp.csr_matrix:
+        return tfidf_rows(matrix, self.idf() if idf is None else idf)
+
+    def iter_chunks(self, tfidf: bool = False) -> Iterable[sp.csr_matrix]:
+        idf = self.idf() if tfidf else None
+        for i in range(len(self.meta["chunks"])):
+            yield self.tfidf(self.chunk(i), idf) if tfidf else self.chunk(i)
+
+    def matrix(self, tfidf: bool = False) -> sp.csr_matrix:
+        return sp.vstack(list(self.iter_chunks(tfidf)), format="csr")
+
+
+def featurize_csv(file: str, store_path: str, n_features: int = 2 ** 20, text_cols: Sequence[str] = ("Title", "Body"),
+                  key_col: str = "Link", chunksize: int = 20000) -> FeatureStore:
+    """Hash the issues of `file` into the store at `store_path`; rows whose key is already stored are skipped,
+    so re-running after a delta sync only featurizes the new issues."""
+    start_time = time.time()
+    store = FeatureStore(store_path, n_features=n_features)
+    featurizer = HashingFeaturizer(n_features=store.n_features)
+    seen = set(store.keys)
+    added = 0
+    for chunk in pd.read_csv(file, chunksize=chunksize):
+        keys = row_keys(chunk, key_col)
+        new_rows = ~keys.isin(seen).to_numpy()
+        if not new_rows.any():
+            continue
+        chunk, keys = chunk[new_rows], keys[new_rows]
+        store.append(featurizer.transform(issue_text(chunk, text_cols)), list(keys))
+        seen.update(keys)
+        added += len(chunk)
+    ANA_LOG.info(f"gpit hashed {added} new docs into {store_path} ({store.n_docs} in total) "
+                 f"in {time.time() - start_time:.2f}s")
+    return store
@@ -0,0 +1,168 @@
+"""
+"Similar issues" search over the hashed TF-IDF features of every collected repo.
+
+The sparse TF-IDF rows are projected to dense `dim`-dimensional embeddings (truncated SVD
+over the hashed columns that occur in at least `min_df` issues) and indexed with an IVF structure: k-means cells, each holding the ids of the embeddings
+closest to its centroid. A query only scans the `nprobe` cells nearest to it.
+"""
+import json
+import os
+import time
+from typing import Dict, List, Sequence
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+
+from gpit.analyzer.features import FeatureStore, HashingFeaturizer, tfidf_rows
+from gpit.processors.topk import top_k_positions
+from gpit.utils.logging import ANA_LOG
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return (vectors / norms).astype(np.float32)
+
+
+class SimilarityIndex:
+    """
+    Persistent IVF index; `path` holds `meta.json`, `keys.txt`, `vectors.npy`, `cells.npy`,
+    `centroids.npy`, `idf.npy`, the kept hashed columns (`columns.npy`) and the SVD projection
+    of those columns (`projection.npy`).
+
+    `meta.json` also records how many rows of every feature store were ingested, so `update`
+    only embeds and inserts the rows added to the stores since (e.g. after a delta sync).
+    """
+
+    def __init__(self, path: str, dim: int = 128, nprobe: int = 8, min_df: int = 2):
+        self.path = path
+        self.meta = {"dim": dim, "nprobe": nprobe, "min_df": min_df, "ingested": {}}
+        self.keys: List[str] = []
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.cells = np.empty(0, dtype=np.int64)
+        self.centroids = None
+        self.idf = None
+        self.columns = self.projection = None
+        self._column_map = self._order = self._offsets = None
+        if os.path.exists(os.path.join(path, "meta.json")):
+            self.load()
+
+    def load(self):
+        with open(os.path.join(self.path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        with open(os.path.join(self.path, "keys.txt"), "r", encoding="utf-8") as f:
+            self.keys = [line.rstrip("\n") for line in f]
+        self.vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+        self.cells = np.load(os.path.join(self.path, "cells.npy"))
+        self.centroids = np.load(os.path.join(self.path, "centroids.npy"))
+        self.idf = np.load(os.path.join(self.path, "idf.npy"))
+        self.columns = np.load(os.path.join(self.path, "columns.npy"))
+        self.projection = np.load(os.path.join(self.path, "projection.npy"))
+        self._build_lists()
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        np.save(os.path.join(self.path, "vectors.npy"), np.asarray(self.vectors))
+        np.save(os.path.join(self.path, "cells.npy"), self.cells)
+        np.save(os.path.join(self.path, "centroids.npy"), self.centroids)
+        np.save(os.path.join(self.path, "idf.npy"), self.idf)
+        np.save(os.path.join(self.path, "columns.npy"), self.columns)
+        np.save(os.path.join(self.path, "projection.npy"), self.projection)
+        with open(os.path.join(self.path, "keys.txt"), "w", encoding="utf-8") as f:
+            f.writelines(f"{key}\n" for key in self.keys)
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+
+    def _build_lists(self):
+        # ids grouped by cell: the members of cell c are _order[_offsets[c]:_offsets[c + 1]]
+        self._order = np.argsort(self.cells, kind="stable")
+        self._offsets = np.searchsorted(self.cells[self._order], np.arange(len(self.centroids) + 1))
+
+    def compact(self, tfidf: sp.csr_matrix) -> sp.csr_matrix:
+        """Keep only the indexed columns (renumbered), dropping hashed columns that never occur."""
+        if self._column_map is None:
+            self._column_map = np.full(len(self.idf), -1, dtype=np.int64)
+            self._column_map[self.columns] = np.arange(len(self.columns))
+        coo = tfidf.tocoo()
+        cols = self._column_map[coo.col]
+        kept = cols >= 0
+        return sp.csr_matrix((coo.data[kept], (coo.row[kept], cols[kept])), shape=(tfidf.shape[0], len(self.columns)))
+
+    def embed(self, tfidf: sp.csr_matrix) -> np.ndarray:
+        return normalize_rows(self.compact(tfidf) @ self.projection)
+
+    def _new_rows(self, stores: Sequence[FeatureStore]):
+        for store in stores:
+            start = self.meta["ingested"].get(store.path, 0)
+            row = 0
+            for chunk, n_rows in zip(store.iter_chunks(), store.meta["chunks"]):
+                if row + n_rows > start:
+                    skip = max(start - row, 0)
+                    yield store, chunk[skip:], store.keys[row + skip:row + n_rows]
+                row += n_rows
+
+    def build(self, stores: Sequence[FeatureStore], n_cells: int = None, sample_size: int = 50000,
+              random_state: int = 0):
+        """Fit the projection and the cells on a random sample of the stores, then insert every row."""
+        start_time = time.time()
+        self.meta["ingested"] = {}
+        self.keys, self.cells = [], np.empty(0, dtype=np.int64)
+        # one idf over all stores, kept fixed afterwards so inserted and queried rows are weighted alike
+        n_docs = sum(store.n_docs for store in stores)
+        doc_freq = sum(store.doc_freq for store in stores)
+        self.idf = (np.log((1 + n_docs) / (1 + doc_freq)) + 1).astype(np.float32)
+        self.columns = np.flatnonzero(doc_freq >= self.meta["min_df"])
+        self._column_map = None
+
+        rng = np.random.default_rng(random_state)
+        keep = min(sample_size / max(n_docs, 1), 1.0)
+        sample = sp.vstack([self.compact(tfidf_rows(chunk[rng.random(chunk.shape[0]) < keep], self.idf))
+                            for _, chunk, _ in self._new_rows(stores)], format="csr")
+        if min(sample.shape) < 3:
+            raise ValueError(f"too few issues or terms to build a similarity index: {sample.shape}")
+        svd = TruncatedSVD(n_components=min(self.meta["dim"], sample.shape[0] - 1, sample.shape[1] - 1),
+                           random_state=random_state).fit(sample)
+        # (n_columns, dim) and C-contiguous, so embedding a sparse row is a cheap sparse @ dense product
+        self.projection = np.ascontiguousarray(svd.components_.T, dtype=np.float32)
+        self.meta["dim"] = svd.n_components
+        self.vectors = np.empty((0, self.meta["dim"]), dtype=np.float32)
+        n_cells = min(n_cells or max(1, int(np.sqrt(n_docs))), sample.shape[0])
+        kmeans = MiniBatchKMeans(n_clusters=n_cells, random_state=random_state, n_init=3)
+        self.centroids = normalize_rows(kmeans.fit(normalize_rows(sample @ self.projection)).cluster_centers_)
+        added = self.update(stores)
+        ANA_LOG.info(f"gpit built a {n_cells}-cell index of {added} issues in {time.time() - start_time:.2f}s")
+        return self
+
+    def update(self, stores: Sequence[FeatureStore]) -> int:
+        """Insert the rows added to the stores since the last build/update; return how many were inserted."""
+        vectors, cells = [np.asarray(self.vectors)], [self.cells]
+        for store, chunk, keys in self._new_rows(stores):
+            vectors.append(self.embed(tfidf_rows(chunk, self.idf)))
+            cells.append(np.argmax(vectors[-1] @ self.centroids.T, axis=1))
+            self.keys.extend(keys)
+            self.meta["ingested"][store.path] = self.meta["ingested"].get(store.path, 0) + len(keys)
+        added = sum(len(v) for v in vectors[1:])
+        self.vectors, self.cells = np.vstack(vectors), np.concatenate(cells)
+        self._build_lists()
+        return added
+
+    def search(self, vectors: np.ndarray, top_k: int = 10, nprobe: int = None) -> List[List[Dict]]:
+        """The `top_k` most similar indexed issues (by cosine similarity) of every query embedding."""
+        nprobe = min(nprobe or self.meta["nprobe"], len(self.centroids))
+        probes = np.argsort(-(vectors @ self.centroids.T), axis=1)[:, :nprobe]
+        results = []
+        for vector, cells in zip(vectors, probes):
+            ids = np.concatenate([self._order[self._offsets[c]:self._offsets[c + 1]] for c in cells])
+            scores = self.vectors[ids] @ vector
+            best = top_k_positions(scores, top_k)
+            results.append([{"key": self.keys[ids[i]], "score": round(float(scores[i]), 4)} for i in best])
+        return results
+
+    def query(self, texts: Sequence[str], top_k: int = 10, nprobe: int = None,
+              featurizer: HashingFeaturizer = None) -> List[List[Dict]]:
+        if self.centroids is None:
+            raise ValueError(f"no similarity index in {self.path}, run `run_similar_index` first")
+        featurizer = featurizer or HashingFeaturizer(n_features=len(self.idf))
+        return self.search(self.embed(tfidf_rows(featurizer.transform(texts), self.idf)), top_k=top_k, nprobe=nprobe)
@@ -10,7 +10,7 @@ from gpit.utils.logging import COL_LOG, ClE_LOG, COU_LOG, logging
 
 class Collector:
     def __init__(self, access_token, repos_name: str = None, query_type=None, query=None, variables=None, to_file=None,
-                 url="https://api.github.com/graphql", headers=None,
+                 url="https://api.github.com/graphql", headers=None, compressor=None,
                  **kwargs):
         if headers is None:
             self.headers = {
@@ -24,6 +24,7 @@ class Collector:
         self.query = query
         self.variables = variables
         self.to_file = to_file
+        self.compressor = compressor  # applied to the raw bodies, see `write_to_file`
         if not os.path.exists(os.path.dirname(to_file)):
             os.makedirs(os.path.dirname(to_file))
 
@@ -50,7 +51,7 @@ class PRCollector(Collector):
         with open(self.to_file, mode='w', newline='', encoding='utf-8') as csvfile:
             writer = csv.writer(csvfile)
             writer.writerow(["Title", "Body", "Code", "CreatedDate", "Tags", "State", "Reactions",
-                             "Comments", 'Link'])  # Add "Reactions" 和 "Comments" column
+                             "Comments", 'Link', "ClosedDate", "FirstResponseDate"])  # Add "Reactions" 和 "Comments" column
 
 
             pr_number = 0
@@ -62,7 +63,7 @@ class PRCollector(Collector):
                 has_next_page = prs["pageInfo"]["hasNextPage"]
                 end_cursor = prs["pageInfo"]["endCursor"]
                 self.variables["cursor"] = end_cursor
-                write_to_file(all_prs, self.query_type, self.repos_name, writer)
+                write_to_file(all_prs, self.query_type, self.repos_name, writer, self.compressor)
                 if pr_number < total_pr_count:
                     collect_rate = pr_number / total_pr_count
                 else:
@@ -84,7 +85,7 @@ class IssueCollector(Collector):
         with open(self.to_file, mode='w', newline='', encoding='utf-8') as csvfile:
             writer = csv.writer(csvfile)
             writer.writerow(["Title", "Body", "Code", "CreatedDate", "Tags", "State", "Reactions",
-                             "Comments", 'Link'])  # Add "Reactions" 和 "Comments" column
+                             "Comments", 'Link', "ClosedDate", "FirstResponseDate"])  # Add "Reactions" 和 "Comments" column
 
             # issues = self.data["data"]["repository"]["issues"]
             # all_issues = issues["nodes"]
@@ -100,7 +101,7 @@ class IssueCollector(Collector):
                 has_next_page = issues["pageInfo"]["hasNextPage"]
                 end_cursor = issues["pageInfo"]["endCursor"]
                 self.variables["cursor"] = end_cursor
-                write_to_file(all_issues, self.query_type, self.repos_name, writer)
+                write_to_file(all_issues, self.query_type, self.repos_name, writer, self.compressor)
                 if issue_number < total_issue_count:
                     collect_rate = issue_number / total_issue_count
                 else:
@@ -1,32 +1,31 @@
+import numpy as np
 import pandas as pd
 from gpit.utils.utils import process_text, word_only, write_to_file, get_response_data, draw_line_chart
+from gpit.processors.cube import RollupCube
+from gpit.processors.topk import weighted_score, stream_top_k
 
 
 class Counter:
     def __init__(self, file: str):
         self.file = file
         self.df = pd.read_csv(file)
-
-    def prio_rank(self, col_weights: dict[str, float], top_n: int = None) -> pd.DataFrame:  # need file name
-        total_weight = sum(col_weights.values())  # compute the sum of all weights
-        sort_key_df = pd.DataFrame()
-        for col in self.df.columns:
-            if col in col_weights:
-                sort_key_df[col] = self.df[col] * col_weights[col]
-        sort_key_df['sort_key'] = sort_key_df.sum(axis=1) / total_weight
-        assert sort_key_df.__len__() != 0, f"cols in col_weights are not contained in file: {self.file}"
-        df_sorted = self.df.iloc[sort_key_df['sort_key'].sort_values(ascending=False).index]
-
-        if top_n is not None:
-            df_sorted = df_sorted.head(top_n)
-
-        return df_sorted
-
-    def draw_counts_by_year(self):
-        self.df["CreatedDate"] = pd.to_datetime(self.df["CreatedDate"], format='%Y-%m-%dT%H:%M:%SZ')
-        self.df["year"] = self.df["CreatedDate"].dt.year
-
-        year_counts = self.df.groupby("year").size()
-        year_counts = year_counts.sort_index()
-
-        draw_line_chart("PyTorch Memory Issues", "Year", "Counts", year_counts.index, year_counts.values)
+        self._cube = None
+
+    @property
+    def cube(self) -> RollupCube:
+        if self._cube is None:  # dates are parsed once here, every count afterwards is a cube lookup
+            self._cube = RollupCube.from_frame(self.df)
+        return self._cube
+
+    def prio_rank(self, col_weights: dict[str, float], top_n: int = None, group_by: str = None):  # need file name
+        if top_n is None and group_by is None:
+            order = np.argsort(-weighted_score(self.df, col_weights), kind="stable")
+            return self.df.iloc[order]
+        return stream_top_k([self.df], col_weights, top_n or len(self.df), group_by=group_by)
+
+    def counts_by_year(self, **filters) -> pd.Series:
+        return self.cube.query(by="year", **filters)["count"]
+
+    def draw_counts_by_year(self, title: str = "Issue Counts", save_path: str = None, **filters):
+        year_counts = self.counts_by_year(**filters)
+        draw_line_chart(title, "Year", "Counts", year_counts.index, year_counts.values, save_path=save_path)
@@ -0,0 +1,153 @@
+import os
+import time
+from typing import Dict, List, Union
+
+import pandas as pd
+
+from gpit.utils.logging import COU_LOG
+
+
+DIMS = ["repo", "year", "month", "state", "label"]
+MEASURES = ["count", "reactions", "comments"]
+ALL_LABELS = "*"  # every item contributes one row under this label, so label-free rollups never double count
+CELL_DTYPES = {"repo": "object", "state": "object", "label": "object"}
+RAW_COLS = ["CreatedDate", "Tags", "State", "Reactions", "Comments", "Link"]
+ITEM_DTYPES = {"Link": str, "CreatedDate": str, "Tags": str, "State": str}
+
+
+def repo_of(links: pd.Series) -> pd.Series:
+    return links.str.split("/").str[3:5].str.join("/")
+
+
+def explode_labels(df: pd.DataFrame, tags: pd.Series) -> pd.DataFrame:
+    """One `*` row per item plus one row per label in `tags` (the comma-joined `Tags` col)."""
+    tags = tags.fillna("")
+    labeled = df[(tags != "").to_numpy()].assign(label=tags[tags != ""].str.split(", ").to_numpy()).explode("label")
+    return pd.concat([df.assign(label=ALL_LABELS), labeled], ignore_index=True)
+
+
+def contributions(df: pd.DataFrame) -> pd.DataFrame:
+    """The raw cols of `df` that an item contributes to the cube, normalized so they compare equal after a reload."""
+    return pd.DataFrame({
+        "Link": df["Link"].to_numpy(),
+        "CreatedDate": df["CreatedDate"].to_numpy(),
+        "Tags": df["Tags"].fillna("").to_numpy(),
+        "State": df["State"].fillna("").to_numpy(),
+        "Reactions": df["Reactions"].fillna(0).astype("int64").to_numpy(),
+        "Comments": df["Comments"].fillna(0).astype("int64").to_numpy(),
+    })
+
+
+def aggregate_items(df: pd.DataFrame) -> pd.DataFrame:
+    """Aggregate raw collected items (the `all_*.csv` layout) into cube cells in one vectorized pass."""
+    created = pd.to_datetime(df["CreatedDate"], format="ISO8601")
+    base = pd.DataFrame({
+        "repo": repo_of(df["Link"]),
+        "year": created.dt.year,
+        "month": created.dt.month,
+        "state": df["State"].fillna(""),
+        "count": 1,
+        "reactions": df["Reactions"].fillna(0).astype("int64"),
+        "comments": df["Comments"].fillna(0).astype("int64"),
+    })
+    cells = explode_labels(base, df["Tags"])
+    return cells.groupby(DIMS, as_index=False)[MEASURES].sum()
+
+
+class RollupCube:
+    """Counts and reaction/comment sums by (repo, year, month, state, label).
+
+    The cube is persisted next to the collected data as a csv plus a
+    `.items.csv` sidecar holding the last contribution of every item, so `update`
+    only aggregates items that are new or changed; the old contribution of a
+    changed item (e.g. closed since, or more reactions) is retracted first.
+    """
+
+    def __init__(self, cube_file: str = None):
+        self.cube_file = cube_file
+        self.cells = pd.DataFrame({col: pd.Series(dtype=CELL_DTYPES.get(col, "int64")) for col in DIMS + MEASURES})
+        self.items = pd.DataFrame({col: pd.Series(dtype=ITEM_DTYPES.get(col, "int64")) for col in RAW_COLS})
+        if cube_file is not None and os.path.exists(cube_file):
+            self.load()
+
+    @property
+    def items_file(self):
+        return f"{self.cube_file}.items.csv"
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "RollupCube":
+        cube = cls()
+        cube.update(df)
+        return cube
+
+    def load(self):
+        self.cells = pd.read_csv(self.cube_file, keep_default_na=False, dtype={dim: str for dim in CELL_DTYPES})
+        if os.path.exists(self.items_file):
+            self.items = pd.read_csv(self.items_file, keep_default_na=False, dtype=ITEM_DTYPES)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.cube_file) or ".", exist_ok=True)
+        self.cells.to_csv(self.cube_file, index=False)
+        self.items.to_csv(self.items_file, index=False)
+
+    def update(self, df: pd.DataFrame) -> int:
+        """Fold the items of `df` that are new or changed since they were folded in; return how many."""
+        current = contributions(df.drop_duplicates("Link", keep="last"))
+        known = current.merge(self.items, on="Link", how="left", suffixes=("", "_before"), indicator=True)
+        is_new = (known["_merge"] == "left_only").to_numpy()
+        changed = is_new.copy()
+        for col in RAW_COLS:
+            if col != "Link":
+                changed |= (known[col] != known[f"{col}_before"]).to_numpy()
+        if not changed.any():
+            return 0
+
+        # the old contribution of a changed item is retracted by negative measures, then the new one is added
+        stale = self.items[self.items["Link"].isin(current["Link"][changed & ~is_new])]
+        deltas = [aggregate_items(current[changed])]
+        if len(stale):
+            retracted = aggregate_items(stale)
+            retracted[MEASURES] = -retracted[MEASURES]
+            deltas.append(retracted)
+        cells = pd.concat([self.cells, *deltas], ignore_index=True).groupby(DIMS, as_index=False)[MEASURES].sum()
+        self.cells = cells[cells["count"] != 0].reset_index(drop=True)
+        self.items = pd.concat([self.items[~self.items["Link"].isin(current["Link"][changed])], current[changed]],
+                               ignore_index=True)
+        return int(changed.sum())
+
+    def update_from_csv(self, file: str, chunksize: int = 50000) -> int:
+        start_time = time.time()
+        changed = 0
+        for chunk in pd.read_csv(file, usecols=RAW_COLS, chunksize=chunksize):
+            changed += self.update(chunk)
+        COU_LOG.info(f"gpit folded {changed} new or changed items from {file} into the cube "
+                     f"in {time.time() - start_time:.2f}s")
+        return changed
+
+    def query(self, by: Union[List[str], str] = None, **filters) -> pd.DataFrame:
+        """Slice the cube with `filters` (dim=value or dim=[values]) and roll it up to the `by` dims.
+
+        Without a `label` in `by` or `filters`, the `*` rows are used so each item is counted once.
+        """
+        by = [by] if isinstance(by, str) else list(by or [])
+        unknown = (set(by) | set(filters)) - set(DIMS)
+        if unknown:
+            raise ValueError(f"no cube dims: {', '.join(sorted(unknown))}")
+
+        cells = self.cells
+        mask = pd.Series(True, index=cells.index)
+        for dim, value in filters.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            mask &= cells[dim].isin(values)
+        if "label" in by and "label" not in filters:
+            mask &= cells["label"] != ALL_LABELS
+        elif "label" not in filters:
+            mask &= cells["label"] == ALL_LABELS
+        cells = cells[mask]
+
+        if not by:
+            return cells[MEASURES].sum().to_frame().T
+        return cells.groupby(by)[MEASURES].sum().sort_index()
+
+    def totals(self) -> Dict[str, int]:
+        return {k: int(v) for k, v in self.query().iloc[0].items()}
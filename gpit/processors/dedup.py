@@ -0,0 +1,161 @@
+import os
+import pickle
+import re
+import time
+import zlib
+from collections import defaultdict
+from typing import Dict, List, Sequence
+
+import numpy as np
+import pandas as pd
+
+from gpit.utils.logging import ClE_LOG
+
+
+PRIME = np.uint64(4294967291)  # largest prime below 2**32, so a * h + b never overflows uint64
+WORD_PATTERN = re.compile(r"[a-z0-9_]+")
+
+
+def shingle_hashes(text: str, k: int = 3) -> np.ndarray:
+    """crc32 of every k-word shingle of the lower-cased text (the text itself when it has fewer than k words)"""
+    words = WORD_PATTERN.findall(text.lower())
+    shingles = [" ".join(words[i:i + k]) for i in range(max(len(words) - k + 1, 1))]
+    return np.unique(np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64,
+                                 count=len(shingles)))
+
+
+class MinHashLSH:
+    """
+    MinHash signatures of issue shingles with an LSH banding index.
+
+    A new document is only compared with the documents it shares a band bucket with, and pairs whose
+    estimated Jaccard similarity reaches `threshold` are merged into one cluster (union-find), so
+    adding n documents costs roughly O(n). The whole index is pickled to `path` between runs; its keys
+    are issue links, so one index can hold the issues of several repos.
+    """
+
+    def __init__(self, num_perm: int = 128, bands: int = 16, threshold: float = 0.7, shingle_size: int = 3,
+                 seed: int = 1):
+        assert num_perm % bands == 0, f"num_perm ({num_perm}) must be a multiple of bands ({bands})"
+        rng = np.random.default_rng(seed)
+        self.seed = seed
+        self.a = rng.integers(1, int(PRIME), size=num_perm, dtype=np.uint64)
+        self.b = rng.integers(0, int(PRIME), size=num_perm, dtype=np.uint64)
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.keys: List[str] = []
+        self.key_ids: Dict[str, int] = {}
+        self.signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self.buckets = [defaultdict(list) for _ in range(bands)]
+        self.parent: List[int] = []
+
+    @staticmethod
+    def load(path: str) -> "MinHashLSH":
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def params(self) -> Dict[str, int]:
+        """The parameters the signatures and buckets depend on"""
+        return {"num_perm": len(self.a), "bands": self.bands, "shingle_size": self.shingle_size, "seed": self.seed}
+
+    def set_threshold(self, threshold: float):
+        """Cluster the indexed documents again with `threshold`, from their stored signatures"""
+        self.threshold = threshold
+        self.parent = list(range(len(self.keys)))
+        for buckets in self.buckets:
+            for bucket in buckets.values():
+                ids = np.array(bucket, dtype=np.int64)
+                for offset in range(1, len(ids)):  # every document with the earlier ones, as `add` does
+                    similarity = (self.signatures[ids[:offset]] == self.signatures[ids[offset]]).mean(axis=1)
+                    for candidate in ids[:offset][similarity >= threshold]:
+                        self._union(int(ids[offset]), int(candidate))
+
+    def signature_matrix(self, texts: Sequence[str]) -> np.ndarray:
+        hashes = [shingle_hashes(text, self.shingle_size) for text in texts]
+        lengths = np.array([len(h) for h in hashes])
+        flat = np.concatenate(hashes) if hashes else np.empty(0, dtype=np.uint64)
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+        signatures = np.empty((len(texts), len(self.a)), dtype=np.uint32)
+        for i, (a, b) in enumerate(zip(self.a, self.b)):  # one vectorized pass over all shingles per permutation
+            signatures[:, i] = np.minimum.reduceat((a * flat + b) % PRIME, starts)
+        return signatures
+
+    def _find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def _union(self, i: int, j: int):
+        root_i, root_j = self._find(i), self._find(j)
+        if root_i != root_j:  # the earliest document stays the representative
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+    def add(self, keys: Sequence[str], texts: Sequence[str]) -> int:
+        """Insert the documents whose key is not indexed yet; return how many were inserted."""
+        new = [(key, text) for key, text in zip(keys, texts) if key not in self.key_ids]
+        new = list({key: text for key, text in new}.items())
+        if not new:
+            return 0
+        signatures = self.signature_matrix([text for _, text in new])
+        first_id = len(self.keys)
+        self.signatures = np.vstack([self.signatures, signatures])
+        for offset, (key, _) in enumerate(new):
+            doc_id = first_id + offset
+            self.keys.append(key)
+            self.key_ids[key] = doc_id
+            self.parent.append(doc_id)
+            candidates = set()
+            for band in range(self.bands):
+                bucket = self.buckets[band][signatures[offset, band * self.rows:(band + 1) * self.rows].tobytes()]
+                candidates.update(bucket)
+                bucket.append(doc_id)
+            if candidates:
+                candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+                similarity = (self.signatures[candidates] == signatures[offset]).mean(axis=1)
+                for candidate in candidates[similarity >= self.threshold]:
+                    self._union(doc_id, int(candidate))
+        return len(new)
+
+    def clusters(self) -> Dict[str, str]:
+        """key -> key of its cluster representative (the first indexed member)"""
+        return {key: self.keys[self._find(i)] for i, key in enumerate(self.keys)}
+
+
+def dedup_csv(file: str, index_path: str, text_cols: Sequence[str] = ("Title", "Body"), key_col: str = "Link",
+              chunksize: int = 20000, **index_kwargs) -> pd.Series:
+    """Index the issues of `file` (incrementally, if `index_path` exists) and write their cluster
+    representative back to `file` as the `DupCluster` column.
+    An existing index is re-clustered when its threshold differs from `index_kwargs`; its signatures can not be
+    reused with other MinHash parameters (num_perm, bands, shingle_size, seed), which raises a ValueError."""
+    from gpit.analyzer.features import issue_text
+
+    start_time = time.time()
+    index = MinHashLSH(**index_kwargs)
+    if os.path.exists(index_path):
+        stored = MinHashLSH.load(index_path)
+        if stored.params() != index.params():
+            raise ValueError(f"the index {index_path} was built with {stored.params()} but got {index.params()}: "
+                             f"use the same parameters or delete the index to rebuild it")
+        if stored.threshold != index.threshold:
+            stored.set_threshold(index.threshold)
+        index = stored
+    added = 0
+    for chunk in pd.read_csv(file, chunksize=chunksize, usecols=lambda col: col in (*text_cols, key_col)):
+        added += index.add(list(chunk[key_col].astype(str)), issue_text(chunk, text_cols))
+    index.save(index_path)
+
+    df = pd.read_csv(file)
+    df["DupCluster"] = df[key_col].astype(str).map(index.clusters())
+    df.to_csv(file, index=False)
+    n_duplicates = int((df["DupCluster"] != df[key_col].astype(str)).sum())
+    ClE_LOG.info(f"gpit indexed {added} new items in {time.time() - start_time:.2f}s, "
+                 f"{n_duplicates} of {len(df)} items are near-duplicates of another one")
+    return df["DupCluster"]
@@ -0,0 +1,189 @@
+import os
+import time
+from typing import List, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from gpit.processors.cube import ALL_LABELS, explode_labels, repo_of
+from gpit.utils.logging import COU_LOG
+
+
+RAW_COLS = ["CreatedDate", "Tags", "State", "Link", "ClosedDate", "FirstResponseDate"]
+DAILY_MEASURES = ["opened", "closed", "close_hours", "responded", "response_hours"]
+LATENCY_METRICS = ["close", "response"]
+# fixed log-spaced bins (in hours) so histograms of different refreshes can simply be added up
+LATENCY_EDGES = np.concatenate([[0.0], 0.25 * 2.0 ** np.arange(17), [np.inf]])
+
+
+def empty_frame(**dtypes) -> pd.DataFrame:
+    return pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in dtypes.items()})
+
+
+def to_timestamps(values: pd.Series) -> pd.Series:
+    return pd.to_datetime(values.replace("", np.nan), format="ISO8601", utc=True).dt.tz_localize(None)
+
+
+def histogram_quantiles(counts: np.ndarray, q: Sequence[float]) -> np.ndarray:
+    """Quantiles from a LATENCY_EDGES histogram, interpolated linearly inside the bin (the open last bin is
+    reported at its lower edge)."""
+    total = counts.sum()
+    if total == 0:
+        return np.full(len(q), np.nan)
+    cum = np.cumsum(counts)
+    ranks = np.asarray(q) * total
+    bins = np.minimum(np.searchsorted(cum, ranks, side="left"), len(counts) - 1)
+    lower = LATENCY_EDGES[bins]
+    upper = np.where(np.isinf(LATENCY_EDGES[bins + 1]), lower, LATENCY_EDGES[bins + 1])
+    before = np.where(bins > 0, cum[bins - 1], 0)
+    inside = np.divide(ranks - before, counts[bins], out=np.zeros(len(q)), where=counts[bins] > 0)
+    return lower + (upper - lower) * inside
+
+
+class LifecycleMetrics:
+    """Time-to-close, time-to-first-response and open-backlog aggregates per (repo, label).
+
+    Three files share the `prefix`: `_daily.csv` holds per-day event counts and latency sums,
+    `_latency.csv` the latency histograms and `_items.csv` the last seen lifecycle of every item.
+    `refresh` diffs new data against `_items.csv` and only adds the events that happened since,
+    so the aggregates never have to be rebuilt from the full history. A close that no longer holds
+    (the item was reopened, or closed again at another time) is retracted by a negative event.
+    """
+
+    def __init__(self, prefix: str = None):
+        self.prefix = prefix
+        self.daily = empty_frame(repo="object", label="object", day="datetime64[ns]",
+                                 **{col: "float64" for col in DAILY_MEASURES})
+        self.latency = empty_frame(repo="object", label="object", metric="object", bin="int64", count="int64")
+        self.items = empty_frame(Link="object", Tags="object", created="datetime64[ns]", closed="datetime64[ns]",
+                                 responded="datetime64[ns]")
+        if prefix is not None and os.path.exists(f"{prefix}_items.csv"):
+            self.load()
+
+    def load(self):
+        self.daily = pd.read_csv(f"{self.prefix}_daily.csv", keep_default_na=False, parse_dates=["day"],
+                                 dtype={"repo": str, "label": str})
+        self.latency = pd.read_csv(f"{self.prefix}_latency.csv", keep_default_na=False,
+                                   dtype={"repo": str, "label": str, "metric": str})
+        self.items = pd.read_csv(f"{self.prefix}_items.csv", parse_dates=["created", "closed", "responded"],
+                                 dtype={"Link": str, "Tags": str})
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.prefix) or ".", exist_ok=True)
+        self.daily.to_csv(f"{self.prefix}_daily.csv", index=False)
+        self.latency.to_csv(f"{self.prefix}_latency.csv", index=False)
+        self.items.to_csv(f"{self.prefix}_items.csv", index=False)
+
+    def refresh(self, df: pd.DataFrame) -> int:
+        """Fold the lifecycle changes of `df` (an `all_*.csv` frame); return how many items changed."""
+        missing = set(RAW_COLS) - set(df.columns)
+        if missing:
+            raise ValueError(f"no col names: {', '.join(sorted(missing))} (re-run run_collection to fetch them)")
+        df = df.drop_duplicates("Link", keep="last")
+        current = pd.DataFrame({
+            "Link": df["Link"].to_numpy(),
+            "Tags": df["Tags"].fillna("").to_numpy(),
+            "created": to_timestamps(df["CreatedDate"]).to_numpy(),
+            "closed": to_timestamps(df["ClosedDate"]).where(df["State"] != "OPEN").to_numpy(),
+            "responded": to_timestamps(df["FirstResponseDate"]).to_numpy(),
+        })
+        known = current.merge(self.items[["Link", "closed", "responded"]], on="Link", how="left",
+                              suffixes=("", "_before"), indicator=True)
+        is_new = (known["_merge"] == "left_only").to_numpy()
+        # a close is added when the item is closed now but was not (at that time) before, and retracted when
+        # the item was closed before but is open now (reopened) or was closed again at another time
+        same_close = (known["closed"] == known["closed_before"]).to_numpy()
+        newly_closed = known["closed"].notna().to_numpy() & ~same_close
+        retracted = known["closed_before"].notna().to_numpy() & ~same_close
+        newly_responded = (known["responded"].notna() & known["responded_before"].isna()).to_numpy()
+        changed = is_new | newly_closed | retracted | newly_responded
+        if not changed.any():
+            return 0
+
+        delta = current[changed].reset_index(drop=True)
+        delta_new = is_new[changed]
+        delta_closed = newly_closed[changed]
+        delta_retracted = retracted[changed]
+        delta_responded = newly_responded[changed]
+        closed_before = known["closed_before"][changed].reset_index(drop=True)
+        close_hours = (delta["closed"] - delta["created"]).dt.total_seconds().to_numpy() / 3600
+        retracted_hours = (closed_before - delta["created"]).dt.total_seconds().to_numpy() / 3600
+        response_hours = (delta["responded"] - delta["created"]).dt.total_seconds().to_numpy() / 3600
+
+        # every event is one row (item, day, measures); they are aggregated per (repo, label, day) at once
+        repo = repo_of(delta["Link"])
+        events = pd.concat([
+            pd.DataFrame({"repo": repo, "day": delta["created"].dt.floor("D"), "opened": 1, "Tags": delta["Tags"]})[delta_new],
+            pd.DataFrame({"repo": repo, "day": delta["closed"].dt.floor("D"), "closed": 1,
+                          "close_hours": close_hours, "Tags": delta["Tags"]})[delta_closed],
+            pd.DataFrame({"repo": repo, "day": closed_before.dt.floor("D"), "closed": -1,
+                          "close_hours": -retracted_hours, "Tags": delta["Tags"]})[delta_retracted],
+            pd.DataFrame({"repo": repo, "day": delta["responded"].dt.floor("D"), "responded": 1,
+                          "response_hours": response_hours, "Tags": delta["Tags"]})[delta_responded],
+        ], ignore_index=True)
+        events = explode_labels(events.drop(columns=["Tags"]), events["Tags"])
+        events[DAILY_MEASURES] = events.reindex(columns=DAILY_MEASURES).fillna(0)
+        self.daily = (pd.concat([self.daily, events], ignore_index=True)
+                      .groupby(["repo", "label", "day"], as_index=False)[DAILY_MEASURES].sum())
+
+        latencies = pd.concat([
+            pd.DataFrame({"repo": repo, "metric": "close", "hours": close_hours, "count": 1,
+                          "Tags": delta["Tags"]})[delta_closed],
+            pd.DataFrame({"repo": repo, "metric": "close", "hours": retracted_hours, "count": -1,
+                          "Tags": delta["Tags"]})[delta_retracted],
+            pd.DataFrame({"repo": repo, "metric": "response", "hours": response_hours, "count": 1,
+                          "Tags": delta["Tags"]})[delta_responded],
+        ], ignore_index=True)
+        latencies = explode_labels(latencies.drop(columns=["Tags"]), latencies["Tags"])
+        latencies["bin"] = np.searchsorted(LATENCY_EDGES, np.clip(latencies["hours"], 0, None), side="right") - 1
+        latency = (pd.concat([self.latency, latencies.drop(columns=["hours"])], ignore_index=True)
+                   .groupby(["repo", "label", "metric", "bin"], as_index=False)["count"].sum())
+        self.latency = latency[latency["count"] != 0].reset_index(drop=True)
+
+        self.items = pd.concat([self.items[~self.items["Link"].isin(delta["Link"])], delta], ignore_index=True)
+        return int(changed.sum())
+
+    def refresh_from_csv(self, file: str, chunksize: int = 50000) -> int:
+        start_time = time.time()
+        changed = 0
+        for chunk in pd.read_csv(file, usecols=RAW_COLS, chunksize=chunksize):
+            changed += self.refresh(chunk)
+        COU_LOG.info(f"gpit folded {changed} lifecycle changes from {file} in {time.time() - start_time:.2f}s")
+        return changed
+
+    def _daily_slice(self, repo: Union[str, List[str]] = None, label: str = ALL_LABELS) -> pd.DataFrame:
+        daily = self.daily[self.daily["label"] == label]
+        if repo is not None:
+            daily = daily[daily["repo"].isin([repo] if isinstance(repo, str) else repo)]
+        return daily.groupby("day")[DAILY_MEASURES].sum().sort_index()
+
+    def backlog(self, repo: Union[str, List[str]] = None, label: str = ALL_LABELS, freq: str = "D") -> pd.Series:
+        """Open items at the end of every period: the running sum of opened minus closed events."""
+        daily = self._daily_slice(repo, label)
+        curve = (daily["opened"] - daily["closed"]).cumsum()
+        return curve.resample(freq).last().ffill() if len(curve) else curve
+
+    def rolling(self, window: str = "28D", repo: Union[str, List[str]] = None, label: str = ALL_LABELS) -> pd.DataFrame:
+        """Trailing-window opened/closed counts and mean latencies (hours)."""
+        daily = self._daily_slice(repo, label)
+        if len(daily) == 0:
+            return daily
+        daily = daily.asfreq("D", fill_value=0).rolling(window).sum()
+        return pd.DataFrame({
+            "opened": daily["opened"],
+            "closed": daily["closed"],
+            "mean_close_hours": daily["close_hours"] / daily["closed"].replace(0, np.nan),
+            "mean_response_hours": daily["response_hours"] / daily["responded"].replace(0, np.nan),
+        })
+
+    def latency_quantiles(self, metric: str = "close", q: Sequence[float] = (0.5, 0.9, 0.99),
+                          label: str = ALL_LABELS) -> pd.DataFrame:
+        """Latency quantiles in hours per repo (for one label), estimated from the histograms."""
+        assert metric in LATENCY_METRICS, f"metric must be one of {LATENCY_METRICS} but got {metric}"
+        hist = self.latency[(self.latency["metric"] == metric) & (self.latency["label"] == label)]
+        rows = {}
+        for repo, group in hist.groupby("repo"):
+            counts = np.zeros(len(LATENCY_EDGES) - 1, dtype="int64")
+            np.add.at(counts, group["bin"].astype(int).to_numpy(), group["count"].to_numpy())
+            rows[repo] = np.append(histogram_quantiles(counts, q), counts.sum())
+        return pd.DataFrame.from_dict(rows, orient="index", columns=[f"p{round(x * 100)}" for x in q] + ["n"])
@@ -0,0 +1,106 @@
+import time
+from collections import Counter
+from typing import Dict, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from gpit.processors.topk import iter_chunks
+from gpit.utils.logging import ClE_LOG
+
+
+STRATA = ("year", "label", "state")
+STRATUM_COL = "Stratum"
+WEIGHT_COL = "SampleWeight"  # stratum population / stratum sample size: the rows each sampled row stands for
+
+
+def strata_keys(df: pd.DataFrame, by: Sequence[str] = STRATA) -> pd.Series:
+    """Stratum of every row, its values of `by` joined by "|": `year` of CreatedDate, the first `label` of Tags,
+    `state`, or any other col."""
+    parts = []
+    for name in by:
+        if name == "year":
+            part = pd.to_datetime(df["CreatedDate"], format="ISO8601").dt.year.astype("Int64").astype(str)
+        elif name == "label":  # a row is in exactly one stratum, so only its first label counts
+            part = df["Tags"].fillna("").astype(str).str.split(", ").str[0]
+        elif name == "state":
+            part = df["State"].astype(str)
+        else:
+            part = df[name].astype(str)
+        parts.append(part.reset_index(drop=True))
+    if not parts:
+        return pd.Series("", index=df.index)
+    strata = parts[0].str.cat(parts[1:], sep="|") if len(parts) > 1 else parts[0]
+    return pd.Series(strata.to_numpy(), index=df.index)
+
+
+def priorities(keys: pd.Series, seed: int = 0) -> np.ndarray:
+    """Uniform pseudo-random number in [0, 1) of every key, the same for the same key and seed in every run"""
+    hashes = pd.util.hash_pandas_object(keys.astype(str) + f"\x00{seed}", index=False).to_numpy()
+    return (hashes >> np.uint64(11)).astype(np.float64) / 2 ** 53
+
+
+class StratifiedReservoir:
+    """Single-pass stratified sampling without replacement over chunks.
+
+    Every row draws a priority from the hash of its key and the seed, and every stratum keeps the rows of lowest
+    priority seen so far (a bottom-k reservoir of its target size). The sample is uniform within each stratum, the
+    same for any chunking or row order, and memory stays bounded by the sample plus one chunk.
+    """
+
+    def __init__(self, size: int = 100, sizes: Dict[str, int] = None, by: Sequence[str] = STRATA, seed: int = 0,
+                 key_col: str = "Link"):
+        assert size >= 0, f"size must not be negative but got {size}"
+        self.size = size
+        self.sizes = dict(sizes or {})
+        self.by = list(by)
+        self.seed = seed
+        self.key_col = key_col
+        self.population = Counter()
+        self.rows = 0
+        self.retained = None
+
+    def target(self, stratum: str) -> int:
+        return self.sizes.get(stratum, self.size)
+
+    def push(self, chunk: pd.DataFrame):
+        rows = pd.RangeIndex(self.rows, self.rows + len(chunk))
+        self.rows += len(chunk)
+        keys = chunk[self.key_col] if self.key_col in chunk.columns else pd.Series(rows.astype(str))
+        chunk = chunk.assign(_row=rows.to_numpy(), _stratum=strata_keys(chunk, self.by),
+                             _priority=priorities(keys.reset_index(drop=True), self.seed))
+        self.population.update(chunk["_stratum"].to_numpy().tolist())
+        if self.retained is not None:
+            chunk = pd.concat([self.retained, chunk], ignore_index=True)
+        chunk = chunk.sort_values(["_stratum", "_priority"], kind="stable")
+        targets = chunk["_stratum"].map(self.target)
+        self.retained = chunk[chunk.groupby("_stratum", sort=False).cumcount().to_numpy() < targets.to_numpy()]
+
+    def result(self) -> pd.DataFrame:
+        """The sample in input order, with the `Stratum` and `SampleWeight` of every row"""
+        if self.retained is None:
+            return pd.DataFrame(columns=[STRATUM_COL, WEIGHT_COL])
+        sample = self.retained.sort_values("_row")
+        sampled = sample["_stratum"].value_counts()
+        weights = sample["_stratum"].map(lambda stratum: self.population[stratum] / sampled[stratum])
+        return (sample.assign(**{STRATUM_COL: sample["_stratum"], WEIGHT_COL: weights})
+                .drop(columns=["_row", "_stratum", "_priority"]).reset_index(drop=True))
+
+
+def sample_csv(file: str, out_file: str, size: int = 100, sizes: Dict[str, int] = None, by: Sequence[str] = STRATA,
+               seed: int = 0, key_col: str = "Link", chunksize: int = 20000) -> pd.DataFrame:
+    """Stratified sample of `file` (streamed chunk by chunk), written to `out_file`"""
+    start_time = time.time()
+    reservoir = StratifiedReservoir(size, sizes=sizes, by=by, seed=seed, key_col=key_col)
+    for chunk in iter_chunks(file, chunksize=chunksize):
+        reservoir.push(chunk)
+    sample = reservoir.result()
+    sample.to_csv(out_file, index=False)
+    ClE_LOG.info(f"gpit sampled {len(sample)} of {reservoir.rows} items from {len(reservoir.population)} strata "
+                 f"in {time.time() - start_time:.2f}s")
+    return sample
+
+
+def estimate_counts(df: pd.DataFrame, by: Union[str, Sequence[str]], weight_col: str = WEIGHT_COL) -> pd.Series:
+    """Population counts of the values of `by` estimated from a sample: the sum of the weights of each value"""
+    return df.groupby(by)[weight_col].sum().sort_values(ascending=False)
@@ -0,0 +1,102 @@
+import glob
+from typing import Dict, Iterable, List, Union
+
+import numpy as np
+import pandas as pd
+
+
+def weighted_score(df: pd.DataFrame, col_weights: Dict[str, float]) -> np.ndarray:
+    """The `prio_rank` sort key: weighted sum of the given cols divided by the sum of all weights."""
+    cols = [col for col in col_weights if col in df.columns]
+    assert cols, f"cols in col_weights are not contained in columns: {list(df.columns)}"
+    total_weight = sum(col_weights.values())  # compute the sum of all weights
+    values = df[cols].to_numpy(dtype="float64", na_value=0.0)
+    weights = np.array([col_weights[col] for col in cols], dtype="float64")
+    return values @ weights / total_weight
+
+
+def top_k_positions(scores: np.ndarray, k: int) -> np.ndarray:
+    """Positions of the k largest scores, best first, found with a partial selection instead of a full sort.
+    Equal scores are ranked by position (earliest first), like a stable sort, also at the k-th score."""
+    if k < len(scores):
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]  # the k-th largest score
+        above = np.flatnonzero(scores > kth)
+        candidates = np.concatenate([above, np.flatnonzero(scores == kth)[:k - len(above)]])
+        candidates.sort()
+    else:
+        candidates = np.arange(len(scores))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def with_group_keys(df: pd.DataFrame, group_by: str) -> pd.DataFrame:
+    """Attach the `_group` col; `label` explodes `Tags` so an item competes in every label it carries."""
+    if group_by == "label":
+        df = df.assign(_group=df["Tags"].fillna("").str.split(", ")).explode("_group")
+    elif group_by == "year":
+        df = df.assign(_group=pd.to_datetime(df["CreatedDate"], format="ISO8601").dt.year)
+    else:
+        df = df.assign(_group=df[group_by])
+    return df
+
+
+class TopK:
+    """Streaming top-k over chunks: every chunk is reduced to its own top-k and merged into the retained set,
+    so memory stays bounded by k (per group) plus one chunk. Equal scores are ranked by input position, so the
+    result is the same for any chunk size and the same as a stable sort of the whole input.
+    """
+
+    def __init__(self, col_weights: Dict[str, float], top_n: int, group_by: str = None):
+        assert top_n > 0, f"top_n must be positive but got {top_n}"
+        self.col_weights = col_weights
+        self.top_n = top_n
+        self.group_by = group_by
+        self.retained = None
+        self.rows = 0
+
+    def select(self, df: pd.DataFrame) -> pd.DataFrame:
+        if self.group_by is None:
+            return df.iloc[top_k_positions(df["_score"].to_numpy(), self.top_n)]
+        # nlargest per group is a partial selection as well
+        best = df.reset_index(drop=True)
+        best = best.loc[best.groupby("_group", sort=False)["_score"].nlargest(self.top_n).index.get_level_values(-1)]
+        return best.sort_values(["_group", "_score", "_pos"], ascending=[True, False, True], kind="stable")
+
+    def push(self, chunk: pd.DataFrame):
+        # `_pos` is the input position: selections see their rows in input order, so ties keep the earliest rows
+        chunk = chunk.assign(_score=weighted_score(chunk, self.col_weights),
+                             _pos=np.arange(self.rows, self.rows + len(chunk)))
+        self.rows += len(chunk)
+        if self.group_by is not None:
+            chunk = with_group_keys(chunk, self.group_by)
+        chunk_best = self.select(chunk)
+        if self.retained is None:
+            self.retained = chunk_best
+        else:
+            merged = pd.concat([self.retained, chunk_best], ignore_index=True).sort_values("_pos", kind="stable")
+            self.retained = self.select(merged)
+
+    def result(self) -> Union[pd.DataFrame, Dict[object, pd.DataFrame]]:
+        if self.retained is None:
+            return pd.DataFrame() if self.group_by is None else {}
+        if self.group_by is None:
+            return self.retained.drop(columns=["_score", "_pos"])
+        return {group: df.drop(columns=["_score", "_pos", "_group"]) for group, df in self.retained.groupby("_group")}
+
+
+def iter_chunks(inputs: Union[str, List[str], Iterable[pd.DataFrame]], chunksize: int = 50000) -> Iterable[pd.DataFrame]:
+    """Yield frames from a csv path, a glob of partitions, a list of paths or an iterable of frames."""
+    if isinstance(inputs, str):
+        inputs = sorted(glob.glob(inputs)) or [inputs]
+    for item in inputs:
+        if isinstance(item, pd.DataFrame):
+            yield item
+        else:
+            yield from pd.read_csv(item, chunksize=chunksize)
+
+
+def stream_top_k(inputs, col_weights: Dict[str, float], top_n: int, group_by: str = None, chunksize: int = 50000):
+    """Rank inputs that do not fit in memory; returns a frame, or a dict of frames per group when `group_by` is set."""
+    top_k = TopK(col_weights, top_n, group_by=group_by)
+    for chunk in iter_chunks(inputs, chunksize=chunksize):
+        top_k.push(chunk)
+    return top_k.result()
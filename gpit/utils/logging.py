@@ -3,7 +3,14 @@ import logging
 COL_LOG = logging.getLogger("COLLECTING")
 ClE_LOG = logging.getLogger("CLEANING")
 COU_LOG = logging.getLogger("COUNTING")
+ANA_LOG = logging.getLogger("ANALYZING")
 
 COL_LOG.setLevel(logging.INFO)
 COL_LOG.addHandler(logging.StreamHandler())
 
+ClE_LOG.setLevel(logging.INFO)
+ClE_LOG.addHandler(logging.StreamHandler())
+COU_LOG.setLevel(logging.INFO)
+COU_LOG.addHandler(logging.StreamHandler())
+ANA_LOG.setLevel(logging.INFO)
+ANA_LOG.addHandler(logging.StreamHandler())
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List
+
+from gpit.utils.logging import COU_LOG
+
+
+@dataclass
+class ChartSpec:
+    """One chart of a report: every series is a (x, y) pair of plain lists drawn on the same axes."""
+    name: str
+    title: str
+    x_label: str
+    y_label: str
+    series: Dict[str, List[List]] = field(default_factory=dict)
+    kind: str = "line"
+
+    def digest(self) -> str:
+        """Hash of everything the picture depends on; an unchanged digest means the chart can be skipped."""
+        payload = json.dumps(asdict(self), sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def use_agg():
+    """Pool worker initializer: the non-interactive Agg backend, safe in worker processes on headless hosts."""
+    import matplotlib
+    matplotlib.use("Agg")
+
+
+def render_chart(spec: ChartSpec, save_path: str) -> str:
+    """Render one chart to `save_path` on its own Figure, without pyplot, so the backend of the calling
+    process (e.g. an interactive session) is left as it is."""
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 4.5))
+    ax = fig.subplots()
+    for label, (x_data, y_data) in spec.series.items():
+        if spec.kind == "bar":
+            ax.bar([str(x) for x in x_data], y_data, label=label)
+        else:
+            ax.plot(x_data, y_data, marker="o", label=label)
+    ax.set_title(spec.title)
+    ax.set_xlabel(spec.x_label)
+    ax.set_ylabel(spec.y_label)
+    if len(spec.series) > 1:
+        ax.legend()
+    fig.tight_layout()
+    fig.savefig(save_path)
+    return save_path
+
+
+class ReportRenderer:
+    """Render many charts into `out_dir` with a process pool.
+
+    `out_dir/manifest.json` maps chart names to the digest of the aggregates they were drawn from,
+    so charts whose inputs did not change since the last render are skipped.
+    """
+
+    def __init__(self, out_dir: str, max_workers: int = None):
+        self.out_dir = out_dir
+        self.max_workers = max_workers
+        self.manifest_file = os.path.join(out_dir, "manifest.json")
+        os.makedirs(out_dir, exist_ok=True)
+        self.manifest = {}
+        if os.path.exists(self.manifest_file):
+            with open(self.manifest_file, "r", encoding="utf-8") as f:
+                self.manifest = json.load(f)
+
+    def chart_path(self, spec: ChartSpec) -> str:
+        return os.path.join(self.out_dir, f"{spec.name}.png")
+
+    def render(self, specs: List[ChartSpec]) -> List[str]:
+        """Render the stale charts of `specs`; return the paths that were (re)drawn."""
+        start_time = time.time()
+        digests = {spec.name: spec.digest() for spec in specs}
+        stale = [spec for spec in specs
+                 if self.manifest.get(spec.name) != digests[spec.name] or not os.path.exists(self.chart_path(spec))]
+        rendered = []
+        if stale:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=use_agg) as pool:
+                rendered = list(pool.map(render_chart, stale, [self.chart_path(spec) for spec in stale]))
+            for spec in stale:
+                self.manifest[spec.name] = digests[spec.name]
+            with open(self.manifest_file, "w", encoding="utf-8") as f:
+                json.dump(self.manifest, f, indent=2, sort_keys=True)
+        COU_LOG.info(f"gpit rendered {len(rendered)} charts ({len(specs) - len(stale)} unchanged) "
+                     f"in {time.time() - start_time:.2f}s")
+        return rendered
+
+
+def charts_from_cube(cube, repos: List[str] = None, metrics=("count", "reactions", "comments"),
+                     query_type: str = "issue") -> List[ChartSpec]:
+    """Per repo and metric, a yearly chart with one line per state."""
+    repos = repos if repos is not None else sorted(cube.cells["repo"].unique())
+    specs = []
+    for repo in repos:
+        by_year = cube.query(by=["state", "year"], repo=repo)
+        for metric in metrics:
+            series = {state: [group.index.get_level_values("year").tolist(), group[metric].tolist()]
+                      for state, group in by_year.groupby(level="state")}
+            specs.append(ChartSpec(name=f"{repo.replace('/', '__')}__{query_type}__{metric}",
+                                   title=f"{repo} {query_type}s: {metric} by year", x_label="Year",
+                                   y_label=metric.capitalize(), series=series))
+    return specs
@@ -1,3 +1,4 @@
+import os
 import re
 import nltk
 from nltk.corpus import stopwords
@@ -9,41 +10,65 @@ import yaml
 nltk.download('stopwords')
 nltk_stopwords = set(stopwords.words('english'))
 
-def process_text(text):
-    if isinstance(text, float):
-        return ''
-    # TODO@YSY: put these into parameter control
-    # text = text.lower()
-    # replace "error" as "bug"
-    # text = text.replace('error', 'bug')
-    # text = text.replace('na', 'nan')
+class TextNormalizer:
+    """
+    The `process_text` normalization with its patterns compiled once, so it can be applied to whole datasets.
+    Words listed in `stopwords_file` (one per line, optional) are removed as well.
+    """
 
-    # delete the words containing "http"
-    text = re.sub(r'http\S+', '', text)
+    def __init__(self, stopwords_file: str = 'stopwords.txt', max_tokens: int = 300):
+        self.max_tokens = max_tokens
+        words_to_remove = []
+        if os.path.exists(stopwords_file):
+            with open(stopwords_file, 'r', encoding='utf-8') as f:
+                words_to_remove = [line.strip() for line in f.readlines() if line.strip()]
+        # words_pattern = '|'.join([re.escape(word) for word in words_to_remove])
+        # words_pattern = r'\b(?:' + words_pattern + r')\b|\w*(' + words_pattern + r')\w*'
+        self.words_pattern = None
+        if words_to_remove:
+            self.words_pattern = re.compile(r'\b(?:' + '|'.join(re.escape(word) for word in words_to_remove) + r')\b',
+                                            flags=re.IGNORECASE)
+        self.http_pattern = re.compile(r'http\S+')
+        self.one_word_pattern = re.compile(r'\b\w\b')
 
-    # delete one word
-    text = re.sub(r'\b\w\b', '', text)
+    def tokens(self, text):
+        if isinstance(text, float):
+            return []
+        # TODO@YSY: put these into parameter control
+        # text = text.lower()
+        # replace "error" as "bug"
+        # text = text.replace('error', 'bug')
+        # text = text.replace('na', 'nan')
 
-    # delete the specific words
-    with open('stopwords.txt', 'r', encoding='utf-8') as f:
-        words_to_remove = [line.strip() for line in f.readlines()]
-    # words_pattern = '|'.join([re.escape(word) for word in words_to_remove])
-    # words_pattern = r'\b(?:' + words_pattern + r')\b|\w*(' + words_pattern + r')\w*'
-    words_pattern = r'\b(?:' + '|'.join(re.escape(word) for word in words_to_remove) + r')\b'
+        # delete the words containing "http"
+        text = self.http_pattern.sub('', text)
 
-    # use re to match the strings or substring is space
-    text = re.sub(words_pattern, ' ', text, flags=re.IGNORECASE)
+        # delete one word
+        text = self.one_word_pattern.sub('', text)
 
-    text_list = text.split(" ")
+        # delete the specific words
+        # use re to match the strings or substring is space
+        if self.words_pattern is not None:
+            text = self.words_pattern.sub(' ', text)
 
-    text_list = [x for x in text_list if x][:300]
+        text_list = text.split(" ")
 
-    # remove the stopwords
-    text_list = [word for word in text_list if word not in nltk_stopwords]
+        text_list = [x for x in text_list if x][:self.max_tokens]
 
-    text = " ".join(text_list)
+        # remove the stopwords
+        return [word for word in text_list if word not in nltk_stopwords]
 
-    return text.strip()
+    def __call__(self, text):
+        return " ".join(self.tokens(text)).strip()
+
+
+_normalizers = {}
+
+
+def process_text(text, stopwords_file='stopwords.txt'):
+    if stopwords_file not in _normalizers:
+        _normalizers[stopwords_file] = TextNormalizer(stopwords_file)
+    return _normalizers[stopwords_file](text)
 
 
 def word_only(intput_text: str, numbers: int):
@@ -54,12 +79,16 @@ def word_only(intput_text: str, numbers: int):
     return output
 
 
-def write_to_file(all_items, query_type, repos_name, writer):
+def write_to_file(all_items, query_type, repos_name, writer, compressor=None):
     # FIXME@SHAOYU: how to make the filter condition in config yaml?
+    # `compressor` (e.g. `compress.LogCompressor()`) is applied to the raw body: logs and tracebacks are only
+    # recognized by their lines, which are gone once the body is flattened below
     for item in all_items:
         title = item['title']
         body = item['body']
         code = "\n".join(re.findall(r'```([\s\S]*?)```', body))
+        if compressor is not None:
+            body = compressor(body)
 
         body = body.replace('"', ' ')  # eliminate the "
         body = re.sub(r'@\w+', '', body)  # delete @account
@@ -85,8 +114,23 @@ def write_to_file(all_items, query_type, repos_name, writer):
         item_id = item['number']
         item_type = "issues" if query_type=="issue" else "pull"
         item_link = f"{repo_url}/{item_type}/{item_id}"
+        closed_at = item.get('closedAt') or ""
+        first_response_at = get_first_response(item)
         writer.writerow([title, body, code, created_at, labels, state, reactions_count,
-                         comments_count, item_link])  # write reactions and comments count to file
+                         comments_count, item_link, closed_at, first_response_at])  # write reactions and comments count to file
+
+
+def get_first_response(item):
+    """
+    createdAt of the first comment written neither by the item's author nor by a bot ("" if there is none in the
+    fetched page: only the first 20 comments are fetched, see `comments(first: 20)` of the queries)
+    """
+    author = (item.get('author') or {}).get('login')
+    for comment in item['comments'].get('nodes') or []:
+        commenter = comment.get('author') or {}
+        if commenter.get('login') != author and commenter.get('__typename') != 'Bot':
+            return comment['createdAt']
+    return ""
 
 
 def get_response_data(url, query, response_type, headers, variables=None):
@@ -99,13 +143,18 @@ def get_response_data(url, query, response_type, headers, variables=None):
 
 
 def draw_line_chart(title, x_label, y_label, x_data, y_data, save_path=None):
+    # with a save_path the chart is rendered to the file only (without pyplot) and never shown
+    from gpit.utils.report import ChartSpec, render_chart
+    spec = ChartSpec(name=title, title=title, x_label=x_label, y_label=y_label,
+                     series={title: [list(x_data), list(y_data)]})
+    if save_path:
+        render_chart(spec, str(save_path))
+        return
     import matplotlib.pyplot as plt
     plt.plot(x_data, y_data)
     plt.title(title)
     plt.xlabel(x_label)
     plt.ylabel(y_label)
-    if save_path:
-        plt.savefig(save_path)
     plt.show()
     return
 
@@ -1,14 +1,37 @@
 import fire
+import os
+import time
 import re
 import operator
 import pandas as pd
 
+from dataclasses import replace
 from typing import Union, List
 from functools import reduce
 from pathlib import Path
 
-from gpit.utils.utils import load_config_file
+from gpit.utils.utils import load_config_file, draw_line_chart
 from gpit.processors import collecter, counter
+from gpit.processors.cube import RollupCube
+from gpit.processors.lifecycle import LifecycleMetrics
+from gpit.processors.dedup import dedup_csv
+from gpit.processors.sampler import STRATA, STRATUM_COL, WEIGHT_COL, sample_csv
+from gpit.utils.report import ReportRenderer, charts_from_cube
+from gpit.analyzer.LDA.lda import Model as TopicModel, issue_texts
+from gpit.analyzer.features import featurize_csv, FeatureStore
+from gpit.analyzer.similarity import SimilarityIndex
+from gpit.analyzer.LLM.analysis import analyze_csv
+from gpit.analyzer.LLM.benchmark import benchmark_suite, load_prompt_set, sample_prompt_set
+from gpit.analyzer.LLM.cache import ResultCache
+from gpit.analyzer.LLM.cascade import KeywordScorer, LLMScorer, TRIAGE_MAX_TOKENS, triage_csv
+from gpit.analyzer.LLM.compress import LogCompressor
+from gpit.analyzer.LLM.parallel import DataParallelEngine
+from gpit.analyzer.LLM.engines import ENGINES
+from gpit.analyzer.LLM.inference import resolve_config
+from gpit.analyzer.LLM.inference_config import config_manager
+from gpit.analyzer.LLM.prompts import PromptBuilder, load_tokenizer
+from gpit.analyzer.LLM.structured import SCHEMAS, schema_instructions, schema_max_tokens
+from gpit.analyzer.LLM.worker import SubprocessEngine
 
 
 class Pipeline(object):
@@ -25,7 +48,10 @@ class Pipeline(object):
     def run_collection(
         self,
         query_type,
+        compress: bool = True,
     ):
+        # `compress` collapses repeated log lines, duplicate stack frames and environment dumps of the bodies before
+        # they are flattened into the `Body` col (afterwards their lines are gone)
         access_tokens = Path(self.github_pat_token_file).read_text().strip()
         assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
         # TLDR@SHAOYU; Currently, PR query and issue query are compatible.
@@ -42,12 +68,15 @@ class Pipeline(object):
             "name": self.repo_path.split("/")[1]
         }
 
+        compressor = LogCompressor() if compress else None
         if query_type == "issue":
             cor = collecter.IssueCollector(access_tokens, repos_name=self.repo_path, query_type=query_type, query=query, variables=variables,
-                                  to_file=f"Results/{self.repo_path.split('/')[-1]}/all_{query_type}s.csv")
+                                  to_file=f"Results/{self.repo_path.split('/')[-1]}/all_{query_type}s.csv",
+                                  compressor=compressor)
         elif query_type == "PR":
             cor = collecter.PRCollector(access_tokens, repos_name=self.repo_path, query_type=query_type, query=query, variables=variables,
-                                  to_file=f"Results/{self.repo_path.split('/')[-1]}/all_{query_type}s.csv")
+                                  to_file=f"Results/{self.repo_path.split('/')[-1]}/all_{query_type}s.csv",
+                                  compressor=compressor)
 
         cor.get_whole_data()
 
@@ -63,10 +92,15 @@ class Pipeline(object):
         title_keywords: str = None,
         body_keywords: str = None,
         save_cols: List[str] = None,
+        dedup: bool = False,
     ):
         assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
         file_path = f"Results/{self.repo_path.split('/')[-1]}/all_{query_type}s.csv"
         df = pd.read_csv(file_path)
+        if dedup:  # keep one representative per near-duplicate cluster (see `run_dedup`)
+            if "DupCluster" not in df.columns:
+                raise ValueError(f"no col names: DupCluster, run `run_dedup --query_type {query_type}` first")
+            df = df[df["DupCluster"] == df["Link"]]
         if years is not None:  # FIXME@SHAOYU: the col name should not be replaced, maybe I should not use `Year`
             df['CreatedDate'] = pd.to_datetime(df['CreatedDate'])
             df["Year"] = df['CreatedDate'].dt.year
@@ -106,14 +140,295 @@ class Pipeline(object):
 
         df.to_csv(Path(file_path).parent / f"cleaned_{query_type}s.csv", index=False)
 
+    def run_dedup(
+        self,
+        query_type: str = "issue",
+        threshold: float = 0.7,
+        num_perm: int = 128,
+    ):
+        # MinHash-LSH near-duplicate clusters, written to `all_{query_type}s.csv` as the `DupCluster` column.
+        # One index in `Results/minhash_{query_type}s.pkl` holds the items of every repo, so an item can be a
+        # near-duplicate of an item of another repo (its cluster representative is then a link to that repo)
+        assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
+        file_path = f"Results/{self.repo_path.split('/')[-1]}/all_{query_type}s.csv"
+        dedup_csv(file_path, f"Results/minhash_{query_type}s.pkl", threshold=threshold, num_perm=num_perm)
+
+    def run_sampling(
+        self,
+        query_type: str = "issue",
+        size: int = 100,
+        sizes: dict = None,
+        by: Union[List[str], str] = STRATA,
+        seed: int = 0,
+    ):
+        # stratified sample of `cleaned_{query_type}s.csv` (`size` items per year/label/state stratum, `sizes` per
+        # named stratum such as {"2024|module: cuda|OPEN": 500}) to `sampled_{query_type}s.csv`, for
+        # `run_analysis --source sampled`; `SampleWeight` is the number of items each sampled item stands for
+        assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
+        file_path = f"Results/{self.repo_path.split('/')[-1]}/cleaned_{query_type}s.csv"
+        if isinstance(by, str):
+            by = by.split(",")
+        sample = sample_csv(file_path, str(Path(file_path).parent / f"sampled_{query_type}s.csv"), size=size,
+                            sizes=sizes, by=by, seed=seed)
+        print(sample.groupby(STRATUM_COL)[WEIGHT_COL].agg(["size", "first"]).rename(
+            columns={"size": "sampled", "first": "weight"}))
+
     def run_counting(
         self,
+        query_type: str = "issue",
         draw: bool = False,
     ):
-        pass
+        assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
+        file_path = f"Results/{self.repo_path.split('/')[-1]}/all_{query_type}s.csv"
+        cube = RollupCube(str(Path(file_path).parent / f"cube_{query_type}s.csv"))
+        cube.update_from_csv(file_path)
+        cube.save()
+        print(cube.query(by=["year", "state"]))
+
+        if draw:
+            year_counts = cube.query(by="year")["count"]
+            draw_line_chart(f"{self.repo_path} {query_type}s", "Year", "Counts", year_counts.index, year_counts.values,
+                            save_path=Path(file_path).parent / f"counts_by_year_{query_type}s.png")
+
+    def run_report(
+        self,
+        query_type: str = "issue",
+        out_dir: str = "Results/report",
+        max_workers: int = None,
+    ):
+        # charts for every repo with a cube (see `run_counting`), unless `--repo_path` picks one
+        assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
+        if self.repo_path:
+            repo_dirs = [self.repo_path.split('/')[-1]]
+            assert os.path.isdir(f"Results/{repo_dirs[0]}"), \
+                f"no results of {self.repo_path} in Results/{repo_dirs[0]}, run `run_counting` first"
+        else:
+            assert os.path.isdir("Results"), "no Results directory, run `run_counting` first"
+            repo_dirs = sorted(os.listdir("Results"))
+        specs = []
+        for repo_dir in repo_dirs:
+            cube_file = Path("Results") / repo_dir / f"cube_{query_type}s.csv"
+            if cube_file.exists():
+                specs += charts_from_cube(RollupCube(str(cube_file)), query_type=query_type)
+        ReportRenderer(out_dir, max_workers=max_workers).render(specs)
+
+    def run_lifecycle(
+        self,
+        query_type: str = "issue",
+        label: str = "*",
+    ):
+        assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
+        file_path = f"Results/{self.repo_path.split('/')[-1]}/all_{query_type}s.csv"
+        metrics = LifecycleMetrics(str(Path(file_path).parent / f"lifecycle_{query_type}s"))
+        metrics.refresh_from_csv(file_path)
+        metrics.save()
+        print("time to close (hours):")
+        print(metrics.latency_quantiles("close", label=label))
+        print("time to first response (hours):")
+        print(metrics.latency_quantiles("response", label=label))
+        print("open backlog (monthly):")
+        print(metrics.backlog(label=label, freq="ME").tail(12))
+
+    def run_features(
+        self,
+        query_type: str = "issue",
+        source: str = "all",
+        n_features: int = 2 ** 20,
+        chunksize: int = 20000,
+    ):
+        # hashed bag-of-words of `{source}_{query_type}s.csv`, appended to `features_{query_type}s/` chunk by chunk
+        assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
+        file_path = f"Results/{self.repo_path.split('/')[-1]}/{source}_{query_type}s.csv"
+        store = featurize_csv(file_path, str(Path(file_path).parent / f"features_{query_type}s"),
+                              n_features=n_features, chunksize=chunksize)
+        print(f"{store.n_docs} docs x {store.n_features} features in {len(store.meta['chunks'])} chunks")
+
+    def run_similar_index(
+        self,
+        query_type: str = "issue",
+        rebuild: bool = False,
+    ):
+        # featurize the new items of every collected repo and insert them into the shared index
+        assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
+        stores = []
+        for file_path in sorted(Path("Results").glob(f"*/all_{query_type}s.csv")):
+            stores.append(featurize_csv(str(file_path), str(file_path.parent / f"features_{query_type}s")))
+        index = SimilarityIndex(f"Results/similar_{query_type}s")
+        if index.centroids is None or rebuild:
+            index.build(stores)
+        else:
+            print(f"inserted {index.update(stores)} new {query_type}s")
+        index.save()
+
+    def run_similar(
+        self,
+        query: str,
+        query_type: str = "issue",
+        top_k: int = 10,
+    ):
+        index = SimilarityIndex(f"Results/similar_{query_type}s")
+        start_time = time.time()
+        results = index.query([query], top_k=top_k)[0]
+        print(f"top {top_k} similar {query_type}s ({(time.time() - start_time) * 1000:.1f}ms):")
+        for result in results:
+            print(f"  {result['score']:.3f}  {result['key']}")
+
+    def run_topics(
+        self,
+        query_type: str = "issue",
+        n_topics: int = 20,
+        retrain: bool = False,
+    ):
+        # an existing model only folds in the issues it has not seen (e.g. after a delta sync)
+        assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
+        file_path = f"Results/{self.repo_path.split('/')[-1]}/cleaned_{query_type}s.csv"
+        model_path = Path(file_path).parent / f"lda_{query_type}s.joblib"
+        df = pd.read_csv(file_path)
+        texts = issue_texts(df)
+        keys = df["Link"] if "Link" in df.columns else None
+        if model_path.exists() and not retrain:
+            model = TopicModel.load(str(model_path))
+            model.fold_in(texts, keys)
+        else:
+            model = TopicModel(n_topics=n_topics).fit(texts, keys)
+        model.save(str(model_path))
+
+        df = model.assign_topics(df, texts)
+        df.to_csv(file_path, index=False)
+        for topic, words in enumerate(model.top_words(10)):
+            print(f"topic {topic}: {' '.join(words)}")
+
+    def _analysis_model(self, compress: bool = True, schema: str = None):
+        # the InferenceConfig and PromptBuilder of the `model` section of the config file; with a `schema` of
+        # `SCHEMAS`, outputs are constrained to it and the prompt asks for it
+        model_config = dict(self.config["model"])
+        template = model_config.pop("prompt_template")
+        budgets = model_config.pop("prompt_budgets", None)
+        prefix_first = model_config.pop("prompt_prefix_first", True)
+        config = resolve_config(model_config.pop("model_path"), **model_config)  # a path or a config name
+        if schema is not None:
+            assert schema in SCHEMAS, f"schema must be one of {list(SCHEMAS)} but got {schema}"
+            template = f"{template.rstrip()}\n{schema_instructions(SCHEMAS[schema])}\n"
+            config = replace(config, json_schema=SCHEMAS[schema], max_tokens=schema_max_tokens(SCHEMAS[schema]))
+        builder = PromptBuilder(template, budgets=budgets, tokenizer=load_tokenizer(config.model_path),
+                                compressor=LogCompressor() if compress else None, prefix_first=prefix_first)
+        return config, builder
+
+    def run_analysis(
+        self,
+        query_type: str = "issue",
+        source: str = "cleaned",
+        engine: str = None,
+        isolate: bool = False,
+        batch_size: int = None,
+        restart: bool = False,
+        cache: bool = True,
+        cache_size_mb: float = 1024,
+        compress: bool = True,
+        triage: str = None,
+        threshold: float = 0.5,
+        schema: str = None,
+    ):
+        # `model.prompt_template` of every row of `cleaned_{query_type}s.csv`, written to
+        # `{source}_{query_type}s_analysis.csv` (`..._analysis_{schema}.csv` with a `schema`); finished rows are
+        # checkpointed next to it, so an interrupted run continues where it stopped (`--restart True` to start from
+        # scratch).
+        # Outputs are also cached across runs and repos in `Results/llm_cache.sqlite`, keyed by model, sampling
+        # parameters and rendered prompt, so re-running after changing the filters only generates new issues.
+        # `compress` collapses repeated log lines, duplicate stack frames and environment dumps of the code (the bodies
+        # are compressed by `run_collection`, before their lines are flattened).
+        # `engine` overrides `model.engine`; `openai` sends the prompts to the server at `model.api_base` instead.
+        # `fake` is a dry run: its outputs are not cached and are written to `Results/<repo>/fake/`, away from the
+        # results (and checkpoints) of real models.
+        # With `model.data_parallel_size` > 1 every replica runs in a worker process, whatever `isolate`.
+        # `triage` ("keyword", or a small model config/path such as "qwen_small") scores the relevance of every row
+        # first, and only the rows scoring at least `threshold` are analyzed by the model.
+        # `source` "sampled" analyzes the sample of `run_sampling` instead, keeping its strata and weights.
+        # `schema` ("memory") constrains the outputs to the JSON schema of `structured.SCHEMAS` and writes every
+        # field to its own column
+        assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
+        file_path = f"Results/{self.repo_path.split('/')[-1]}/{source}_{query_type}s.csv"
+        config, builder = self._analysis_model(compress, schema)
+        engine = engine or config.engine
+        assert engine in ENGINES, f"engine must be one of {list(ENGINES)} but got {engine}"
+        out_dir = Path(file_path).parent
+        if engine == "fake":  # fake outputs must never be served to (or resumed by) runs of real models
+            cache = False
+            out_dir = out_dir / "fake"
+            out_dir.mkdir(exist_ok=True)
+
+        def make_engine(engine_config):
+            if engine_config.data_parallel_size > 1:  # one worker process per replica
+                return DataParallelEngine(ENGINES[engine]())
+            return SubprocessEngine(ENGINES[engine]()) if isolate else ENGINES[engine]()
+
+        result_cache = ResultCache("Results/llm_cache.sqlite", max_size_mb=cache_size_mb) if cache else None
+        llm = make_engine(config)
+        try:
+            relevance = None
+            if triage is not None:
+                if triage == "keyword":
+                    scorer = KeywordScorer()
+                else:
+                    triage_config = resolve_config(triage, max_tokens=TRIAGE_MAX_TOKENS, temperature=0.0,
+                                                   system_content=None)
+                    scorer = LLMScorer(make_engine(triage_config), triage_config, cache=result_cache)
+                try:
+                    # scores of another scorer or query type are not reused
+                    scorer_name = re.sub(r"[^\w.-]", "_", triage)  # a config name or model path
+                    triage_file = out_dir / f"triage_{query_type}s_{scorer_name}.jsonl"
+                    relevance = triage_csv(file_path, str(triage_file), scorer, restart=restart)
+                finally:
+                    scorer.close()  # release the small model before the analysis model is loaded
+            out_file = f"{source}_{query_type}s_analysis{f'_{schema}' if schema else ''}.csv"
+            results = analyze_csv(file_path, str(out_dir / out_file), llm, config,
+                                  builder, keep_cols=("Title", STRATUM_COL, WEIGHT_COL), batch_size=batch_size,
+                                  restart=restart, cache=result_cache, relevance=relevance, threshold=threshold)
+        finally:
+            llm.close()
+            if result_cache is not None:
+                result_cache.close()
+        print(f"{len(results)} {query_type}s analyzed")
 
-    def run_analysis(self):
-        pass
+    def run_benchmark(
+        self,
+        query_type: str = "issue",
+        engines: Union[List[str], str] = "fake",
+        configs: Union[List[str], str] = None,
+        n_prompts: int = 200,
+        seed: int = 0,
+        resample: bool = False,
+        batch_size: int = None,
+        repeats: int = 2,
+        isolate: bool = False,
+        cache: bool = False,
+    ):
+        # replays a fixed prompt set (`n_prompts` issues of `cleaned_{query_type}s.csv` sampled with `seed`, rendered
+        # like `run_analysis` and saved to `benchmark_prompts_{query_type}s.json` on first use) through every engine
+        # and config (all ConfigManager configs by default); the report is written to `benchmark_{query_type}s.json`.
+        # The `fake` engine needs no GPU and measures the overhead of batching, caching and (`isolate`) worker I/O
+        assert query_type in ["issue", "PR"], f"query_type must be 'query' or 'issues' but got {query_type}"
+        file_path = f"Results/{self.repo_path.split('/')[-1]}/cleaned_{query_type}s.csv"
+        prompt_file = Path(file_path).parent / f"benchmark_prompts_{query_type}s.json"
+        if prompt_file.exists() and not resample:
+            prompts = load_prompt_set(str(prompt_file))
+        else:
+            _, builder = self._analysis_model()
+            prompts = sample_prompt_set(file_path, str(prompt_file), builder, n=n_prompts, seed=seed)
+        if isinstance(engines, str):
+            engines = engines.split(",")
+        if configs is None:
+            configs = list(config_manager.list_configs())
+        elif isinstance(configs, str):
+            configs = configs.split(",")
+        report = benchmark_suite(prompts, engines, configs, str(Path(file_path).parent / f"benchmark_{query_type}s.json"),
+                                 batch_size=batch_size, repeats=repeats, isolate=isolate, cache=cache)
+        for result in report["results"]:
+            if "error" in result:
+                print(f"{result['engine']:8} {result['config']:15} failed: {result['error']}")
+            else:
+                print(f"{result['engine']:8} {result['config']:15} {result['throughput_requests_per_s']:10.1f} req/s  "
+                      f"p50 {result['latency_s']['p50']:.3f}s  p99 {result['latency_s']['p99']:.3f}s")
 
 
 if __name__ == "__main__":
@@ -2,4 +2,241 @@ import unittest
 from unittest.mock import patch, mock_open, MagicMock
 from gpit.processors.collecter import IssueCollector
 import csv
-import time
\ No newline at end of file
+import time
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from gpit.analyzer.LDA.lda import Model
+from gpit.analyzer.features import FeatureStore, featurize_csv
+from gpit.analyzer.similarity import SimilarityIndex
+from gpit.analyzer.LLM.analysis import analyze_csv, render_prompts
+from gpit.analyzer.LLM.cascade import KeywordScorer, LLMScorer, parse_score, triage_csv
+from gpit.analyzer.LLM.engines import Engine, FakeEngine
+from gpit.analyzer.LLM.structured import MEMORY_SCHEMA
+from gpit.analyzer.LLM.inference_config import InferenceConfig
+
+
+class PromptEchoEngine(Engine):
+    def load(self, config):
+        self.config = config
+        self.generated = []
+
+    def generate(self, prompts, temperature, top_p, repetition_penalty, max_tokens, system_content=None):
+        if "bad" in prompts:
+            raise ValueError("bad prompt")
+        self.generated.extend(prompts)
+        return [f"analysis of {prompt}" for prompt in prompts]
+
+
+class TestTopicModel(unittest.TestCase):
+    def setUp(self):
+        memory = "cuda memory leak allocator oom gpu cache fragmentation".split()
+        build = "cmake build fails linker error compile wheel toolchain".split()
+        self.memory = [" ".join(memory[i % 4:i % 4 + 5]) for i in range(20)]
+        self.build = [" ".join(build[i % 4:i % 4 + 5]) for i in range(20)]
+
+    def test_fit_fold_in_and_assign(self):
+        model = Model(n_topics=2, min_df=1, max_df=1.0, batch_size=8, max_iter=20, n_jobs=1)
+        model.fit(self.memory + self.build, keys=range(40))
+        self.assertEqual(model.fold_in(self.memory[:5], keys=range(5)), 0)  # already seen
+        self.assertEqual(model.fold_in(["gpu oom memory cuda"], keys=[40]), 1)
+
+        df = model.assign_topics(pd.DataFrame({"Title": ["a", "b"]}), [self.memory[0], self.build[0]])
+        self.assertEqual(list(df.columns), ["Title", "Topic", "TopicScore", "TopicWords"])
+        self.assertNotEqual(df["Topic"][0], df["Topic"][1])
+        self.assertIn("gpu", df["TopicWords"][0])
+
+
+class TestFeatureStore(unittest.TestCase):
+    def test_featurize_incrementally(self):
+        df = pd.DataFrame({"Title": ["cuda oom", "build fails", "cuda memory leak"],
+                           "Body": ["out of memory on gpu", None, "allocator leak"],
+                           "Link": ["l1", "l2", "l3"]})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file, store_path = os.path.join(temp_dir, "all_issues.csv"), os.path.join(temp_dir, "features")
+            df.iloc[:2].to_csv(file, index=False)
+            featurize_csv(file, store_path, n_features=2 ** 12, chunksize=1)
+            df.to_csv(file, index=False)
+            featurize_csv(file, store_path, n_features=2 ** 12, chunksize=2)
+
+            store = FeatureStore(store_path)
+            self.assertEqual(store.keys, ["l1", "l2", "l3"])
+            self.assertEqual(store.meta["chunks"], [1, 1, 1])
+            self.assertEqual(store.doc_freq.sum(), store.matrix().nnz)
+            similarity = (store.matrix(tfidf=True) @ store.matrix(tfidf=True).T).toarray()
+            self.assertAlmostEqual(similarity[0, 0], 1, places=5)
+            self.assertGreater(similarity[0, 2], similarity[0, 1])
+
+    def test_interrupted_append(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = FeatureStore(os.path.join(temp_dir, "features"), n_features=8)
+            store.append(sp.csr_matrix(np.eye(2, 8)), ["l1", "l2"])
+            with patch("gpit.analyzer.features.os.replace", side_effect=OSError("crash")):
+                with self.assertRaises(OSError):  # crash before meta.json is committed
+                    store.append(sp.csr_matrix(np.eye(1, 8)), ["l3"])
+            self.assertEqual((store.n_docs, store.keys, store.doc_freq.sum()), (2, ["l1", "l2"], 2))  # in memory
+            reloaded = FeatureStore(os.path.join(temp_dir, "features"))
+            self.assertEqual((reloaded.n_docs, reloaded.keys), (2, ["l1", "l2"]))
+            self.assertEqual(reloaded.doc_freq.sum(), 2)
+            with patch("gpit.analyzer.features.os.replace", side_effect=OSError("crash")):
+                with self.assertRaises(OSError):
+                    store.append(sp.csr_matrix(np.eye(1, 8)), ["l3"])
+            store.append(sp.csr_matrix(np.eye(1, 8)), ["l4"])  # the store that failed writes over the failed keys
+            store = FeatureStore(os.path.join(temp_dir, "features"))
+            self.assertEqual(store.keys, ["l1", "l2", "l4"])
+            self.assertEqual(store.matrix().shape, (3, 8))
+
+
+class TestSimilarityIndex(unittest.TestCase):
+    def test_build_update_and_query(self):
+        topics = [["cuda", "memory", "oom", "allocator", "gpu", "leak"], ["cmake", "linker", "build", "wheel", "compile", "toolchain"],
+                  ["nan", "loss", "gradient", "optimizer", "diverge", "amp"]]
+        df = pd.DataFrame({"Title": [" ".join(topics[i % 3][i % 2:i % 2 + 3]) for i in range(60)],
+                           "Body": [" ".join(topics[i % 3][(i + 1) % 3:]) for i in range(60)],
+                           "Link": [f"l{i}" for i in range(60)]})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file = os.path.join(temp_dir, "all_issues.csv")
+            df.iloc[:45].to_csv(file, index=False)
+            store = featurize_csv(file, os.path.join(temp_dir, "features"), n_features=2 ** 12)
+            SimilarityIndex(os.path.join(temp_dir, "index"), dim=8, nprobe=2).build([store], n_cells=3).save()
+
+            df.to_csv(file, index=False)
+            store = featurize_csv(file, os.path.join(temp_dir, "features"), n_features=2 ** 12)
+            index = SimilarityIndex(os.path.join(temp_dir, "index"))
+            self.assertEqual(index.update([store]), 15)
+            self.assertEqual(index.update([store]), 0)
+
+            results = index.query(["gpu oom in the cuda allocator"], top_k=5)[0]
+            self.assertEqual(len(results), 5)
+            self.assertTrue(all(int(result["key"][1:]) % 3 == 0 for result in results))
+
+
+class ScoreEngine(Engine):
+    def load(self, config):
+        self.config = config
+
+    def generate(self, prompts, temperature, top_p, repetition_penalty, max_tokens, system_content=None):
+        if any("typo" in prompt for prompt in prompts):
+            raise ValueError("bad prompt")
+        return ["<think>\n\n</think>\n\n9" if "oom" in prompt else "2/10" for prompt in prompts]
+
+
+class TestAnalysis(unittest.TestCase):
+    def test_render_prompts(self):
+        df = pd.DataFrame({"Title": ['a "quoted" {title}'], "Body": [None]})
+        self.assertEqual(render_prompts(df, "{title} / {body}"), ['a "quoted" {title} / nan'])
+        with self.assertRaises(ValueError):
+            render_prompts(df, "{code}")
+
+    def test_resume_from_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file, out_file = os.path.join(tmp, "cleaned_issues.csv"), os.path.join(tmp, "analyzer_results.csv")
+            links = [f"https://github.com/o/r/issues/{i}" for i in range(10)]
+            pd.DataFrame({"Title": [f"t{i}" for i in range(10)], "Link": links}).to_csv(file, index=False)
+            config = InferenceConfig(model_path="test/model")
+
+            engine = PromptEchoEngine()
+            analyze_csv(file, out_file, engine, config, "{title}", batch_size=4, chunksize=3)
+            self.assertEqual(len(engine.generated), 10)
+            # interrupted run: the run key, 6 finished rows and a torn line
+            checkpoint = os.path.join(tmp, "analyzer_results.jsonl")
+            with open(checkpoint, "r", encoding="utf-8") as f:
+                lines = f.readlines()[:7]
+            with open(checkpoint, "w", encoding="utf-8") as f:
+                f.writelines(lines + ['{"Link": "https://github.com/o/r/is'])
+
+            engine = PromptEchoEngine()
+            results = analyze_csv(file, out_file, engine, config, "{title}", batch_size=4, chunksize=3)
+            self.assertEqual(engine.generated, [f"t{i}" for i in range(6, 10)])
+            self.assertEqual(list(results["Link"]), links)
+            self.assertEqual(list(pd.read_csv(out_file)["Analysis"]), [f"analysis of t{i}" for i in range(10)])
+
+            engine = PromptEchoEngine()
+            analyze_csv(file, out_file, engine, config, "{title}", restart=True)
+            self.assertEqual(len(engine.generated), 10)
+
+            # another model or template does not resume the checkpoint of this one
+            for other_config, template in [(InferenceConfig(model_path="test/other"), "{title}"), (config, "{title}!")]:
+                engine = PromptEchoEngine()
+                analyze_csv(file, out_file, engine, other_config, template, batch_size=4)
+                self.assertEqual(len(engine.generated), 10)
+            engine = PromptEchoEngine()
+            analyze_csv(file, out_file, engine, config, "{title}!", batch_size=4)
+            self.assertFalse(engine.loaded)  # the same run again: every row is resumed
+
+            # rows removed from the csv are not exported from the checkpoint
+            pd.DataFrame({"Title": ["t9", "t3"], "Link": [links[9], links[3]]}).to_csv(file, index=False)
+            results = analyze_csv(file, out_file, PromptEchoEngine(), config, "{title}")
+            self.assertEqual(list(results["Link"]), [links[9], links[3]])
+
+    def test_dead_letter(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file, out_file = os.path.join(tmp, "cleaned_issues.csv"), os.path.join(tmp, "analyzer_results.csv")
+            titles = ["t0", "t1", "bad", "t3", "t4"]
+            pd.DataFrame({"Title": titles, "Link": [f"l{i}" for i in range(5)]}).to_csv(file, index=False)
+            config = InferenceConfig(model_path="test/model")
+
+            engine = PromptEchoEngine()
+            results = analyze_csv(file, out_file, engine, config, "{title}", batch_size=4)
+            self.assertEqual(sorted(engine.generated), ["t0", "t1", "t3", "t4"])
+            self.assertEqual(list(results["Link"]), [f"l{i}" for i in range(5)])
+            self.assertEqual(list(results["Analysis"].isna()), [False, False, True, False, False])
+            dead_letter = pd.read_json(os.path.join(tmp, "analyzer_results_failed.jsonl"), lines=True)
+            self.assertEqual(list(dead_letter["Link"]), ["l2"])
+            self.assertIn("bad prompt", dead_letter["error"][0])
+
+            engine = PromptEchoEngine()  # failed rows are not checkpointed: the next run tries them again
+            analyze_csv(file, out_file, engine, config, "{title}", batch_size=4)
+            self.assertEqual(engine.generated, [])
+            self.assertEqual(len(pd.read_json(os.path.join(tmp, "analyzer_results_failed.jsonl"), lines=True)), 2)
+
+    def test_structured_columns(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            file, out_file = os.path.join(tmp, "cleaned_issues.csv"), os.path.join(tmp, "analyzer_results.csv")
+            pd.DataFrame({"Title": [f"t{i}" for i in range(6)], "Link": [f"l{i}" for i in range(6)]}).to_csv(
+                file, index=False)
+            config = InferenceConfig(model_path="test/model", json_schema=MEMORY_SCHEMA)
+            results = analyze_csv(file, out_file, FakeEngine(), config, "{title}")
+            self.assertEqual(list(results.columns), ["Link", "Title", "Analysis", "MemoryRelated", "Category", "Device",
+                                                     "Symptom", "Solution", "Confidence", "TokensSaved"])
+            self.assertEqual(str(results["MemoryRelated"].dtype), "boolean")
+            self.assertEqual(str(results["Confidence"].dtype), "Int64")
+            self.assertTrue(results["Category"].isin(MEMORY_SCHEMA["properties"]["category"]["enum"]).all())
+            self.assertTrue(results["Confidence"].between(0, 10).all())
+
+    def test_cascade(self):
+        self.assertEqual(parse_score("<think>\nmaybe 3\n</think>\n\n7"), 0.7)
+        self.assertIsNone(parse_score("<think>\n5 ..."))
+        scorer = KeywordScorer()
+        self.assertEqual(scorer.score("build fails in the zoom room"), 0.0)
+        self.assertGreater(scorer.score("CUDA out of memory"), 0.5)
+        with tempfile.TemporaryDirectory() as tmp:
+            file, out_file = os.path.join(tmp, "cleaned_issues.csv"), os.path.join(tmp, "analyzer_results.csv")
+            titles = ["oom in backward", "linker error", "memory leak in allocator", "docs typo", "oom again"]
+            links = [f"https://github.com/o/r/issues/{i}" for i in range(5)]
+            pd.DataFrame({"Title": titles, "Body": [None] * 5, "Link": links}).to_csv(file, index=False)
+            config = InferenceConfig(model_path="test/model")
+
+            relevance = triage_csv(file, os.path.join(tmp, "triage.jsonl"), scorer)
+            self.assertEqual(list(relevance.index), links)
+            engine = PromptEchoEngine()
+            results = analyze_csv(file, out_file, engine, config, "{title}", relevance=relevance, threshold=0.5)
+            self.assertEqual(sorted(engine.generated), ["memory leak in allocator", "oom again", "oom in backward"])
+            self.assertEqual(list(results["Link"]), links)
+            self.assertEqual(list(results["Analysis"].isna()), [False, True, False, True, False])
+
+            # a lower threshold only generates the newly escalated rows
+            engine = PromptEchoEngine()
+            analyze_csv(file, out_file, engine, config, "{title}", relevance=relevance.clip(lower=0.3), threshold=0.3)
+            self.assertEqual(sorted(engine.generated), ["docs typo", "linker error"])
+
+            scorer = LLMScorer(ScoreEngine(), config)
+            relevance = triage_csv(file, os.path.join(tmp, "triage.jsonl"), scorer, restart=True)
+            self.assertEqual(list(relevance.loc[links]), [0.9, 0.2, 0.2, 1.0, 0.9])  # the failed row is escalated
+            self.assertEqual(len(pd.read_json(os.path.join(tmp, "triage.jsonl"), lines=True)), 4)  # and not saved
+
+
+if __name__ == '__main__':
+    unittest.main()
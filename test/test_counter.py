@@ -0,0 +1,107 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from gpit.processors.cube import RollupCube
+from gpit.processors.topk import stream_top_k, top_k_positions
+
+
+def make_items(rows):
+    return pd.DataFrame(rows, columns=["Title", "Body", "Code", "CreatedDate", "Tags", "State", "Reactions",
+                                       "Comments", "Link"])
+
+
+ITEMS = make_items([
+    ["a", "", "", "2023-01-05T10:00:00Z", "bug, memory", "OPEN", 3, 1, "https://github.com/pytorch/pytorch/issues/1"],
+    ["b", "", "", "2023-02-05T10:00:00Z", "bug", "CLOSED", 0, 4, "https://github.com/pytorch/pytorch/issues/2"],
+    ["c", "", "", "2024-03-05T10:00:00Z", None, "CLOSED", 1, 0, "https://github.com/vllm-project/vllm/issues/3"],
+])
+
+
+class TestRollupCube(unittest.TestCase):
+    def test_rollups(self):
+        cube = RollupCube.from_frame(ITEMS)
+        self.assertEqual(cube.totals(), {"count": 3, "reactions": 4, "comments": 5})
+        by_year = cube.query(by="year")
+        self.assertEqual(by_year.loc[2023, "count"], 2)
+        self.assertEqual(by_year.loc[2024, "reactions"], 1)
+        by_label = cube.query(by="label", repo="pytorch/pytorch")
+        self.assertEqual(by_label.loc["bug", "count"], 2)
+        self.assertEqual(by_label.loc["memory", "comments"], 1)
+        self.assertEqual(cube.query(by="state", label="bug").loc["CLOSED", "count"], 1)
+        with self.assertRaises(ValueError):
+            cube.query(by="author")
+
+    def test_incremental_update_and_persistence(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cube_file = os.path.join(temp_dir, "cube_issues.csv")
+            cube = RollupCube(cube_file)
+            self.assertEqual(cube.update(ITEMS.iloc[:2]), 2)
+            cube.save()
+
+            reloaded = RollupCube(cube_file)
+            self.assertEqual(reloaded.update(ITEMS), 1)  # only the unseen item is folded in
+            self.assertEqual(reloaded.totals(), RollupCube.from_frame(ITEMS).totals())
+
+    def test_changed_items_are_refolded(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cube_file = os.path.join(temp_dir, "cube_issues.csv")
+            cube = RollupCube(cube_file)
+            cube.update(ITEMS)
+            cube.save()
+
+            changed = ITEMS.copy()
+            changed.loc[0, ["State", "Reactions", "Tags"]] = ["CLOSED", 5, "bug"]
+            reloaded = RollupCube(cube_file)
+            self.assertEqual(reloaded.update(ITEMS), 0)
+            self.assertEqual(reloaded.update(changed), 1)  # only the changed item is refolded
+            self.assertEqual(reloaded.query(by="state").loc["CLOSED", "count"], 3)
+            self.assertNotIn("OPEN", reloaded.query(by="state").index)
+            self.assertNotIn("memory", reloaded.query(by="label").index)
+            pd.testing.assert_frame_equal(reloaded.cells.sort_values(["repo", "year", "month", "state", "label"])
+                                          .reset_index(drop=True), RollupCube.from_frame(changed).cells)
+
+
+class TestTopK(unittest.TestCase):
+    def test_top_k_positions(self):
+        scores = np.array([0.5, 3.0, 1.0, 3.0, 2.0])
+        self.assertEqual(top_k_positions(scores, 3).tolist(), [1, 3, 4])
+        self.assertEqual(top_k_positions(scores, 10).tolist(), [1, 3, 4, 2, 0])
+
+    def test_streaming_matches_full_sort(self):
+        rng = np.random.default_rng(0)
+        df = make_items([["t", "", "", f"{2020 + i % 3}-01-01T00:00:00Z", "bug" if i % 2 else "bug, memory", "OPEN",
+                          int(r), int(c), f"https://github.com/a/b/issues/{i}"]
+                         for i, (r, c) in enumerate(rng.integers(0, 100, size=(500, 2)))])
+        weights = {"Reactions": 2.0, "Comments": 1.0}
+        expected = (df.assign(key=df["Reactions"] * 2 + df["Comments"])
+                    .sort_values("key", ascending=False, kind="stable").head(20)["key"].tolist())
+
+        chunks = [df.iloc[i:i + 64] for i in range(0, len(df), 64)]
+        ranked = stream_top_k(chunks, weights, 20)
+        self.assertEqual((ranked["Reactions"] * 2 + ranked["Comments"]).tolist(), expected)
+
+        per_label = stream_top_k(chunks, weights, 5, group_by="label")
+        self.assertEqual(set(per_label), {"bug", "memory"})
+        memory = df[df["Tags"].str.contains("memory")]
+        self.assertEqual(per_label["memory"]["Reactions"].iloc[0] * 2 + per_label["memory"]["Comments"].iloc[0],
+                         (memory["Reactions"] * 2 + memory["Comments"]).max())
+        self.assertEqual(set(stream_top_k(chunks, weights, 5, group_by="year")), {2020, 2021, 2022})
+
+    def test_ties_are_ranked_by_position(self):
+        self.assertEqual(top_k_positions(np.array([1.0, 2.0, 1.0, 1.0, 1.0]), 3).tolist(), [1, 0, 2])
+        df = make_items([["t", "", "", "2023-01-01T00:00:00Z", "bug", "OPEN", 1 if i % 5 else 2, 0,
+                          f"https://github.com/a/b/issues/{i}"] for i in range(40)])
+        expected = df.iloc[np.argsort(-df["Reactions"].to_numpy(), kind="stable")[:12]]["Link"].tolist()
+        for size in (3, 7, 40):  # equal scores across chunk boundaries
+            chunks = [df.iloc[i:i + size] for i in range(0, len(df), size)]
+            self.assertEqual(stream_top_k(chunks, {"Reactions": 1.0}, 12)["Link"].tolist(), expected)
+            self.assertEqual(stream_top_k(chunks, {"Reactions": 1.0}, 12, group_by="label")["bug"]["Link"].tolist(),
+                             expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from gpit.processors.dedup import MinHashLSH, dedup_csv
+
+
+BODY = "RuntimeError CUDA out of memory when calling backward on a large batch with mixed precision enabled"
+
+
+class TestMinHashLSH(unittest.TestCase):
+    def test_clusters_near_duplicates(self):
+        index = MinHashLSH(threshold=0.5)
+        index.add(["a", "b"], [BODY, "Build fails with cmake 3.30 because the linker cannot find libcuda"])
+        self.assertEqual(index.add(["c", "a"], [BODY + " again", BODY]), 1)  # `a` is indexed already
+        self.assertEqual(index.clusters(), {"a": "a", "b": "b", "c": "a"})
+
+    def test_dedup_csv_is_incremental(self):
+        df = pd.DataFrame({"Title": ["OOM", "Linker error", "OOM"],
+                           "Body": [BODY, "Build fails with cmake", BODY],
+                           "Link": ["l1", "l2", "l3"]})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file, index_path = os.path.join(temp_dir, "all_issues.csv"), os.path.join(temp_dir, "minhash.pkl")
+            df.iloc[:2].to_csv(file, index=False)
+            dedup_csv(file, index_path)
+            df.to_csv(file, index=False)
+            clusters = dedup_csv(file, index_path)
+            self.assertEqual(clusters.tolist(), ["l1", "l2", "l1"])
+            self.assertEqual(len(MinHashLSH.load(index_path).keys), 3)
+
+    def test_shared_index(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            index_path = os.path.join(temp_dir, "minhash.pkl")
+            repo_a, repo_b = os.path.join(temp_dir, "a.csv"), os.path.join(temp_dir, "b.csv")
+            pd.DataFrame({"Title": ["OOM"], "Body": [BODY], "Link": ["a/1"]}).to_csv(repo_a, index=False)
+            pd.DataFrame({"Title": ["OOM", "Docs"], "Body": [BODY + " again", "Fix a typo in the install guide"],
+                          "Link": ["b/1", "b/2"]}).to_csv(repo_b, index=False)
+            dedup_csv(repo_a, index_path, threshold=0.5)
+            self.assertEqual(dedup_csv(repo_b, index_path, threshold=0.5).tolist(), ["a/1", "b/2"])  # across repos
+            # a stricter threshold re-clusters the stored signatures
+            self.assertEqual(dedup_csv(repo_b, index_path, threshold=0.99).tolist(), ["b/1", "b/2"])
+            self.assertEqual(MinHashLSH.load(index_path).threshold, 0.99)
+            with self.assertRaises(ValueError):
+                dedup_csv(repo_b, index_path, threshold=0.99, num_perm=64)
+
+
+if __name__ == '__main__':
+    unittest.main()
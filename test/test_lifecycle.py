@@ -0,0 +1,83 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from gpit.processors.lifecycle import LifecycleMetrics, histogram_quantiles, LATENCY_EDGES
+from gpit.utils.utils import get_first_response
+
+
+COLS = ["CreatedDate", "Tags", "State", "Link", "ClosedDate", "FirstResponseDate"]
+ITEMS = pd.DataFrame([
+    ["2023-01-01T00:00:00Z", "bug", "CLOSED", "https://github.com/a/b/issues/1", "2023-01-03T00:00:00Z", "2023-01-01T02:00:00Z"],
+    ["2023-01-02T00:00:00Z", None, "OPEN", "https://github.com/a/b/issues/2", None, None],
+    ["2023-01-05T00:00:00Z", "bug, memory", "OPEN", "https://github.com/a/b/issues/3", None, "2023-01-06T00:00:00Z"],
+], columns=COLS)
+
+
+class TestLifecycleMetrics(unittest.TestCase):
+    def test_histogram_quantiles(self):
+        counts = np.zeros(len(LATENCY_EDGES) - 1, dtype="int64")
+        counts[3] = 10  # every latency falls between 1h and 2h
+        self.assertTrue(np.all((histogram_quantiles(counts, [0.1, 0.5, 0.9]) >= 1) &
+                               (histogram_quantiles(counts, [0.1, 0.5, 0.9]) <= 2)))
+
+    def test_incremental_refresh(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            prefix = os.path.join(temp_dir, "lifecycle_issues")
+            metrics = LifecycleMetrics(prefix)
+            self.assertEqual(metrics.refresh(ITEMS), 3)
+            metrics.save()
+
+            metrics = LifecycleMetrics(prefix)
+            self.assertEqual(metrics.refresh(ITEMS), 0)  # nothing happened since the last refresh
+            later = ITEMS.copy()
+            later.loc[1, ["State", "ClosedDate"]] = ["CLOSED", "2023-01-10T00:00:00Z"]
+            self.assertEqual(metrics.refresh(later), 1)
+
+            backlog = metrics.backlog()
+            self.assertEqual(backlog[pd.Timestamp("2023-01-05")], 2)
+            self.assertEqual(backlog.iloc[-1], 1)
+            self.assertEqual(metrics.backlog(label="bug")[pd.Timestamp("2023-01-03")], 0)
+            self.assertEqual(metrics.latency_quantiles("close").loc["a/b", "n"], 2)
+            self.assertEqual(metrics.latency_quantiles("response", label="memory").loc["a/b", "n"], 1)
+            self.assertEqual(metrics.rolling("3D")["closed"].iloc[-1], 1)
+
+    def test_reopened_and_closed_again(self):
+        metrics = LifecycleMetrics()
+        metrics.refresh(ITEMS)
+        reopened = ITEMS.copy()
+        reopened.loc[0, ["State", "ClosedDate"]] = ["OPEN", None]
+        self.assertEqual(metrics.refresh(reopened), 1)
+        self.assertEqual(metrics.backlog().iloc[-1], 3)  # the close of issue 1 is retracted
+        self.assertEqual(metrics.backlog(label="bug")[pd.Timestamp("2023-01-03")], 1)
+        self.assertNotIn("close", set(metrics.latency["metric"]))
+
+        closed_again = ITEMS.copy()
+        closed_again.loc[0, "ClosedDate"] = "2023-01-08T00:00:00Z"
+        self.assertEqual(metrics.refresh(closed_again), 1)
+        backlog = metrics.backlog()
+        self.assertEqual(backlog[pd.Timestamp("2023-01-05")], 3)
+        self.assertEqual(backlog.iloc[-1], 2)
+        self.assertEqual(metrics.rolling("30D")["mean_close_hours"].iloc[-1], 7 * 24)
+        self.assertEqual(metrics.latency_quantiles("close").loc["a/b", "n"], 1)
+        self.assertEqual(metrics.refresh(closed_again), 0)
+
+    def test_first_response(self):
+        comments = [{"createdAt": "1", "author": {"login": "me", "__typename": "User"}},
+                    {"createdAt": "2", "author": {"login": "pytorch-bot", "__typename": "Bot"}},
+                    {"createdAt": "3", "author": None},
+                    {"createdAt": "4", "author": {"login": "maintainer", "__typename": "User"}}]
+        item = {"author": {"login": "me"}, "comments": {"nodes": comments}}
+        self.assertEqual(get_first_response(item), "3")  # a deleted account is a response
+        self.assertEqual(get_first_response({**item, "comments": {"nodes": comments[:2]}}), "")
+
+    def test_missing_columns(self):
+        with self.assertRaises(ValueError):
+            LifecycleMetrics().refresh(ITEMS.drop(columns=["ClosedDate"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
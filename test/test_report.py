@@ -0,0 +1,31 @@
+import os
+import tempfile
+import unittest
+
+from gpit.utils.report import ChartSpec, ReportRenderer, render_chart
+
+
+class TestReportRenderer(unittest.TestCase):
+    def test_skips_unchanged_charts(self):
+        specs = [ChartSpec(name=f"chart{i}", title=f"Chart {i}", x_label="Year", y_label="Counts",
+                           series={"OPEN": [[2023, 2024], [i, i + 1]]}) for i in range(3)]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            self.assertEqual(len(ReportRenderer(temp_dir, max_workers=2).render(specs)), 3)
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, "chart0.png")))
+
+            specs[1].series["OPEN"][1] = [5, 6]
+            rendered = ReportRenderer(temp_dir, max_workers=2).render(specs)
+            self.assertEqual(rendered, [os.path.join(temp_dir, "chart1.png")])
+
+    def test_keeps_the_backend_of_the_caller(self):
+        import matplotlib
+        backend = matplotlib.get_backend()
+        with tempfile.TemporaryDirectory() as temp_dir:
+            render_chart(ChartSpec(name="c", title="C", x_label="x", y_label="y", series={"s": [[1, 2], [3, 4]]}),
+                         os.path.join(temp_dir, "c.png"))
+            self.assertTrue(os.path.exists(os.path.join(temp_dir, "c.png")))
+        self.assertEqual(matplotlib.get_backend(), backend)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+
+from gpit.processors.sampler import StratifiedReservoir, estimate_counts, sample_csv, strata_keys
+
+
+def issues(n: int = 300) -> pd.DataFrame:
+    return pd.DataFrame({
+        "Title": [f"issue {i}" for i in range(n)],
+        "CreatedDate": [f"{2020 + i % 3}-05-01T10:00:00Z" for i in range(n)],
+        "Tags": ["module: cuda, high priority" if i % 5 == 0 else None for i in range(n)],
+        "State": ["OPEN" if i % 2 else "CLOSED" for i in range(n)],
+        "Link": [f"https://github.com/o/r/issues/{i}" for i in range(n)],
+    })
+
+
+class TestSampler(unittest.TestCase):
+    def test_strata_keys(self):
+        df = issues(5)
+        self.assertEqual(strata_keys(df).tolist()[:2], ["2020|module: cuda|CLOSED", "2021||OPEN"])
+        self.assertEqual(strata_keys(df, by=["state"]).tolist(), ["CLOSED", "OPEN", "CLOSED", "OPEN", "CLOSED"])
+
+    def test_deterministic_under_seed_and_chunking(self):
+        df = issues()
+        reservoir = StratifiedReservoir(size=10, sizes={"2020|module: cuda|CLOSED": 3}, seed=7)
+        reservoir.push(df)
+        sample = reservoir.result()
+        for chunksize in (1, 17, 100):
+            reservoir = StratifiedReservoir(size=10, sizes={"2020|module: cuda|CLOSED": 3}, seed=7)
+            for start in range(0, len(df), chunksize):
+                reservoir.push(df.iloc[start:start + chunksize])
+            pd.testing.assert_frame_equal(reservoir.result(), sample)
+        other = StratifiedReservoir(size=10, seed=8)
+        other.push(df)
+        self.assertNotEqual(other.result()["Link"].tolist(), sample["Link"].tolist())
+
+        sizes = sample.groupby("Stratum").size()
+        self.assertEqual(sizes["2020|module: cuda|CLOSED"], 3)
+        self.assertTrue((sizes.drop("2020|module: cuda|CLOSED") == 10).all())
+        self.assertEqual(list(sample.index), list(range(len(sample))))
+        self.assertTrue(sample["Link"].str.split("/").str[-1].astype(int).is_monotonic_increasing)  # input order
+        # the weights of every stratum add up to its population
+        population = strata_keys(df).value_counts()
+        weights = sample.groupby("Stratum")["SampleWeight"].sum()
+        pd.testing.assert_series_equal(weights.sort_index(), population.sort_index().astype(float),
+                                       check_names=False)
+
+    def test_sample_csv_and_estimates(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            file, out_file = os.path.join(temp_dir, "cleaned_issues.csv"), os.path.join(temp_dir, "sampled_issues.csv")
+            issues().to_csv(file, index=False)
+            sample = sample_csv(file, out_file, size=5, by=["year", "state"], chunksize=50)
+            self.assertEqual(len(sample), 30)
+            self.assertEqual(pd.read_csv(out_file)["Link"].tolist(), sample["Link"].tolist())
+            self.assertEqual(estimate_counts(sample, "State").to_dict(), {"CLOSED": 150.0, "OPEN": 150.0})
+
+
+if __name__ == '__main__':
+    unittest.main()